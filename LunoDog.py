@@ -5,6 +5,7 @@ import time
 
 from config import BOT_LOGGING_LEVEL
 from cli import CLILoggingHandler
+import cluster
 
 
 def run_here(command: str):
@@ -12,8 +13,15 @@ def run_here(command: str):
     return eval(command)
 
 # Have to initialize logger before importing modules if we want logging on start-up (registered commands, etc)
-cli = CLILoggingHandler(runner=run_here)
-logging.basicConfig(level=BOT_LOGGING_LEVEL, handlers=[cli])
+if cluster.WORKER_ID is None:
+    cli = CLILoggingHandler(runner=run_here)
+    logging.basicConfig(level=BOT_LOGGING_LEVEL, handlers=[cli])
+else:
+    # cluster workers share the supervisor terminal, there is no CLI for them
+    cli = None
+    logging.basicConfig(
+        level=BOT_LOGGING_LEVEL, format=f'[worker {cluster.WORKER_ID}] %(levelname)s %(name)s: %(message)s'
+    )
 
 from bot import bot
 from db import db
@@ -25,6 +33,7 @@ import api
 async def think():
     while bot.running:
         frame_time = time.time()
+        await db.think(frame_time)
         await bot.think(frame_time)
         await asyncio.sleep(1)
 
@@ -35,16 +44,20 @@ def main():
 
     loop.run_until_complete(db.connect(loop=loop))
     loop.run_until_complete(api.ApiServer.start())
+    if cluster.WORKER_ID is not None:
+        loop.run_until_complete(cluster.link.connect())
 
     loop.create_task(bot.serve())
     loop.create_task(think())
-    task = loop.create_task(cli.serve_cli(loop=loop))
+    # a cluster worker runs until the supervisor stops it with SIGINT
+    task = loop.create_task(cli.serve_cli(loop=loop)) if cli is not None else loop.create_future()
     try:
         loop.run_until_complete(asyncio.wait_for(task, timeout=None))
     except KeyboardInterrupt:
         logging.info('Keyboard interrupt received. Exiting...')
         loop.run_until_complete(bot.close())
         loop.run_until_complete(api.ApiServer.runner.cleanup())
+        loop.run_until_complete(cluster.link.close())
         print('Can exit now.')
 
 
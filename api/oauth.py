@@ -1,5 +1,4 @@
 import logging
-from aiohttp import ClientSession
 from time import time
 
 import config
@@ -63,20 +62,19 @@ async def _oauth_verify(oauth_code: str, redirect_uri: str, scopes: list[str]) -
     }
     headers = {'Content-Type': 'application/x-www-form-urlencoded'}
 
-    async with ClientSession() as session:
-        async with session.post(oauth2_uri, data=data, headers=headers) as resp:
-            # Response status should be 200 if oauth_code is legit
-            if resp.status != 200:
-                logger.error("API| Got invalid oauth2 code {}, got {} response code from discord api.".format(oauth_code,
-                                                                                                           resp.status))
-                raise ApiError(400, 'Bad Request', 'Failed to authenticate.')
+    async with bot.web.post(oauth2_uri, data=data, headers=headers) as resp:
+        # Response status should be 200 if oauth_code is legit
+        if resp.status != 200:
+            logger.error("API| Got invalid oauth2 code {}, got {} response code from discord api.".format(oauth_code,
+                                                                                                       resp.status))
+            raise ApiError(400, 'Bad Request', 'Failed to authenticate.')
 
-            oauth_data = await resp.json()
-            # Check the scopes are correct
-            if set(oauth_data['scope'].split(' ')) != set(scopes):
-                logger.error(
-                    "API| Invalid scope '{}' provided for oauth2 code '{}'".format(oauth_data['scope'], oauth_code))
-                raise ApiError(400, 'Bad Request', 'Invalid oauth2 scopes provided.')
+        oauth_data = await resp.json()
+        # Check the scopes are correct
+        if set(oauth_data['scope'].split(' ')) != set(scopes):
+            logger.error(
+                "API| Invalid scope '{}' provided for oauth2 code '{}'".format(oauth_data['scope'], oauth_code))
+            raise ApiError(400, 'Bad Request', 'Invalid oauth2 scopes provided.')
 
     # All good
     return oauth_data
@@ -93,14 +91,13 @@ async def _oauth_fetch_user(access_token) -> dict:
     """
 
     headers = {'Authorization': 'Bearer ' + access_token}
-    async with ClientSession() as session:
-        async with session.get(identify_uri, headers=headers) as resp:
-            if resp.status != 200:
-                logger.error(
-                    "API| Error fetching user identity for access_token '{}', got {} response code from discord api".format(
-                        access_token, resp.status))
-                raise ApiError(500, 'Discord API error', 'Error fetching user identity')
-            return await resp.json()
+    async with bot.web.get(identify_uri, headers=headers) as resp:
+        if resp.status != 200:
+            logger.error(
+                "API| Error fetching user identity for access_token '{}', got {} response code from discord api".format(
+                    access_token, resp.status))
+            raise ApiError(500, 'Discord API error', 'Error fetching user identity')
+        return await resp.json()
 
 
 def refresh_user(coro):
@@ -117,15 +114,14 @@ def refresh_user(coro):
         headers = {'Content-Type': 'application/x-www-form-urlencoded'}
         logger.info(data)
 
-        async with ClientSession() as session:
-            async with session.post('https://discord.com/api/v8/oauth2/token', data=data, headers=headers) as resp:
-                if resp.status != 200:
-                    logger.error(
-                        'API| got invalid oauth2 refresh_token \'{}\', got {} response code from discord api'.format(
-                            data['refresh_token'], resp.status
-                        ))
-                    raise ApiError(401, 'Bad Request', 'Failed to authenticate.')
-                oauth_data = await resp.json()
+        async with bot.web.post('https://discord.com/api/v8/oauth2/token', data=data, headers=headers) as resp:
+            if resp.status != 200:
+                logger.error(
+                    'API| got invalid oauth2 refresh_token \'{}\', got {} response code from discord api'.format(
+                        data['refresh_token'], resp.status
+                    ))
+                raise ApiError(401, 'Bad Request', 'Failed to authenticate.')
+            oauth_data = await resp.json()
 
         # Confirm the user_ids are matching
         if oauth_data['id'] != oauth_user['user_id']:
@@ -166,14 +162,13 @@ async def fetch_user_guilds(oauth_user: dict) -> list[int]:
     """
 
     headers = {'Authorization': 'Bearer ' + oauth_user['access_token']}
-    async with ClientSession() as session:
-        async with session.get(guilds_uri, headers=headers) as resp:
-            if resp.status != 200:
-                logger.error(
-                    f"API| Error fetching guilds list for access_token '{oauth_user['access_token']}', resp.code {resp.status}"
-                )
-                raise ApiError(500, 'Discord API error', 'Error fetching guild list.')
-            guilds_data = await resp.json()
+    async with bot.web.get(guilds_uri, headers=headers) as resp:
+        if resp.status != 200:
+            logger.error(
+                f"API| Error fetching guilds list for access_token '{oauth_user['access_token']}', resp.code {resp.status}"
+            )
+            raise ApiError(500, 'Discord API error', 'Error fetching guild list.')
+        guilds_data = await resp.json()
 
     await db.delete('oauth_user_guilds', {'user_id': oauth_user['user_id']})
     await db.insert_many(
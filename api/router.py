@@ -4,6 +4,7 @@ import traceback
 import json
 
 from config import API_NO_AUTH, BOT_OWNER_IDS
+from db import db_tag
 from bot import bot, Guild, Member, FakeMember
 from . import ApiServer, oauth, ApiError
 
@@ -18,6 +19,7 @@ class ApiRoute:
         Provide oauth_user if auth=True is passed.
         Provide discord.Member if get_member=True is passed.
         Restrict Members without guild administrator privileges from using protected routes.
+        Restrict users other than bot owners from using owner routes.
         Provide post json data as kwargs.
         Handle regular (ApiError) exceptions.
         Handle unexpected exceptions.
@@ -25,12 +27,13 @@ class ApiRoute:
 
     AdminFakeMember = FakeMember(user_id='0', username='admin')
 
-    def __init__(self, path, method='GET', auth=False, get_member=False, admin_route=False):
+    def __init__(self, path, method='GET', auth=False, get_member=False, admin_route=False, owner_route=False):
         self.path = path
         self.method = method
-        self.auth = auth or get_member or admin_route
+        self.auth = auth or get_member or admin_route or owner_route
         self.member = get_member
         self.admin_route = admin_route
+        self.owner_route = owner_route
 
     def __call__(self, coro):
         async def decorator(request):
@@ -48,12 +51,16 @@ class ApiRoute:
                             message="Please try again later...").web_response()
 
         # Prepare kwargs and run the function
+        db_tag.set('api')
         try:
             kwargs = await self.get_post_data(request) if self.method == 'POST' else dict(request.query)
 
             if self.auth:
                 kwargs['oauth_user'] = await self.get_oauth_user(request)
 
+            if self.owner_route and str(kwargs['oauth_user']['user_id']) not in BOT_OWNER_IDS:
+                raise ApiError(403, 'Missing permissions', 'Must be the bot owner.')
+
             if self.member or self.admin_route:
                 guild, member = await self.fetch_member(
                     oauth_user=kwargs.get('oauth_user'),
@@ -105,6 +112,9 @@ class ApiRoute:
             raise ApiError(400, 'Bad request', 'Server parameter is bad or missing.')
         if (guild := bot.guilds.get(guild_id)) is None:
             raise ApiError(400, 'Bad request', f'Server with id {guild_id} is not reachable.')
+        # the bot is ready, but the shard of the guild may be reconnecting or still receiving its guilds
+        if not bot.is_guild_available(guild_id):
+            raise ApiError(503, 'Server is unavailable', 'Please try again later...')
 
         if oauth_user['user_id'] == 0:
             return guild, ApiRoute.AdminFakeMember
@@ -2,6 +2,8 @@ from logging import getLogger
 from aiohttp.web import Request
 
 from config import BOT_OWNER_IDS
+from db import db
+from cache import caches
 from bot import bot, Guild, Member
 from . import ApiRoute, ApiError, api_success, oauth
 
@@ -65,7 +67,9 @@ async def get_guild_config(request: Request, oauth_user: dict, guild: Guild, mem
         'name': guild.name,
         'is_admin': guild.is_admin(member),
         'text_channels': [{'name': c.name, 'id': c.id} for c in guild.channels.values() if c.type == 0],
-        'roles': [{'name': r.name, 'id': r.id} for r in guild.roles.values()],
+        'roles': [
+            {'name': r.name, 'id': r.id, 'members': guild.count_role_members(r.id)} for r in guild.roles.values()
+        ],
         'config': guild.cfg.__dict__()
     })
 
@@ -81,6 +85,41 @@ async def update_guild_config(request: Request, oauth_user: dict, guild: Guild,
     return api_success()
 
 
+@ApiRoute('/stats/db', method='GET', owner_route=True)
+async def get_db_stats(request: Request, oauth_user: dict):
+    return api_success(db.pool_info())
+
+
+@ApiRoute('/stats/queries', method='GET', owner_route=True)
+async def get_query_stats(request: Request, oauth_user: dict, limit: str = '10'):
+    return api_success(db.query_info(limit=int(limit)))
+
+
+@ApiRoute('/stats/events', method='GET', owner_route=True)
+async def get_event_stats(request: Request, oauth_user: dict):
+    return api_success(bot.event_metrics.json())
+
+
+@ApiRoute('/stats/presences', method='GET', owner_route=True)
+async def get_presence_stats(request: Request, oauth_user: dict):
+    return api_success(bot.presence_stats.json())
+
+
+@ApiRoute('/stats/members', method='GET', owner_route=True)
+async def get_member_fetch_stats(request: Request, oauth_user: dict):
+    return api_success(bot.member_fetch_stats.json())
+
+
+@ApiRoute('/stats/hosts', method='GET', owner_route=True)
+async def get_web_client_stats(request: Request, oauth_user: dict):
+    return api_success(bot.web.json())
+
+
+@ApiRoute('/stats/caches', method='GET', owner_route=True)
+async def get_cache_stats(request: Request, oauth_user: dict):
+    return api_success({name: cache.json() for name, cache in caches.items()})
+
+
 @ApiRoute('/logout', method='GET', auth=True)
 async def logout(request: Request, oauth_user: dict):
     await oauth.delete_user(oauth_user)
@@ -6,6 +6,7 @@ from aiohttp_middlewares.cors import DEFAULT_ALLOW_HEADERS
 from aiohttp import web
 
 import config
+import cluster
 
 
 logger = logging.getLogger(__name__)
@@ -28,6 +29,12 @@ class ApiServer:
     @classmethod
     async def start(cls):
         await cls.runner.setup()
+        if cluster.WORKER_ID is not None:
+            # the cluster supervisor serves the public API and proxies requests to the workers
+            site = web.UnixSite(cls.runner, cluster.worker_api_socket(cluster.WORKER_ID))
+            await site.start()
+            logger.info(f'API| Serving at {cluster.worker_api_socket(cluster.WORKER_ID)}')
+            return
         site = web.TCPSite(cls.runner, config.API_HOST, config.API_PORT, ssl_context=cls.context)
         await site.start()
         logger.info(f'API| Serving at https://{config.API_HOST}:{config.API_PORT}')
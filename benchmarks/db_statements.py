@@ -0,0 +1,110 @@
+"""
+Micro-benchmark of the per-call python overhead of Database.insert on the member_stats insert path.
+Compares the statement building and debug logging before (rebuild + eager f-string) and after (memoized + lazy).
+The database connection is replaced with a no-op pool, so only the client side overhead is measured.
+
+Usage: python -m benchmarks.db_statements [iterations]
+"""
+import sys
+import asyncio
+import logging
+from time import perf_counter, time
+from typing import Iterable
+
+from db import Database
+
+logger = logging.getLogger('mysql')
+
+
+class NoopCursor:
+    lastrowid = 0
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+    async def execute(self, query, args=None):
+        pass
+
+
+class NoopConnection:
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+    def cursor(self):
+        return NoopCursor()
+
+
+class NoopPool:
+
+    async def acquire(self):
+        return NoopConnection()
+
+    async def release(self, conn):
+        pass
+
+
+class LegacyDatabase(Database):
+    """ Database.insert as it was before the statement cache """
+
+    async def execute(self, query, args=None) -> int:
+        async with self._connection() as conn:
+            async with conn.cursor() as cur:
+                logger.debug(f'{query} -- {args}')
+                await cur.execute(query, args)
+                return cur.lastrowid
+
+    @staticmethod
+    def _legacy_insert(table: str, keys: Iterable[str], on_conflict: str | None) -> str:
+        return {'ignore': 'INSERT IGNORE', 'replace': 'REPLACE', None: 'INSERT'}[on_conflict] + \
+               ' INTO `{}` ({}) VALUES ({})'.format(
+                   table,
+                   ', '.join([f'`{i}`' for i in keys]),
+                   ', '.join([f'%s' for _ in keys])
+               )
+
+    async def insert(self, table: str, row: dict, on_conflict=None) -> int:
+        return await self.execute(
+            query=self._legacy_insert(table, tuple(row.keys()), on_conflict), args=tuple(row.values())
+        )
+
+
+def message_row(n: int) -> dict:
+    return {
+        'guild_id': '200000000000000000',
+        'channel_id': '300000000000000000',
+        'user_id': '400000000000000000',
+        'message_id': str(500000000000000000 + n),
+        'reply_to_user': None,
+        'at': int(time())
+    }
+
+
+async def measure(database: Database, iterations: int) -> float:
+    """ Return average seconds per insert call """
+    database.pool = NoopPool()
+    rows = [message_row(n) for n in range(iterations)]
+    started_at = perf_counter()
+    for row in rows:
+        await database.insert('mbr_stats_messages', row)
+    return (perf_counter() - started_at) / iterations
+
+
+async def main(iterations: int):
+    logging.basicConfig(level=logging.INFO)  # debug logging is off, as in production
+    before = await measure(LegacyDatabase(), iterations)
+    after = await measure(Database(), iterations)
+    print(f'iterations: {iterations}')
+    print(f'before: {before * 1e6:.2f} us/call')
+    print(f'after:  {after * 1e6:.2f} us/call ({(1 - after / before) * 100:.1f}% less)')
+    print(f'statement cache: {Database.statement_cache_info()["insert"]}')
+
+
+if __name__ == '__main__':
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000))
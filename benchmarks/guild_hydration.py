@@ -0,0 +1,56 @@
+"""
+Event loop stall while a large GUILD_CREATE payload is turned into a bot.Guild.
+A ticker task measures how late the loop wakes it up, compares building the guild in a single pass (before)
+with the chunked Guild.hydrate() (after).
+Replays a recorded GUILD_CREATE payload (the event data as json) if a file is given, otherwise a synthetic one.
+
+Usage: python -m benchmarks.guild_hydration [members | payload.json]
+"""
+import sys
+import json
+import asyncio
+from pathlib import Path
+from time import perf_counter
+
+from bot import Guild
+from benchmarks.guild_memory import guild_create_payload
+
+TICK = 0.001
+
+
+async def ticker(stalls: list[float]):
+    while True:
+        started_at = perf_counter()
+        await asyncio.sleep(TICK)
+        stalls.append(perf_counter() - started_at - TICK)
+
+
+async def measure(payload: dict, chunk_size: int) -> tuple[float, float]:
+    """ Return max loop stall and total hydration time in seconds """
+    stalls = []
+    task = asyncio.create_task(ticker(stalls))
+    await asyncio.sleep(TICK * 2)
+    started_at = perf_counter()
+    guild = Guild(bot=None, guild_data=payload, cfg=None)
+    await guild.hydrate(payload, chunk_size=chunk_size)
+    total = perf_counter() - started_at
+    await asyncio.sleep(TICK * 2)
+    task.cancel()
+    return max(stalls), total
+
+
+async def main(source: str):
+    if Path(source).is_file():
+        payload = json.loads(Path(source).read_text())
+    else:
+        payload = json.loads(guild_create_payload(int(source)))
+    members = len(payload['members'])
+    before = await measure(payload, chunk_size=max(members, len(payload['presences']), 1))
+    after = await measure(payload, chunk_size=1000)
+    print(f'members: {members}')
+    print(f'before: max loop stall {before[0] * 1000:.1f} ms, hydrated in {before[1] * 1000:.1f} ms')
+    print(f'after:  max loop stall {after[0] * 1000:.1f} ms, hydrated in {after[1] * 1000:.1f} ms')
+
+
+if __name__ == '__main__':
+    asyncio.run(main(sys.argv[1] if len(sys.argv) > 1 else '100000'))
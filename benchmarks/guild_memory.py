@@ -0,0 +1,110 @@
+"""
+Memory benchmark of the guild members state, built from a synthetic GUILD_CREATE payload.
+Compares the retained memory per member of plain classes with per-instance __dict__ and payload role lists (before)
+and of bot.Guild with slotted objects, interned ids and the columnar presence store (after).
+The payload is freed before measuring, as it is after the GUILD_CREATE event is handled.
+
+Usage: python -m benchmarks.guild_memory [members]
+"""
+import gc
+import sys
+import json
+import random
+import asyncio
+import tracemalloc
+from time import time
+
+from bot import Guild
+
+ROLES = 200
+PRESENCES_SHARE = 0.3  # large guilds only send presences of online members
+
+
+class LegacyMember:
+    """ bot.Member as it was before the slots """
+
+    def __init__(self, data: dict):
+        self.id = data['user']['id']
+        self.username = data['user']['username']
+        self.global_name = data['user']['global_name']
+        self.bot = data['user'].get('bot') or False
+        self.display_name = data['nick'] or self.global_name or self.username
+        self.avatar = data['avatar'] or data['user']['avatar']
+        self.fake = False
+        self.roles = data['roles']
+
+
+class LegacyMemberPresence:
+    """ bot.MemberPresence as it was before the slots """
+
+    def __init__(self, status: str):
+        self.status = status
+        self.at = int(time())
+
+
+def guild_create_payload(members: int) -> str:
+    role_ids = [str(100000000000000000 + i) for i in range(ROLES)]
+    member_ids = [str(200000000000000000 + i) for i in range(members)]
+    return json.dumps({
+        'id': '300000000000000000',
+        'name': 'benchmark',
+        'owner_id': member_ids[0],
+        'icon': None,
+        'roles': [{'id': i, 'name': f'role {i}', 'permissions': '0'} for i in role_ids],
+        'members': [
+            {
+                'user': {'id': i, 'username': f'user{i}', 'global_name': None, 'avatar': None},
+                'nick': None,
+                'avatar': None,
+                'roles': random.sample(role_ids, random.randrange(4))
+            } for i in member_ids
+        ],
+        'presences': [
+            {'user': {'id': i}, 'status': random.choice(('online', 'idle', 'dnd'))}
+            for i in member_ids if random.random() < PRESENCES_SHARE
+        ],
+        'channels': [],
+        'threads': []
+    })
+
+
+def build_legacy(payload: dict) -> tuple:
+    members = {i['user']['id']: LegacyMember(i) for i in payload['members']}
+    presences = {i['user']['id']: LegacyMemberPresence(i['status']) for i in payload['presences']}
+    for user_id in members:
+        if user_id not in presences:
+            presences[user_id] = LegacyMemberPresence('offline')
+    return members, presences
+
+
+def build_guild(payload: dict) -> Guild:
+    guild = Guild(bot=None, guild_data=payload, cfg=None)
+    asyncio.run(guild.hydrate(payload))
+    return guild
+
+
+def retained_memory(raw: str, build) -> int:
+    """ Return bytes retained by the built state once the parsed payload is freed """
+    gc.collect()
+    tracemalloc.start()
+    payload = json.loads(raw)
+    state = build(payload)
+    del payload
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del state
+    return size
+
+
+def main(members: int):
+    raw = guild_create_payload(members)
+    before = retained_memory(raw, build_legacy)
+    after = retained_memory(raw, build_guild)
+    print(f'members: {members}')
+    print(f'before: {before / members:.0f} bytes/member ({before / 2**20:.1f} MiB)')
+    print(f'after:  {after / members:.0f} bytes/member ({after / 2**20:.1f} MiB, {(1 - after / before) * 100:.1f}% less)')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,117 @@
+"""
+Benchmark of the /profile query set on a synthetic multi-million rows dataset, before and after the migrations.
+Needs a separate empty database on the configured MySQL server, the tables in it are dropped and recreated.
+With DB_BACKEND = 'sqlite' the scratch database is a file path instead.
+
+Usage: python -m benchmarks.profile_queries <scratch_db_name> [messages_rows]
+"""
+import re
+import sys
+import random
+import asyncio
+from time import perf_counter, time
+
+from config import MYSQL_DB, SQLITE_PATH
+from db import db
+import migrate
+
+GUILDS = 20
+USERS_PER_GUILD = 5000
+BATCH_SIZE = 5000
+SAMPLES = 50  # number of random members to run the query set for
+DAY = 60 * 60 * 24
+
+PROFILE_QUERIES = {
+    'messages': "SELECT COUNT(*) as cnt FROM mbr_stats_messages WHERE guild_id=%s AND user_id=%s AND at>%s",
+    'replies': "SELECT COUNT(*) as cnt FROM mbr_stats_messages WHERE guild_id=%s AND reply_to_user=%s AND user_id!=%s AND at>%s",
+    'reactions_sent': "SELECT COUNT(*) as cnt FROM mbr_stats_reactions WHERE guild_id=%s AND user_id=%s AND at>%s",
+    'reactions_recv': "SELECT COUNT(*) as cnt FROM mbr_stats_reactions WHERE guild_id=%s AND message_author_id=%s AND user_id!=%s AND at>%s",
+    'presences': "SELECT status, SUM(duration) as duration FROM mbr_stats_presence WHERE guild_id=%s AND user_id=%s AND started_at>%s GROUP BY status",
+    'emojis': "SELECT emoji, emoji_id, COUNT(*) as cnt FROM mbr_stats_reactions WHERE guild_id=%s AND user_id=%s AND at>%s GROUP BY emoji collate utf8mb4_unicode_520_ci ORDER BY cnt DESC LIMIT 3",
+}
+
+
+def query_args(name: str, guild_id: int, user_id: int, at_after: int) -> tuple:
+    if name in ('replies', 'reactions_recv'):
+        return guild_id, user_id, user_id, at_after
+    return guild_id, user_id, at_after
+
+
+async def create_tables():
+    sql = migrate.CREATE_TABLES.read_text()
+    for table in ('schema_version', *re.findall(r'CREATE TABLE `(\w+)`', sql)):
+        await db.execute(f'DROP TABLE IF EXISTS `{table}`')
+    for statement in migrate.split_statements(sql):
+        await db.execute(statement)
+
+
+async def fill_tables(messages_rows: int):
+    now = int(time())
+    guild_ids = [100000000000000000 + i for i in range(GUILDS)]
+
+    def random_member() -> tuple[int, int]:
+        return random.choice(guild_ids), 200000000000000000 + random.randrange(USERS_PER_GUILD)
+
+    for offset in range(0, messages_rows, BATCH_SIZE):
+        messages, reactions, presences = [], [], []
+        for n in range(offset, min(offset + BATCH_SIZE, messages_rows)):
+            guild_id, user_id = random_member()
+            at = now - random.randrange(90 * DAY)
+            reply_to = random_member()[1] if random.random() < 0.2 else None
+            messages.append((guild_id, guild_id, 300000000000000000 + n, user_id, reply_to, at))
+            reactions.append((guild_id, 300000000000000000 + n, user_id, random_member()[1], '👍', None, at))
+            duration = random.randrange(60, 4 * 60 * 60)
+            presences.append((guild_id, user_id, random.choice(('online', 'idle', 'dnd', 'offline')), at, at + duration, duration))
+
+        await db.insert_many(
+            'mbr_stats_messages', ['guild_id', 'channel_id', 'message_id', 'user_id', 'reply_to_user', 'at'], messages
+        )
+        await db.insert_many(
+            'mbr_stats_reactions', ['guild_id', 'message_id', 'message_author_id', 'user_id', 'emoji', 'emoji_id', 'at'], reactions
+        )
+        await db.insert_many(
+            'mbr_stats_presence', ['guild_id', 'user_id', 'status', 'started_at', 'ended_at', 'duration'], presences
+        )
+        print(f'\rInserted {offset + len(messages)}/{messages_rows} rows per table...', end='')
+    print()
+
+
+async def run_queries(samples: list[tuple[int, int]]) -> dict[str, float]:
+    """ Return average seconds per query """
+    at_after = int(time()) - 30 * DAY
+    timings = {}
+    for name, query in PROFILE_QUERIES.items():
+        started_at = perf_counter()
+        for guild_id, user_id in samples:
+            await db.fetch_all(query, query_args(name, guild_id, user_id, at_after))
+        timings[name] = (perf_counter() - started_at) / len(samples)
+    return timings
+
+
+async def main(db_name: str, messages_rows: int):
+    if db_name in (MYSQL_DB, SQLITE_PATH):
+        raise ValueError('Refusing to run on the bot database, provide a scratch database name.')
+    await db.connect(loop=asyncio.get_running_loop(), db_name=db_name)
+    try:
+        await create_tables()
+        await fill_tables(messages_rows)
+        samples = [
+            (100000000000000000 + random.randrange(GUILDS), 200000000000000000 + random.randrange(USERS_PER_GUILD))
+            for _ in range(SAMPLES)
+        ]
+
+        before = await run_queries(samples)
+        print(f"Applied migrations: {', '.join(await migrate.migrate())}")
+        after = await run_queries(samples)
+    finally:
+        await db.close()
+
+    print(f'{"query":<16}{"before, ms":>12}{"after, ms":>12}{"speedup":>10}')
+    for name in PROFILE_QUERIES:
+        print(f'{name:<16}{before[name] * 1000:>12.2f}{after[name] * 1000:>12.2f}{before[name] / after[name]:>9.1f}x')
+    total_before, total_after = sum(before.values()), sum(after.values())
+    print(f'{"total":<16}{total_before * 1000:>12.2f}{total_after * 1000:>12.2f}{total_before / total_after:>9.1f}x')
+
+
+if __name__ == '__main__':
+    asyncio.run(main(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else 2000000))
@@ -1,4 +1,5 @@
 from .objects import DiscordObject, Channel, Thread, Member, FakeMember, MemberPresence, Role
+from .presence import PresenceTable, CoalescingStats
 from . import errors
 from . import cfg
 
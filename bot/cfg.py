@@ -4,6 +4,8 @@ __all__ = [
 ]
 from typing import Any, Type, Self, TYPE_CHECKING
 from abc import ABC, abstractmethod
+from logging import getLogger
+import asyncio
 import json
 
 from db import db
@@ -12,6 +14,8 @@ if TYPE_CHECKING:
     from enum import IntEnum
     from . import Guild
 
+logger = getLogger(__name__)
+
 
 class Variable(ABC):
     """ Base variable class """
@@ -181,6 +185,7 @@ class Config:
     _table_name: str
     _name: str
     _variables: dict[str: Variable] = {}
+    _prefetch_tasks: dict[int, asyncio.Task]  # per class {p_key: get_or_create_many() task}, see prefetch()
 
     def __init__(self, data: dict, p_key, f_key=None):
         self._p_key = p_key
@@ -201,16 +206,66 @@ class Config:
         if p_key:
             row['p_key'] = p_key
 
-        p_key = await db.insert(cls._table_name, row=row)
-        return cls(data=data, p_key=p_key, f_key=f_key)
+        row_id = await db.insert(cls._table_name, row=row)
+        # lastrowid is only set for generated keys
+        return cls(data=data, p_key=p_key or row_id, f_key=f_key)
 
     @classmethod
     async def get_or_create(cls, p_key: int, f_key: int = None) -> Self:
+        if (task := cls.__dict__.get('_prefetch_tasks', {}).pop(p_key, None)) is not None:
+            try:
+                if (config := (await task).get(p_key)) is not None:
+                    return config
+            except Exception:
+                pass  # logged by _on_prefetch_done(), fall back to a single select
+
         record = await db.select_one(cls._table_name, {'p_key': p_key, 'name': cls._name})
         if record:
             return cls(data=json.loads(record['cfg']), p_key=p_key, f_key=f_key)
         return await cls.create(p_key, f_key)
 
+    @classmethod
+    async def get_or_create_many(cls, p_keys: list[int]) -> dict[int, Self]:
+        """ Get configs for many p_keys with a single select, create the missing ones with a single insert """
+        if not len(p_keys):
+            return {}
+        records = await db.fetch_all(
+            f"SELECT `p_key`, `cfg` FROM `{cls._table_name}` WHERE `name`=%s AND `p_key` IN "
+            f"({', '.join(['%s'] * len(p_keys))})",
+            (cls._name, *p_keys)
+        )
+        configs = {record['p_key']: cls(data=json.loads(record['cfg']), p_key=record['p_key']) for record in records}
+
+        if len(missing := [p_key for p_key in p_keys if p_key not in configs]):
+            data = {name: variable.default for name, variable in cls._variables.items()}
+            await db.insert_many(
+                cls._table_name,
+                ['p_key', 'f_key', 'name', 'cfg'],
+                [(p_key, None, cls._name, json.dumps(data)) for p_key in missing],
+                on_conflict='ignore'  # could be created by get_or_create() meanwhile
+            )
+            configs.update({p_key: cls(data=data, p_key=p_key) for p_key in missing})
+        return configs
+
+    @classmethod
+    def prefetch(cls, p_keys: list[int]):
+        """
+        Start loading configs for p_keys in the background, get_or_create() takes them from there.
+        Prefetches of several calls (a READY per shard) are kept until their configs are taken.
+        """
+        if not len(p_keys):
+            return
+        if '_prefetch_tasks' not in cls.__dict__:
+            cls._prefetch_tasks = {}
+        task = asyncio.create_task(cls.get_or_create_many(p_keys))
+        task.add_done_callback(cls._on_prefetch_done)
+        cls._prefetch_tasks.update(dict.fromkeys(p_keys, task))
+
+    @classmethod
+    def _on_prefetch_done(cls, task: asyncio.Task):
+        if not task.cancelled() and (e := task.exception()) is not None:
+            logger.error(f'Failed to prefetch {cls.__name__} rows: {e}')
+
     @classmethod
     async def get_foreign(cls, f_key: int) -> dict[int, Self]:
         """ Get all self Configs for f_key """
@@ -1,15 +1,25 @@
 from __future__ import annotations
 
+import asyncio
 import logging
-from time import time
+from functools import partial
 from typing import cast, TYPE_CHECKING
 from logging import getLogger
 from nextcore.gateway import ShardManager
 from nextcore.http import BotAuthentication, HTTPClient, Route, HTTPRequestStatusError
 
-from config import DC_BOT_TOKEN, DC_BOT_INTENTS, DC_SHARD_ID, DC_SHARD_COUNT
+from config import DC_BOT_TOKEN, DC_BOT_INTENTS, DC_SHARD_COUNT
+from db import db_tag
+import cluster
+from cache import Cache
 from .events import BotEvents
 from bot.interactions import SlashCommandCallback
+from bot.metrics import MetricsDispatcher
+from bot.presence import CoalescingStats
+from bot.snapshot import StateSnapshot
+from bot.guild import MemberFetchStats
+from bot.web import WebClient
+from bot.intents import intent_names
 
 if TYPE_CHECKING:
     from typing import Literal, Callable, Coroutine
@@ -19,37 +29,34 @@ if TYPE_CHECKING:
 logger = getLogger(__name__)
 
 
-class ApiCache:
+class ShardState:
+    """ Readiness of a single shard served by this process """
 
-    MAX_ENTRIES = 100
+    __slots__ = ('ready', 'unavailable_guilds')
 
     def __init__(self):
-        # cached data for self.api_get_cached as {route: [data, expires_at]}
-        # this is used in case of slash commands autocomplete and such
-        self.d: dict[str, tuple[dict, float | int]] = dict()
+        self.ready = False  # if the shard received all of its guilds and is connected
+        self.unavailable_guilds: set[str] = set()  # guilds of the shard not received yet or lost with the connection
 
-    def get(self, route: str) -> dict | None:
-        if (cached := self.d.get(route)) is not None:
-            if time() < cached[1]:
-                logger.debug(f'Using cached response for {route}.')
-                return cached[0]
 
-    def set(self, route: str, data: dict, expires_at: float | int):
-        if self.d.__len__() >= self.MAX_ENTRIES:
-            self.d.clear()
-        self.d[route] = (data, expires_at)
+class BotShardManager(ShardManager):
+    """ Adds shard_disconnect and shard_resumed events with the shard id and events metrics to ShardManager """
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.event_dispatcher = MetricsDispatcher()
 
-class BotShardManager(ShardManager):
-    """ Adds shard_disconnect event to ShardManager """
+    async def _on_shard_disconnect(self, shard_id: int, code: int | bool):
+        await self.event_dispatcher.dispatch('shard_disconnect', shard_id, code)
 
-    async def _on_shard_disconnect(self, code: int | bool):
-        await self.event_dispatcher.dispatch('shard_disconnect', code)
+    async def _on_shard_resumed(self, shard_id: int, data: dict):
+        await self.event_dispatcher.dispatch('shard_resumed', shard_id)
 
     def _spawn_shard(self, shard_id: int, shard_count: int) -> Shard:
         shard = super()._spawn_shard(shard_id, shard_count)
-        shard.dispatcher.add_listener(self._on_shard_disconnect, 'disconnect')
-        shard.dispatcher.add_listener(self._on_shard_disconnect, 'client_disconnect')
+        shard.dispatcher.add_listener(partial(self._on_shard_disconnect, shard_id), 'disconnect')
+        shard.dispatcher.add_listener(partial(self._on_shard_disconnect, shard_id), 'client_disconnect')
+        shard.event_dispatcher.add_listener(partial(self._on_shard_resumed, shard_id), 'RESUMED')
         return shard
 
 
@@ -58,27 +65,71 @@ class Bot:
     def __init__(self):
         self.token = DC_BOT_TOKEN
         self.auth = BotAuthentication(self.token)
-        self.ready = False  # if the bot is fully ready to operate
         self.first_ready = True  # if the bot is ready for first time or reconnected
         self.running = True
-        self.unavailable_guilds: list[str] = []
-        self.cache = ApiCache()
+        self.shards: dict[int, ShardState] = {shard_id: ShardState() for shard_id in cluster.SHARD_IDS}
+        # api_get_cached responses, used in case of slash commands autocomplete and such
+        self.cache = Cache('bot.api_get', max_entries=1000, max_bytes=8 * 2**20)
         self._on_close_tasks = []
         self._on_think_tasks = []
+        self._singleton_tasks = set()  # on_think tasks to run on a single worker of a cluster
 
         self.http_client = HTTPClient()
+        self.web = WebClient()  # third-party APIs
         self.shard_manager = BotShardManager(
-            self.auth, DC_BOT_INTENTS, self.http_client, shard_count=DC_SHARD_COUNT, shard_ids=[DC_SHARD_ID]
+            self.auth, DC_BOT_INTENTS or 0, self.http_client, shard_count=DC_SHARD_COUNT, shard_ids=list(self.shards)
         )
         self.event_dispatcher = self.shard_manager.event_dispatcher
+        self.event_metrics = self.event_dispatcher.metrics  # bot.event_metrics.top() in the CLI
+        self.presence_stats = CoalescingStats()
+        self.snapshot = StateSnapshot(self)
+        self.member_fetch_stats = MemberFetchStats()
         self.slash_commands: dict[str, SlashCommandCallback] = dict()
         self.slash_autocompletes: dict[str, Callable] = dict()
         self.guilds: dict[str, Guild] = {}
 
         self.events = BotEvents(self)
 
+    @property
+    def ready(self) -> bool:
+        """ If the bot is ready to operate, at least one of the process shards is ready """
+        return any(shard.ready for shard in self.shards.values())
+
+    @property
+    def all_ready(self) -> bool:
+        """ If all the process shards are ready """
+        return all(shard.ready for shard in self.shards.values())
+
+    @staticmethod
+    def guild_shard_id(guild_id: str | int) -> int:
+        """ Id of the shard a guild events are sent to """
+        return (int(guild_id) >> 22) % DC_SHARD_COUNT
+
+    def is_guild_available(self, guild_id: str) -> bool:
+        if (shard := self.shards.get(self.guild_shard_id(guild_id))) is None:
+            return False
+        return shard.ready and guild_id not in shard.unavailable_guilds
+
+    def intents(self) -> int:
+        """ DC_BOT_INTENTS or, if it is None, the intents computed from the registered listeners """
+        required = self.events.required_intents()
+        if DC_BOT_INTENTS is None:
+            logger.info(f"Using intents required by the listeners: {', '.join(intent_names(required))}.")
+            return required
+        if excess := DC_BOT_INTENTS & ~required:
+            logger.warning(
+                f"DC_BOT_INTENTS has intents no listener needs: {', '.join(intent_names(excess))}, "
+                f"their events are received for nothing. Set DC_BOT_INTENTS = None to compute them."
+            )
+        if missing := required & ~DC_BOT_INTENTS:
+            logger.warning(f"DC_BOT_INTENTS lacks intents the listeners need: {', '.join(intent_names(missing))}.")
+        return DC_BOT_INTENTS
+
     async def serve(self):
         await self.http_client.setup()
+        # modules register their listeners on import, after the bot is created
+        self.shard_manager.intents = self.intents()
+        await self.snapshot.load()
 
         # This should return once all shards have started to connect.
         # This does not mean they are connected.
@@ -96,10 +147,17 @@ class Bot:
             self.slash_commands[cmd_name] = SlashCommandCallback(callback, ephemeral=ephemeral, expensive=expensive)
         return _decorator
 
-    def on_think(self, callback: Callable):
-        """ Decorator to register an on_think task """
-        logger.info(f'Registered on think task - {callback.__name__}.')
+    def on_think(self, callback: Callable = None, singleton: bool = False):
+        """
+        Decorator to register an on_think task, as @bot.on_think or @bot.on_think(singleton=True)
+        Singleton tasks do global work, e.g. polling an external API, they run only on a single worker of a cluster
+        """
+        if callback is None:
+            return lambda f: self.on_think(f, singleton=singleton)
+        logger.info(f"Registered {'singleton ' if singleton else ''}on think task - {callback.__name__}.")
         self._on_think_tasks.append(callback)
+        if singleton:
+            self._singleton_tasks.add(callback)
 
     def slash_autocomplete(self, option_name: str):
         """ Decorator to register a slash command option autocomplete """
@@ -117,6 +175,9 @@ class Bot:
     async def think(self, frame_time: float):
         if self.ready:
             for task in self._on_think_tasks:
+                if task in self._singleton_tasks and not cluster.link.runs_singletons:
+                    continue
+                db_tag.set(task.__module__)
                 await task(frame_time)
 
     @staticmethod
@@ -138,13 +199,12 @@ class Bot:
         )
         return await resp.json()
 
-    async def api_get_cached(self, route: str, expire_delay: int | float = 15) -> dict:
-        """ same as api_get but with simple route caching """
-        if (data := self.cache.get(route)) is not None:
-            return data
-        data = await self.api_get(route)
-        self.cache.set(route, data, time()+expire_delay)
-        return data
+    async def api_get_cached(self, route: str, expire_delay: int | float = 15, stale_delay: int | float = 0) -> dict:
+        """
+        same as api_get but with route caching, concurrent calls for a route share a single request,
+        for stale_delay seconds after expire_delay the cached response is returned while it is refreshed
+        """
+        return await self.cache.get_or_fetch(route, self.api_get, route, ttl=expire_delay, stale_ttl=stale_delay)
 
     async def api_post(self, route: str, data: dict, method: Literal['POST', 'PATCH'] = 'POST') -> dict:
         """ Do api POST and return json response """
@@ -179,6 +239,14 @@ class Bot:
         return resp.status
 
     async def close(self):
+        # the changes still settling are applied at their own time, the saved intervals must start with them
+        for guild in self.guilds.values():
+            if len(guild.pending_presences):
+                await guild.settle_presences()
+        await asyncio.sleep(0)  # let the dispatched BOT_MEMBER_PRESENCE_CHANGE listeners buffer their rows
+        # the open presence intervals of the saved guilds continue from the snapshot, on_close tasks skip writing them
+        await self.snapshot.save()
         for task in self._on_close_tasks:
             await task()
         await self.shard_manager.close()
+        await self.web.close()
@@ -1,14 +1,19 @@
 from __future__ import annotations
 from typing import TYPE_CHECKING
 from logging import getLogger
+import asyncio
 
 from bot import Guild, SlashCommandInteraction, SlashAutocompleteInteraction
+from bot.guild import GuildConfig
+from bot.intents import INTENTS, required_intents
 
 if TYPE_CHECKING:
     import discord_typings as dt
     from . import Bot
 
 logger = getLogger(__name__)
+# the guilds, channels, roles and members cache is kept whatever the modules listen to
+CACHE_INTENTS = INTENTS['GUILDS'] | INTENTS['GUILD_MEMBERS']
 
 
 class BotEvents:
@@ -19,7 +24,7 @@ class BotEvents:
 
     def register_events(self):
         self.bot.event_dispatcher.add_listener(self._on_ready, 'READY')
-        self.bot.event_dispatcher.add_listener(self._on_resume, 'RESUMED')
+        self.bot.event_dispatcher.add_listener(self._on_shard_resumed, 'shard_resumed')
         self.bot.event_dispatcher.add_listener(self._on_guild_create, 'GUILD_CREATE')
         self.bot.event_dispatcher.add_listener(self._on_guild_update, 'GUILD_UPDATE')
         self.bot.event_dispatcher.add_listener(self._on_guild_delete, 'GUILD_DELETE')
@@ -37,45 +42,67 @@ class BotEvents:
         self.bot.event_dispatcher.add_listener(self._on_interaction_create, 'INTERACTION_CREATE')
         self.bot.event_dispatcher.add_listener(self._on_message_create, 'MESSAGE_CREATE')
         self.bot.event_dispatcher.add_listener(self._on_shard_disconnect, 'shard_disconnect')
+        self.bot.on_think(self._settle_presences)
+
+    def required_intents(self) -> int:
+        """ Minimal intents for the events the modules listen to, the own listeners only follow them for the cache """
+        module_events = {
+            event_name for event_name, callbacks in self.bot.event_dispatcher.listeners().items()
+            if any(getattr(i, '__self__', None) is not self for i in callbacks)
+        }
+        return CACHE_INTENTS | required_intents(module_events)
 
     async def _on_ready(self, data: dt.ReadyData):
-        logger.info(f"Logged in as {data['user']['username']} ({data['user']['id']}).")
-        self.bot.unavailable_guilds = [i['id'] for i in data['guilds']]
-        if len(self.bot.unavailable_guilds):
-            logger.info(f'Waiting for Guild data... {len(self.bot.unavailable_guilds)} left')
-            self.bot.ready = False
+        shard_id = data.get('shard', [0])[0]
+        logger.info(f"Logged in as {data['user']['username']} ({data['user']['id']}) on shard {shard_id}.")
+        shard = self.bot.shards[shard_id]
+        shard.unavailable_guilds = {i['id'] for i in data['guilds']}
+        # load configs of all the new guilds with a single query, Guild.new() will take them from there
+        GuildConfig.prefetch([int(i['id']) for i in data['guilds'] if i['id'] not in self.bot.guilds])
+        if len(shard.unavailable_guilds):
+            logger.info(f'Shard {shard_id} waiting for Guild data... {len(shard.unavailable_guilds)} left')
+            shard.ready = False
         else:
+            self._on_shard_ready(shard_id)
+
+    async def _on_shard_resumed(self, shard_id: int):
+        logger.info(f'Shard {shard_id} connection was resumed.')
+        # the missed events are replayed before RESUMED, guilds of the shard are up to date again
+        shard = self.bot.shards[shard_id]
+        shard.unavailable_guilds.clear()
+        shard.ready = True
+
+    def _on_shard_ready(self, shard_id: int):
+        self.bot.shards[shard_id].ready = True
+        logger.info(f'All Guilds of shard {shard_id} loaded, ready to operate.')
+        if self.bot.first_ready and self.bot.all_ready:
             self.bot.first_ready = False
-            self.bot.ready = True
-
-    async def _on_resume(self, d: dict):
-        logger.info(f'Connection was resumed.')
-        self.bot.ready = True
+            # guilds missing from all the shards were left while the bot was down
+            asyncio.create_task(self.bot.snapshot.end_remaining())
 
     async def _on_guild_create(self, data: dt.GuildCreateData):
         #  This function is called every time a guild becomes available (usually before READY event)
         logger.debug(f"Create guild for {data['id']}")
         if data['id'] not in self.bot.guilds.keys():
             logger.debug(f'not found in keys: {self.bot.guilds.keys()}')
-            self.bot.guilds[data['id']] = await Guild.new(self.bot, data)
+            # the guild is available to the events handlers while the members are being hydrated
+            self.bot.guilds[data['id']] = guild = await Guild.new(self.bot, data)
+            await guild.hydrate(data, warm=self.bot.snapshot.pop(data['id']))
         else:
             self.bot.guilds[data['id']].update_self(data)
 
         # We receive READY event first,
-        # and then we have to track all Guilds data are received before the bot can load state and be ready to operate
-        if not self.bot.ready:
-            if data['id'] in self.bot.unavailable_guilds:
-                self.bot.unavailable_guilds.remove(data['id'])
-            else:
-                logger.warning(f"Unexpected guild create even received @ guild_id {data['id']}")
-
-            if not len(self.bot.unavailable_guilds):
-                if self.bot.first_ready:
-                    self.bot.first_ready = False
-#                    await self.bot.load_state()
-
-            self.bot.ready = True
-            logger.info('All Guilds loaded, ready to operate.')
+        # and then we have to track all Guilds data of a shard are received before it is ready to operate
+        shard_id = self.bot.guild_shard_id(data['id'])
+        if (shard := self.bot.shards.get(shard_id)) is None:
+            logger.warning(f"Guild create received for shard {shard_id} not served by this process @ {data['id']}")
+            return
+        if data['id'] in shard.unavailable_guilds:
+            shard.unavailable_guilds.discard(data['id'])
+            if not shard.ready and not len(shard.unavailable_guilds):
+                self._on_shard_ready(shard_id)
+        elif not shard.ready:
+            logger.warning(f"Unexpected guild create even received @ guild_id {data['id']}")
 
     async def _on_guild_update(self, data: dt.GuildUpdateData):
         #  Data is the same as GUILD_CREATE but without members and channels data
@@ -84,6 +111,8 @@ class BotEvents:
     async def _on_guild_delete(self, data: dt.GuildDeleteData):
         if data['unavailable']:
             logger.warning(f"Guild with id {data['id']} is unavailable due to an outage.")
+            if (shard := self.bot.shards.get(self.bot.guild_shard_id(data['id']))) is not None:
+                shard.unavailable_guilds.add(data['id'])
         self.bot.guilds.pop(data['id'])
 
     async def _on_channel_create(self, data: dt.ChannelCreateData):
@@ -122,6 +151,11 @@ class BotEvents:
     async def _on_presence_update(self, data: dt.PresenceUpdateData):
         await self.bot.guilds[data['guild_id']].update_member_presence(data)
 
+    async def _settle_presences(self, frame_time: float):
+        for guild in self.bot.guilds.values():
+            if len(guild.pending_presences):
+                await guild.settle_presences(frame_time)
+
     async def _on_interaction_create(self, data: dt.InteractionCreateData):
         if data['type'] == 2:  # it's a /slash command
             sci = SlashCommandInteraction(bot=self.bot, interaction_data=data)
@@ -150,16 +184,20 @@ class BotEvents:
             logger.error(f'Received MESSAGE_CREATE with an unknown guild_id: {guild_id}.')
             return
 
-    async def _on_shard_disconnect(self, code: int | bool):
+    async def _on_shard_disconnect(self, shard_id: int, code: int | bool):
         # This means shard is disconnected by local request (ShardManager.close() or .rescale_shards())
         if code is True:
             return
 
-        logger.error('A shard closed connection: ' + ('heartbeat timeout.' if code is False else f"code {code}."))
-        num_connected_shards = len([shard for shard in self.bot.shard_manager.active_shards if shard.connected.is_set()])
-        if num_connected_shards == 0:
-            logger.error('No more connected shards left. Bot is no longer ready.')
-            self.bot.ready = False
+        logger.error(
+            f'Shard {shard_id} closed connection: ' + ('heartbeat timeout.' if code is False else f"code {code}.")
+        )
+        # only the guilds of the disconnected shard are out of date until it resumes or receives them again
+        shard = self.bot.shards[shard_id]
+        shard.ready = False
+        shard.unavailable_guilds = {i for i in self.bot.guilds if self.bot.guild_shard_id(i) == shard_id}
+        if not self.bot.ready:
+            logger.error('No more ready shards left. Bot is no longer ready.')
             return
-        logger.error(f'{num_connected_shards} connected shards left.')
+        logger.error(f'{sum(shard.ready for shard in self.bot.shards.values())} ready shards left.')
 
@@ -1,10 +1,16 @@
 from __future__ import annotations
 from typing import TYPE_CHECKING
+import gc
+import asyncio
 from logging import getLogger
+from sys import intern
+from time import time, perf_counter
 from nextcore.http.errors import NotFoundError
 
 from config import BOT_OWNER_IDS
-from bot import DiscordObject, Channel, Thread, Role, Member, MemberPresence
+from cache import Cache
+from bot import DiscordObject, Channel, Thread, Role, Member, MemberPresence, PresenceTable
+from bot.presence import SETTLE_TIME, STATUSES, STATUS_CODES, OFFLINE
 from bot.cfg import Config, StrVar, RoleVar, IntVar, ListVar, BoolVar, TextChannelVar
 
 if TYPE_CHECKING:
@@ -13,6 +19,37 @@ if TYPE_CHECKING:
     from bot import Bot
 
 logger = getLogger(__name__)
+HYDRATE_CHUNK_SIZE = 1000  # members and presences processed between yields to the event loop
+HYDRATE_GC_THRESHOLD = 100_000  # young generation collection threshold while hydrating
+MEMBER_NOT_FOUND_TTL = 60  # users not found by Guild.fetch_member() are not requested again for this long (seconds)
+# negative cache of Guild.fetch_member() of all the guilds as {(guild_id, user_id): True}
+missing_members = Cache('guild.missing_members', max_entries=10000, ttl=MEMBER_NOT_FOUND_TTL)
+
+
+class MemberFetchStats:
+    """ Guild.fetch_member() lookups, all the guilds together """
+
+    __slots__ = ('hits', 'misses', 'shared', 'not_found', 'not_found_hits', 'errors')
+
+    def __init__(self):
+        self.hits = 0  # found in guild.members
+        self.misses = 0  # requested from the API
+        self.shared = 0  # waited for a request already in flight for the same member
+        self.not_found = 0  # requests answered NotFound
+        self.not_found_hits = 0  # answered None from the negative cache
+        self.errors = 0  # requests failed otherwise
+
+    def json(self) -> dict:
+        lookups = self.hits + self.misses + self.shared + self.not_found_hits
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'shared': self.shared,
+            'not_found': self.not_found,
+            'not_found_hits': self.not_found_hits,
+            'errors': self.errors,
+            'requests_saved_share': (lookups - self.misses) / lookups if lookups else 0.0
+        }
 
 
 class GuildConfig(Config):
@@ -137,6 +174,8 @@ class GuildConfig(Config):
 
 class Guild(DiscordObject):
     _fields = ['id', 'name', 'owner_id', 'icon']
+    _hydrations = 0  # number of guilds being hydrated at the moment
+    _gc_thresholds: tuple[int, int, int] = gc.get_threshold()  # collector thresholds to restore after
 
     def __init__(self, bot: Bot, guild_data: GuildCreateData, cfg: GuildConfig):
         self.cfg = cfg
@@ -146,24 +185,29 @@ class Guild(DiscordObject):
         self.owner_id = guild_data['owner_id']
         self.icon = guild_data['icon']
 
-        self.roles: dict[str, Role] = {i['id']: Role(i) for i in guild_data['roles']}
+        # objects are keyed by their interned ids, so the dict keys share the string with the object
+        self.roles: dict[str, Role] = {role.id: role for role in map(Role, guild_data['roles'])}
 
-        self.members: dict[str, Member] = {i['user']['id']: Member.from_api(i) for i in guild_data['members']}
-        self.presences: dict[str, MemberPresence] = {i['user']['id']: MemberPresence.from_api(i) for i in guild_data['presences']}
-        # if a guild is large, presences do not contain offline/invisible members
-        for user_id in self.members:
-            if user_id not in self.presences:
-                self.presences[user_id] = MemberPresence(status='offline')
+        # members and presences are filled by self.hydrate()
+        self.hydrating = True
+        self.members: dict[str, Member] = {}
+        self.presences = PresenceTable()
+        self.pending_presences: dict[str, MemberPresence] = {}  # status changes waiting to settle
+        # reverse index of member roles, kept in sync on every member roles change
+        self.role_members: dict[str, set[str]] = {role_id: set() for role_id in self.roles}
+        self._left_members: set[str] = set()  # members removed during the hydration
+        self._member_fetches: dict[str, asyncio.Task] = {}  # fetch_member() requests in flight
 
         self.admin_roles: set[str] = {i.id for i in self.roles.values() if int(i.permissions) & (1 << 3)}
-        self.channels: dict[str, Channel] = {i['id']: Channel(i) for i in guild_data['channels']}
-        self.threads: dict[str, Thread] = {i['id']: Thread(i) for i in guild_data['threads']}
+        self.channels: dict[str, Channel] = {channel.id: channel for channel in map(Channel, guild_data['channels'])}
+        self.threads: dict[str, Thread] = {thread.id: thread for thread in map(Thread, guild_data['threads'])}
 
     def __repr__(self):
         return f'<Guild {self.name} id={self.id}>'
 
     @classmethod
     async def new(cls, bot: Bot, guild_data: GuildCreateData) -> Guild:
+        """ Create a guild without members and presences, self.hydrate() must be called next """
         logger.debug(f'Creating guild {guild_data["name"]}...')
         guild = cls(
             bot=bot,
@@ -173,6 +217,72 @@ class Guild(DiscordObject):
 
         return guild
 
+    async def hydrate(
+            self, guild_data: GuildCreateData, chunk_size: int = HYDRATE_CHUNK_SIZE,
+            warm: dict[str, tuple[int, int]] | None = None
+    ):
+        """
+        Fill members and presences from the GUILD_CREATE payload in chunks, yielding to the event loop in between,
+        so large guilds do not stall the gateway heartbeats and interactions.
+        Members and presences set by the events received meanwhile are newer than the payload and are kept.
+        warm are the guild presences of the state snapshot, members still in the same status keep their start time.
+        """
+        started_at = perf_counter()
+        # hydration allocates lots of long living objects, every few hundred of them trigger a young generation pass
+        # cascading into the older ones, so the collections are made rare while any guild is hydrating
+        if Guild._hydrations == 0:
+            Guild._gc_thresholds = gc.get_threshold()
+            gc.set_threshold(HYDRATE_GC_THRESHOLD, *Guild._gc_thresholds[1:])
+        Guild._hydrations += 1
+        try:
+            await self._hydrate(guild_data, chunk_size, warm or {})
+        finally:
+            Guild._hydrations -= 1
+            if Guild._hydrations == 0:
+                gc.set_threshold(*Guild._gc_thresholds)
+        logger.debug(f'Hydrated guild {self.name}, {len(self.members)} members in {perf_counter() - started_at:.3f}s.')
+
+    async def _hydrate(self, guild_data: GuildCreateData, chunk_size: int, warm: dict[str, tuple[int, int]]):
+        now = int(time())
+
+        def since(user_id: str, status: str) -> int:
+            if (saved := warm.get(user_id)) is not None and saved[0] == STATUS_CODES.get(status, OFFLINE):
+                return saved[1]
+            return now
+        members_data = guild_data['members']
+        for n in range(0, len(members_data), chunk_size):
+            for member in map(Member.from_api, members_data[n:n+chunk_size]):
+                if member.id not in self.members and member.id not in self._left_members:
+                    self.members[member.id] = member
+                    self._index_member_roles(member.id, (), member.roles)
+            await asyncio.sleep(0)
+
+        presences_data = guild_data['presences']
+        for n in range(0, len(presences_data), chunk_size):
+            for presence_data in presences_data[n:n+chunk_size]:
+                user_id = intern(presence_data['user']['id'])
+                if user_id not in self.presences and user_id not in self._left_members:
+                    self.presences.set(user_id, presence_data['status'], since(user_id, presence_data['status']))
+            await asyncio.sleep(0)
+
+        # if a guild is large, presences do not contain offline/invisible members
+        member_ids = list(self.members)
+        for n in range(0, len(member_ids), chunk_size):
+            for user_id in member_ids[n:n+chunk_size]:
+                if user_id not in self.presences:
+                    self.presences.set(user_id, 'offline', since(user_id, 'offline'))
+            await asyncio.sleep(0)
+
+        self.hydrating = False
+        self._left_members.clear()
+
+        # the snapshot intervals which did not continue ended while the bot was down
+        ended = []
+        for user_id, (code, at) in warm.items():
+            if (presence := self.presences.get(user_id)) is None or presence.at != at:
+                ended.append((user_id, MemberPresence(STATUSES[code], at=at)))
+        await self.bot.snapshot.end_presences(self.id, ended)
+
     def update_self(self, guild_data: GuildUpdateData):
         logger.debug(f'Updating guild {guild_data["name"]}...')
         self.id = guild_data['id']
@@ -195,11 +305,24 @@ class Guild(DiscordObject):
             return
         self.threads[thread_data['id']] = Thread(thread_data)
 
+    def _index_member_roles(self, member_id: str, old_roles: tuple[str, ...], new_roles: tuple[str, ...]):
+        for role_id in old_roles:
+            if role_id not in new_roles and (members := self.role_members.get(role_id)) is not None:
+                members.discard(member_id)
+        for role_id in new_roles:
+            if role_id not in old_roles:
+                self.role_members.setdefault(role_id, set()).add(member_id)
+
     def update_or_create_member(self, member_data: dict):
         if (member := self.members.get(member_data['user']['id'])) is not None:
+            old_roles = member.roles
             member.update(member_data)
+            self._index_member_roles(member.id, old_roles, member.roles)
             return
-        self.members[member_data['user']['id']] = Member.from_api(member_data)
+        member = Member.from_api(member_data)
+        self.members[member.id] = member
+        self._index_member_roles(member.id, (), member.roles)
+        missing_members.pop((self.id, member.id))
 
     def update_or_create_role(self, role_data: dict):
         if int(role_data['permissions']) & (1 << 3):
@@ -210,31 +333,69 @@ class Guild(DiscordObject):
         if (role := self.roles.get(role_data['id'])) is not None:
             role.update(role_data)
             return
-        self.roles[role_data['id']] = Role(role_data)
+        role = Role(role_data)
+        self.roles[role.id] = role
+        self.role_members.setdefault(role.id, set())
 
     def delete_role(self, role_id: str):
         self.admin_roles.discard(role_id)
-        for m in filter(lambda i: role_id in i.roles, self.members.values()):
-            m.roles.remove(role_id)
+        for member_id in self.role_members.pop(role_id, ()):
+            member = self.members[member_id]
+            member.roles = tuple(i for i in member.roles if i != role_id)
         self.roles.pop(role_id)
 
     def delete_channel(self, channel_id: str):
         self.channels.pop(channel_id)
 
     def delete_member(self, member_id: str):
+        if self.hydrating:
+            self._left_members.add(member_id)
         if member_id in self.members:
-            self.members.pop(member_id)
+            self._index_member_roles(member_id, self.members.pop(member_id).roles, ())
         if member_id in self.presences:
             self.presences.pop(member_id)
+        self.pending_presences.pop(member_id, None)
 
     async def update_member_presence(self, presence_data: PresenceUpdateData):
-        old_presence = self.presences.get(presence_data['user']['id'])  # should only be None if it's a new Member
-        self.presences[presence_data['user']['id']] = MemberPresence.from_api(presence_data)
-        if old_presence:
+        """
+        Status changes are coalesced: a change waits in self.pending_presences until it has held for SETTLE_TIME,
+        a newer change replaces it and a change back to the settled status drops it,
+        so clients flapping between statuses or mass reconnects do not produce near-zero presence intervals.
+        """
+        user_id = presence_data['user']['id']
+        status = presence_data['status']
+        settled_status = self.presences.get_status(user_id)
+        pending = self.pending_presences.get(user_id)
+        # updates of activities and such keep the status, so keep the time it was set at as well
+        if (pending.status if pending is not None else settled_status) == status:
+            return
+        stats = self.bot.presence_stats
+        stats.updates += 1
+        if settled_status is None:  # a new Member
+            self.presences.set(intern(user_id), status)
+            return
+        if pending is not None:
+            stats.merged += 1
+        if status == settled_status:
+            stats.merged += 1
+            del self.pending_presences[user_id]
+        else:
+            self.pending_presences[intern(user_id)] = MemberPresence(status)
+
+    async def settle_presences(self, now: float | None = None):
+        """
+        Apply the status changes held for SETTLE_TIME, dispatch BOT_MEMBER_PRESENCE_CHANGE for each.
+        Without now all the pending changes are applied at the time they happened, e.g. on close.
+        """
+        settled = [
+            (user_id, i) for user_id, i in self.pending_presences.items() if now is None or now - i.at >= SETTLE_TIME
+        ]
+        for user_id, presence in settled:
+            del self.pending_presences[user_id]
+            old_presence = self.presences.set(user_id, presence.status, presence.at)
+            self.bot.presence_stats.settled += 1
             await self.bot.event_dispatcher.dispatch(
-                'BOT_MEMBER_PRESENCE_CHANGE',
-                old_presence,  # old presence
-                presence_data  # new presence
+                'BOT_MEMBER_PRESENCE_CHANGE', self.id, user_id, old_presence, presence
             )
 
     def is_admin(self, member: Member) -> bool:
@@ -246,11 +407,54 @@ class Guild(DiscordObject):
         return False
 
     async def fetch_member(self, user_id: str) -> Member | None:
-        """ Get existing from self.members or fetch from discord API and save to self.members """
+        """
+        Get existing from self.members or fetch from discord API and save to self.members.
+        Concurrent lookups of the same member share a single request, users not found are remembered
+        for MEMBER_NOT_FOUND_TTL seconds.
+        """
+        stats = self.bot.member_fetch_stats
         if (member := self.members.get(user_id)) is not None:
+            stats.hits += 1
             return member
+        if missing_members.get((self.id, user_id)):
+            stats.not_found_hits += 1
+            return None
+
+        if (task := self._member_fetches.get(user_id)) is not None:
+            stats.shared += 1
+        else:
+            stats.misses += 1
+            task = self._member_fetches[user_id] = asyncio.create_task(self._fetch_member(user_id))
+            task.add_done_callback(lambda _: self._member_fetches.pop(user_id, None))
+        # a cancelled caller does not cancel the request the others are waiting for
+        return await asyncio.shield(task)
+
+    async def _fetch_member(self, user_id: str) -> Member | None:
         try:
-            self.members[user_id] = Member.from_api(await self.bot.api_get(f'/guilds/{self.id}/members/{user_id}'))
-            return self.members[user_id]
+            member = Member.from_api(await self.bot.api_get(f'/guilds/{self.id}/members/{user_id}'))
         except NotFoundError:
+            self.bot.member_fetch_stats.not_found += 1
+            missing_members.set((self.id, user_id), True)
             return None
+        except Exception:
+            self.bot.member_fetch_stats.errors += 1
+            raise
+        if (existing := self.members.get(member.id)) is not None:
+            return existing  # GUILD_MEMBER_ADD was received meanwhile
+        self.members[member.id] = member
+        self._index_member_roles(member.id, (), member.roles)
+        return member
+
+    def has_role(self, member_id: str, role_id: str) -> bool:
+        """ Check if a cached guild member has the role """
+        return member_id in self.role_members.get(role_id, ())
+
+    def role_member_ids(self, role_id: str) -> set[str]:
+        """ Ids of cached guild members with the role, the returned set must not be modified """
+        return self.role_members.get(role_id, set())
+
+    def members_with_role(self, role_id: str) -> list[Member]:
+        return [self.members[member_id] for member_id in self.role_members.get(role_id, ())]
+
+    def count_role_members(self, role_id: str) -> int:
+        return len(self.role_members.get(role_id, ()))
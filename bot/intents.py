@@ -0,0 +1,87 @@
+from __future__ import annotations
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from typing import Iterable
+
+"""
+Discord gateway intents the bot listeners need.
+See https://discord.com/developers/docs/topics/gateway#gateway-intents
+"""
+
+INTENTS = {
+    'GUILDS': 1 << 0,
+    'GUILD_MEMBERS': 1 << 1,
+    'GUILD_MODERATION': 1 << 2,
+    'GUILD_EMOJIS_AND_STICKERS': 1 << 3,
+    'GUILD_INTEGRATIONS': 1 << 4,
+    'GUILD_WEBHOOKS': 1 << 5,
+    'GUILD_INVITES': 1 << 6,
+    'GUILD_VOICE_STATES': 1 << 7,
+    'GUILD_PRESENCES': 1 << 8,
+    'GUILD_MESSAGES': 1 << 9,
+    'GUILD_MESSAGE_REACTIONS': 1 << 10,
+    'GUILD_MESSAGE_TYPING': 1 << 11,
+    'DIRECT_MESSAGES': 1 << 12,
+    'DIRECT_MESSAGE_REACTIONS': 1 << 13,
+    'DIRECT_MESSAGE_TYPING': 1 << 14,
+    'MESSAGE_CONTENT': 1 << 15,
+    'GUILD_SCHEDULED_EVENTS': 1 << 16,
+    'AUTO_MODERATION_CONFIGURATION': 1 << 20,
+    'AUTO_MODERATION_EXECUTION': 1 << 21,
+}
+
+# gateway events sent only with an intent, the rest (READY, INTERACTION_CREATE, ...) are always sent
+EVENT_INTENTS = {
+    **dict.fromkeys((
+        'GUILD_CREATE', 'GUILD_UPDATE', 'GUILD_DELETE', 'GUILD_ROLE_CREATE', 'GUILD_ROLE_UPDATE', 'GUILD_ROLE_DELETE',
+        'CHANNEL_CREATE', 'CHANNEL_UPDATE', 'CHANNEL_DELETE', 'CHANNEL_PINS_UPDATE', 'THREAD_CREATE', 'THREAD_UPDATE',
+        'THREAD_DELETE', 'THREAD_LIST_SYNC', 'THREAD_MEMBER_UPDATE', 'STAGE_INSTANCE_CREATE', 'STAGE_INSTANCE_UPDATE',
+        'STAGE_INSTANCE_DELETE'
+    ), 'GUILDS'),
+    **dict.fromkeys(('GUILD_MEMBER_ADD', 'GUILD_MEMBER_UPDATE', 'GUILD_MEMBER_REMOVE', 'THREAD_MEMBERS_UPDATE'),
+                    'GUILD_MEMBERS'),
+    **dict.fromkeys(('GUILD_AUDIT_LOG_ENTRY_CREATE', 'GUILD_BAN_ADD', 'GUILD_BAN_REMOVE'), 'GUILD_MODERATION'),
+    **dict.fromkeys(('GUILD_EMOJIS_UPDATE', 'GUILD_STICKERS_UPDATE'), 'GUILD_EMOJIS_AND_STICKERS'),
+    **dict.fromkeys(('GUILD_INTEGRATIONS_UPDATE', 'INTEGRATION_CREATE', 'INTEGRATION_UPDATE', 'INTEGRATION_DELETE'),
+                    'GUILD_INTEGRATIONS'),
+    'WEBHOOKS_UPDATE': 'GUILD_WEBHOOKS',
+    **dict.fromkeys(('INVITE_CREATE', 'INVITE_DELETE'), 'GUILD_INVITES'),
+    'VOICE_STATE_UPDATE': 'GUILD_VOICE_STATES',
+    'PRESENCE_UPDATE': 'GUILD_PRESENCES',
+    **dict.fromkeys(('MESSAGE_CREATE', 'MESSAGE_UPDATE', 'MESSAGE_DELETE', 'MESSAGE_DELETE_BULK'), 'GUILD_MESSAGES'),
+    **dict.fromkeys((
+        'MESSAGE_REACTION_ADD', 'MESSAGE_REACTION_REMOVE', 'MESSAGE_REACTION_REMOVE_ALL',
+        'MESSAGE_REACTION_REMOVE_EMOJI'
+    ), 'GUILD_MESSAGE_REACTIONS'),
+    'TYPING_START': 'GUILD_MESSAGE_TYPING',
+    **dict.fromkeys((
+        'GUILD_SCHEDULED_EVENT_CREATE', 'GUILD_SCHEDULED_EVENT_UPDATE', 'GUILD_SCHEDULED_EVENT_DELETE',
+        'GUILD_SCHEDULED_EVENT_USER_ADD', 'GUILD_SCHEDULED_EVENT_USER_REMOVE'
+    ), 'GUILD_SCHEDULED_EVENTS'),
+    **dict.fromkeys(('AUTO_MODERATION_RULE_CREATE', 'AUTO_MODERATION_RULE_UPDATE', 'AUTO_MODERATION_RULE_DELETE'),
+                    'AUTO_MODERATION_CONFIGURATION'),
+    'AUTO_MODERATION_ACTION_EXECUTION': 'AUTO_MODERATION_EXECUTION',
+}
+
+# events dispatched by the bot itself and the gateway events they are made from
+DERIVED_EVENTS = {
+    'BOT_MEMBER_PRESENCE_CHANGE': ('PRESENCE_UPDATE',),
+}
+
+
+def gateway_events(events: Iterable[str]) -> set[str]:
+    """ Gateway events the events are made from """
+    return set().union(*(DERIVED_EVENTS.get(event, (event,)) for event in events))
+
+
+def required_intents(events: Iterable[str]) -> int:
+    intents = 0
+    for event in gateway_events(events):
+        if (intent := EVENT_INTENTS.get(event)) is not None:
+            intents |= INTENTS[intent]
+    return intents
+
+
+def intent_names(intents: int) -> list[str]:
+    return [name for name, bit in INTENTS.items() if intents & bit]
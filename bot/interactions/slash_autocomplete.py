@@ -3,6 +3,7 @@ from typing import TYPE_CHECKING
 from logging import getLogger
 from nextcore.http import Route
 
+from db import db_tag
 from bot import Member
 
 if TYPE_CHECKING:
@@ -35,6 +36,7 @@ class SlashAutocompleteInteraction:
                     return sub_option
 
     async def answer(self):
+        db_tag.set(f'autocomplete {self.option}')
         if self.callback is not None:
             choices: list[dict] = await self.callback(self)
         else:
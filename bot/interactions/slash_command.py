@@ -8,6 +8,7 @@ from nextcore.http import Route
 from nextcore.http.errors import HTTPRequestStatusError, ForbiddenError
 from aiohttp.http_exceptions import HttpProcessingError
 
+from db import db_tag
 from bot import errors, Member
 from common import Colors
 
@@ -67,6 +68,7 @@ class SlashCommandInteraction:
             return
 
         logger.debug(f'Running slash command /{self.name} {self.options}')
+        db_tag.set(f'/{self.name}')
         if self.callback.expensive:
             await self._run_expensive_callback()
         else:
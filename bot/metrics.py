@@ -0,0 +1,185 @@
+from __future__ import annotations
+from typing import TYPE_CHECKING
+from bisect import bisect_left
+from collections import defaultdict
+from time import time, perf_counter
+from nextcore.common import Dispatcher
+from nextcore.common.maybe_coro import maybe_coro
+
+if TYPE_CHECKING:
+    from typing import Any, Callable, Literal
+
+"""
+Gateway events dispatch metrics.
+MetricsDispatcher is the bot event_dispatcher, it counts the dispatched events per type
+and times every listener run, keyed by (event, listener), so the stats cover the module listeners
+registered with @bot.event_dispatcher.listen() as well as the BotEvents ones.
+"""
+
+# upper bounds of the listener latency histogram buckets (seconds), the last bucket counts anything slower
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+RATE_WINDOW = 60  # seconds to compute the recent events rate over
+
+
+def _callback_name(callback: Callable) -> str:
+    callback = getattr(callback, 'func', callback)  # functools.partial
+    return f"{getattr(callback, '__module__', '?')}.{getattr(callback, '__qualname__', repr(callback))}"
+
+
+class EventStats:
+    """ Number of dispatched events of a type, in total and per second over the last RATE_WINDOW seconds """
+
+    __slots__ = ('count', '_seconds', '_counts')
+
+    def __init__(self):
+        self.count = 0
+        self._seconds = [0] * RATE_WINDOW
+        self._counts = [0] * RATE_WINDOW
+
+    def add(self):
+        self.count += 1
+        second = int(time())
+        i = second % RATE_WINDOW
+        if self._seconds[i] != second:
+            self._seconds[i], self._counts[i] = second, 0
+        self._counts[i] += 1
+
+    def rate(self) -> float:
+        since = int(time()) - RATE_WINDOW
+        return sum(c for s, c in zip(self._seconds, self._counts) if s > since) / RATE_WINDOW
+
+
+class HandlerStats:
+    """ Runs, latency histogram, in-flight runs and exceptions of a listener of an event """
+
+    __slots__ = ('calls', 'errors', 'in_flight', 'max_in_flight', 'total_time', 'max_time', 'buckets', 'last_error')
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.last_error: str | None = None
+
+    def add(self, duration: float):
+        self.calls += 1
+        self.total_time += duration
+        self.max_time = max(self.max_time, duration)
+        self.buckets[bisect_left(LATENCY_BUCKETS, duration)] += 1
+
+    def percentile(self, p: float) -> float:
+        """ Upper bound of the histogram bucket the percentile falls in, max_time for the last bucket """
+        if not self.calls:
+            return 0.0
+        rank = p * self.calls
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS, self.buckets):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max_time)
+        return self.max_time
+
+    def json(self) -> dict:
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'in_flight': self.in_flight,
+            'max_in_flight': self.max_in_flight,
+            'total_time': self.total_time,
+            'avg_time': self.total_time / self.calls if self.calls else 0.0,
+            'p50_time': self.percentile(0.5),
+            'p95_time': self.percentile(0.95),
+            'p99_time': self.percentile(0.99),
+            'max_time': self.max_time,
+            'histogram': {str(bound): count for bound, count in zip((*LATENCY_BUCKETS, 'inf'), self.buckets)},
+            'last_error': self.last_error
+        }
+
+
+class EventMetrics:
+
+    def __init__(self):
+        self.started_at = time()
+        self.events: defaultdict[str, EventStats] = defaultdict(EventStats)
+        self.handlers: dict[tuple[str, str], HandlerStats] = {}
+
+    def handler(self, event_name: str, callback: Callable) -> HandlerStats:
+        key = (event_name, _callback_name(callback))
+        if (stats := self.handlers.get(key)) is None:
+            stats = self.handlers[key] = HandlerStats()
+        return stats
+
+    def reset(self):
+        self.__init__()
+
+    def top(self, by: Literal['total', 'p95', 'max', 'calls', 'errors'] = 'total', limit: int = 20) -> str:
+        """ Top listeners as a text table, for the CLI """
+        key = {
+            'total': lambda i: i[1].total_time,
+            'p95': lambda i: i[1].percentile(0.95),
+            'max': lambda i: i[1].max_time,
+            'calls': lambda i: i[1].calls,
+            'errors': lambda i: i[1].errors
+        }[by]
+        lines = [f'{"ev/s":>8}{"calls":>9}{"errors":>7}{"in fl":>6}{"total, s":>10}{"avg, ms":>9}{"p95, ms":>9}'
+                 f'{"max, ms":>9}  event / listener']
+        for (event_name, name), stats in sorted(self.handlers.items(), key=key, reverse=True)[:limit]:
+            lines.append(
+                f'{self.events[event_name].rate():>8.2f}{stats.calls:>9}{stats.errors:>7}{stats.in_flight:>6}'
+                f'{stats.total_time:>10.2f}{stats.total_time / (stats.calls or 1) * 1000:>9.2f}'
+                f'{stats.percentile(0.95) * 1000:>9.2f}{stats.max_time * 1000:>9.2f}  {event_name} / {name}'
+            )
+        return '\n'.join(lines)
+
+    def json(self) -> dict:
+        handlers = defaultdict(list)
+        for (event_name, name), stats in self.handlers.items():
+            handlers[event_name].append({'handler': name, **stats.json()})
+        return {
+            'uptime': time() - self.started_at,
+            'latency_buckets': LATENCY_BUCKETS,
+            'events': {
+                event_name: {'count': stats.count, 'rate': stats.rate(), 'handlers': handlers.get(event_name, [])}
+                for event_name, stats in self.events.items()
+            }
+        }
+
+
+class MetricsDispatcher(Dispatcher):
+    """ Dispatcher accounting the dispatched events and the listeners runs in EventMetrics """
+
+    def __init__(self):
+        super().__init__()
+        self.metrics = EventMetrics()
+
+    def listeners(self) -> dict[str, list[Callable]]:
+        """ Listeners per event name, without the global ones """
+        return {event_name: list(callbacks) for event_name, callbacks in self._event_handlers.items() if len(callbacks)}
+
+    async def dispatch(self, event_name: str, *args: Any) -> None:
+        self.metrics.events[event_name].add()
+        await super().dispatch(event_name, *args)
+
+    async def _run_event_handler(self, callback: Callable, event_name: str, *args: Any) -> None:
+        stats = self.metrics.handler(event_name, callback)
+
+        async def _measured(*a):
+            try:
+                return await maybe_coro(callback, *a)
+            except Exception as e:
+                stats.errors += 1
+                stats.last_error = f'{type(e).__name__}: {e}'
+                raise
+
+        stats.in_flight += 1
+        stats.max_in_flight = max(stats.max_in_flight, stats.in_flight)
+        started_at = perf_counter()
+        try:
+            # the exception handlers of the base class run inside the measured time, there are none in the bot
+            await super()._run_event_handler(_measured, event_name, *args)
+        finally:
+            stats.in_flight -= 1
+            stats.add(perf_counter() - started_at)
@@ -2,16 +2,24 @@ from __future__ import annotations
 from typing import TYPE_CHECKING
 from logging import getLogger
 from time import time
+from sys import intern
 
 if TYPE_CHECKING:
+    from typing import Iterable
     from discord_typings import ChannelData, ThreadChannelData, GuildMemberData, RoleData, PresenceUpdateData
 
     from bot import Guild
 
 logger = getLogger(__name__)
 
+"""
+State objects are kept for every member of every guild, so they are slotted and the snowflake ids and
+other repeating strings are interned to share a single string object between all the references.
+"""
+
 
 class DiscordObject:
+    __slots__ = ()
     _fields = []
 
     def json(self) -> dict:
@@ -22,10 +30,11 @@ class DiscordObject:
 
 
 class Channel(DiscordObject):
+    __slots__ = ('id', 'type', 'name')
     _fields = ['id', 'type', 'name']
 
     def __init__(self, data: ChannelData):
-        self.id: str = data['id']
+        self.id: str = intern(data['id'])
         self.type: int = data['type']
         self.name: str = data['name']
 
@@ -38,10 +47,11 @@ class Channel(DiscordObject):
 
 
 class Thread(DiscordObject):
+    __slots__ = ('id', 'name', 'type', 'archived')
     _fields = ['id', 'name', 'archived']
 
     def __init__(self, data: ThreadChannelData):
-        self.id = data['id']
+        self.id = intern(data['id'])
         self.name = data['name']
         self.type = data['type']
         self.archived = data['thread_metadata']['archived']
@@ -52,20 +62,21 @@ class Thread(DiscordObject):
 
 
 class Member(DiscordObject):
+    __slots__ = ('id', 'username', 'global_name', 'bot', 'display_name', 'avatar', 'fake', 'roles')
     _fields = ['id', 'username', 'global_name', 'bot', 'display_name', 'roles', 'avatar', 'fake']
 
     def __init__(
             self, user_id: str, username: str, global_name: str, bot: bool, nick: str | None, avatar: str | None,
-            fake: bool, roles: list[str]
+            fake: bool, roles: Iterable[str]
     ):
-        self.id = user_id
+        self.id = intern(user_id)
         self.username = username
         self.global_name = global_name
         self.bot = bot
         self.display_name = nick or self.global_name or self.username
         self.avatar = avatar
         self.fake = fake
-        self.roles = roles
+        self.roles: tuple[str, ...] = tuple(map(intern, roles))
 
     def __repr__(self):
         return f'<Member {self.username} id={self.id}>'
@@ -104,18 +115,19 @@ class Member(DiscordObject):
         self.username = data['user']['username']
         self.global_name = data['user']['global_name']
         self.display_name = data['nick'] or self.display_name
-        self.roles = data['roles']
+        self.roles = tuple(map(intern, data['roles']))
 
     def __eq__(self, other):
         return self.id == other.id
 
 
 class MemberPresence(DiscordObject):
+    __slots__ = ('status', 'at')
     _fields = ['status', 'at']
 
-    def __init__(self, status: str):
-        self.status = status
-        self.at = int(time())
+    def __init__(self, status: str, at: int = None):
+        self.status = intern(status)
+        self.at = int(time()) if at is None else at
 
     @classmethod
     def from_api(cls, data: PresenceUpdateData):
@@ -126,11 +138,12 @@ class MemberPresence(DiscordObject):
 
 class FakeMember(Member):
     """ Represents unreachable or completely fake Member """
+    __slots__ = ()
 
     def __init__(self, user_id: str, username: str):
         super().__init__(
             user_id=user_id, username=username, global_name=username, bot=False, nick=None, avatar=None,
-            fake=True, roles=[]
+            fake=True, roles=()
         )
 
     def __repr__(self):
@@ -141,10 +154,11 @@ class FakeMember(Member):
 
 
 class Role(DiscordObject):
+    __slots__ = ('id', 'name', 'permissions')
     _fields = ['id', 'name', 'permissions']
 
     def __init__(self, data: RoleData):
-        self.id = data['id']
+        self.id = intern(data['id'])
         self.name = data['name']
         self.permissions = data['permissions']
 
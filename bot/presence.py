@@ -0,0 +1,122 @@
+from __future__ import annotations
+from typing import TYPE_CHECKING
+from array import array
+from time import time
+
+from .objects import MemberPresence
+
+if TYPE_CHECKING:
+    from typing import Iterator
+
+"""
+Columnar per-guild members presence store.
+Every member gets a slot index in two arrays, a status code byte and the time the status was set at,
+so presence updates do not allocate and the number of members per status is kept up to date.
+The table holds settled statuses only, see Guild.update_member_presence() for the coalescing of status changes.
+"""
+
+STATUSES = ('online', 'idle', 'dnd', 'offline')
+STATUS_CODES = {status: code for code, status in enumerate(STATUSES)}
+OFFLINE = STATUS_CODES['offline']
+SETTLE_TIME = 10  # seconds a new status must hold to be applied, shorter intervals are merged into the previous one
+
+
+class CoalescingStats:
+    """ Status changes received vs settled, every settled change is written to the stats as a presence interval """
+
+    __slots__ = ('updates', 'merged', 'settled')
+
+    def __init__(self):
+        self.updates = 0  # status changing PRESENCE_UPDATE events
+        self.merged = 0  # changes superseded or reverted before they settled, not written
+        self.settled = 0  # changes held for SETTLE_TIME and dispatched as BOT_MEMBER_PRESENCE_CHANGE
+
+    def json(self) -> dict:
+        return {
+            'updates': self.updates,
+            'merged': self.merged,
+            'settled': self.settled,
+            'saved_writes_share': self.merged / self.updates if self.updates else 0.0
+        }
+
+
+class PresenceTable:
+    """ Dict-like {user_id: MemberPresence} view over the presence arrays """
+
+    def __init__(self):
+        self.slots: dict[str, int] = {}
+        self.free_slots: list[int] = []
+        self._status = array('B')
+        self._since = array('q')
+        self._counts = [0] * len(STATUSES)
+
+    def __len__(self) -> int:
+        return len(self.slots)
+
+    def __contains__(self, user_id: str) -> bool:
+        return user_id in self.slots
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.slots)
+
+    def get(self, user_id: str, default: MemberPresence | None = None) -> MemberPresence | None:
+        if (slot := self.slots.get(user_id)) is None:
+            return default
+        return MemberPresence(STATUSES[self._status[slot]], at=self._since[slot])
+
+    def get_status(self, user_id: str) -> str | None:
+        """ Same as get(user_id).status, without creating the MemberPresence object """
+        if (slot := self.slots.get(user_id)) is None:
+            return None
+        return STATUSES[self._status[slot]]
+
+    def items(self) -> Iterator[tuple[str, MemberPresence]]:
+        for user_id, slot in self.slots.items():
+            yield user_id, MemberPresence(STATUSES[self._status[slot]], at=self._since[slot])
+
+    def set(self, user_id: str, status: str, at: int = None) -> MemberPresence | None:
+        """ Set a member status, return the previous presence if the member had one """
+        code = STATUS_CODES.get(status, OFFLINE)
+        at = int(time()) if at is None else at
+        if (slot := self.slots.get(user_id)) is not None:
+            old_code = self._status[slot]
+            old_presence = MemberPresence(STATUSES[old_code], at=self._since[slot])
+            self._counts[old_code] -= 1
+            self._status[slot], self._since[slot] = code, at
+            self._counts[code] += 1
+            return old_presence
+
+        if len(self.free_slots):
+            slot = self.free_slots.pop()
+            self._status[slot], self._since[slot] = code, at
+        else:
+            slot = len(self._status)
+            self._status.append(code)
+            self._since.append(at)
+        self.slots[user_id] = slot
+        self._counts[code] += 1
+        return None
+
+    def pop(self, user_id: str, default: MemberPresence | None = None) -> MemberPresence | None:
+        if (slot := self.slots.pop(user_id, None)) is None:
+            return default
+        code = self._status[slot]
+        self._counts[code] -= 1
+        self.free_slots.append(slot)
+        return MemberPresence(STATUSES[code], at=self._since[slot])
+
+    def dump(self) -> dict:
+        """ JSON-able copy of the table for the state snapshot, see bot/snapshot.py """
+        slots = list(self.slots.values())
+        return {
+            'users': list(self.slots),
+            'statuses': [self._status[i] for i in slots],
+            'since': [self._since[i] for i in slots]
+        }
+
+    def count(self, status: str) -> int:
+        """ Number of members with the status """
+        return self._counts[STATUS_CODES[status]]
+
+    def counts(self) -> dict[str, int]:
+        return dict(zip(STATUSES, self._counts))
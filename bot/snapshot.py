@@ -0,0 +1,131 @@
+from __future__ import annotations
+from typing import TYPE_CHECKING
+import os
+import gzip
+import json
+import asyncio
+from logging import getLogger
+from time import time, perf_counter
+
+from config import STATE_SNAPSHOT_PATH, STATE_SNAPSHOT_MAX_AGE
+from .objects import MemberPresence
+from .presence import STATUSES
+import cluster
+
+if TYPE_CHECKING:
+    from . import Bot
+
+"""
+On-disk snapshot of the members presences with the time each status was set at, written on close.
+On start the snapshot is loaded and every guild presences are reconciled with its GUILD_CREATE in Guild.hydrate():
+a member with the same status keeps the time it was set at, so presence intervals continue across restarts
+and the bot does not have to write the open intervals of the saved guilds on close.
+The intervals that did not continue (status changed or the member left meanwhile, or the snapshot is older than
+STATE_SNAPSHOT_MAX_AGE) are dispatched as BOT_PRESENCES_ENDED, ended at the time the snapshot was saved at.
+The snapshot is written on close only and removed once loaded: the intervals of a snapshot saved while running
+may have been written to the stats already by the status changes after it, and could not be told apart.
+It is written to a temporary file renamed once complete, so a crash while writing never leaves a partial snapshot.
+The status changes still settling on close are applied before, at the time they happened.
+Members, roles and channels are not stored, Discord sends all of them in GUILD_CREATE on every new session anyway.
+"""
+
+logger = getLogger(__name__)
+SNAPSHOT_VERSION = 1
+
+
+def _snapshot_path() -> str | None:
+    if STATE_SNAPSHOT_PATH is None or cluster.WORKER_ID is None:
+        return STATE_SNAPSHOT_PATH
+    return f'{STATE_SNAPSHOT_PATH}.{cluster.WORKER_ID}'  # every cluster worker keeps the state of its own shards
+
+
+def _write(path: str, data: dict) -> int:
+    tmp_path = path + '.tmp'
+    with gzip.open(tmp_path, 'wt', encoding='utf-8', compresslevel=1) as f:
+        json.dump(data, f, separators=(',', ':'))
+    os.replace(tmp_path, path)  # a crash while writing keeps the previous snapshot
+    return os.path.getsize(path)
+
+
+def _read(path: str) -> dict:
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        return json.load(f)
+
+
+class StateSnapshot:
+
+    def __init__(self, bot: Bot):
+        self.bot = bot
+        self.path = _snapshot_path()
+        self.saved_at: int | None = None  # time the loaded snapshot was saved at
+        self.guilds: dict[str, dict[str, tuple[int, int]]] = {}  # {guild_id: {user_id: (status code, since)}}
+        self.saved_guilds: set[str] = set()  # guilds written to the snapshot on close
+
+    async def save(self):
+        """ Write the presences of all the hydrated guilds on close, self.saved_guilds are set once it is written """
+        if self.path is None:
+            return
+        started_at = perf_counter()
+        guilds = {}
+        for guild_id, guild in list(self.bot.guilds.items()):
+            if guild.hydrating:
+                continue
+            guilds[guild_id] = guild.presences.dump()
+            await asyncio.sleep(0)  # large guilds are copied one at a time, between the event loop iterations
+        data = {'version': SNAPSHOT_VERSION, 'saved_at': int(time()), 'guilds': guilds}
+        try:
+            size = await asyncio.get_running_loop().run_in_executor(None, _write, self.path, data)
+        except OSError as e:
+            logger.error(f'Failed to write the state snapshot to {self.path}: {e}')
+            return
+        self.saved_guilds = set(guilds)
+        logger.info(
+            f'Saved the state snapshot of {len(guilds)} guilds, {size / 2**20:.1f} MiB '
+            f'in {perf_counter() - started_at:.2f}s.'
+        )
+
+    async def load(self):
+        """ Load the snapshot written by the previous run, the intervals of a too old one are ended at once """
+        if self.path is None or not os.path.exists(self.path):
+            return
+        try:
+            data = await asyncio.get_running_loop().run_in_executor(None, _read, self.path)
+        except (OSError, ValueError) as e:
+            logger.error(f'Failed to read the state snapshot {self.path}, ignoring it: {e}')
+            return
+        finally:
+            # the intervals are continued or ended from now on, a crash later must not load them again
+            try:
+                os.remove(self.path)
+            except OSError as e:
+                logger.error(f'Failed to remove the state snapshot {self.path}: {e}')
+        if data.get('version') != SNAPSHOT_VERSION:
+            logger.warning(f"Ignoring the state snapshot of version {data.get('version')}.")
+            return
+
+        self.saved_at = data['saved_at']
+        self.guilds = {
+            guild_id: dict(zip(presences['users'], zip(presences['statuses'], presences['since'])))
+            for guild_id, presences in data['guilds'].items()
+        }
+        if time() - self.saved_at > STATE_SNAPSHOT_MAX_AGE:
+            logger.warning(f'The state snapshot is {int(time()) - self.saved_at}s old, presences will not continue.')
+            await self.end_remaining()
+            return
+        logger.info(f'Loaded the state snapshot of {len(self.guilds)} guilds saved {int(time()) - self.saved_at}s ago.')
+
+    def pop(self, guild_id: str) -> dict[str, tuple[int, int]] | None:
+        """ Presences of a guild as {user_id: (status code, since)}, to be reconciled by Guild.hydrate() """
+        return self.guilds.pop(guild_id, None)
+
+    async def end_presences(self, guild_id: str, presences: list[tuple[str, MemberPresence]]):
+        if len(presences):
+            await self.bot.event_dispatcher.dispatch('BOT_PRESENCES_ENDED', guild_id, presences, self.saved_at)
+
+    async def end_remaining(self):
+        """ End the intervals of the guilds no GUILD_CREATE was received for """
+        for guild_id, presences in self.guilds.items():
+            await self.end_presences(guild_id, [
+                (user_id, MemberPresence(STATUSES[code], at=since)) for user_id, (code, since) in presences.items()
+            ])
+        self.guilds.clear()
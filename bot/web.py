@@ -0,0 +1,105 @@
+from __future__ import annotations
+from typing import TYPE_CHECKING
+from collections import defaultdict
+from time import perf_counter
+import aiohttp
+
+from config import WEB_CLIENT_LIMIT, WEB_CLIENT_LIMIT_PER_HOST, WEB_CLIENT_TIMEOUT, WEB_CLIENT_DNS_TTL, \
+    WEB_CLIENT_KEEPALIVE
+from .metrics import HandlerStats
+
+if TYPE_CHECKING:
+    from types import SimpleNamespace
+
+"""
+Pooled HTTP client for the third-party APIs (twitch, danbooru, ip-api, discord oauth2...), owned by the bot.
+All the requests share a single aiohttp session, so the connections are kept alive and reused,
+resolved hosts are cached for WEB_CLIENT_DNS_TTL seconds and the connections per host are limited.
+Requests, latency and new vs reused connections are accounted per host.
+"""
+
+
+class HostStats(HandlerStats):
+    """ Requests of a host with the latency histogram, plus the connections opened and reused """
+
+    __slots__ = ('connections', 'reused')
+
+    def __init__(self):
+        super().__init__()
+        self.connections = 0
+        self.reused = 0
+
+    def json(self) -> dict:
+        return {
+            **super().json(),
+            'connections': self.connections,
+            'reused': self.reused,
+            'reuse_share': self.reused / (self.connections + self.reused) if self.connections + self.reused else 0.0
+        }
+
+
+class WebClient:
+
+    def __init__(self):
+        self.hosts: defaultdict[str, HostStats] = defaultdict(HostStats)
+        self._session: aiohttp.ClientSession | None = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        """ The shared session, created on first use inside the running event loop """
+        if self._session is None or self._session.closed:
+            trace_config = aiohttp.TraceConfig()
+            trace_config.on_request_start.append(self._on_request_start)
+            trace_config.on_request_end.append(self._on_request_end)
+            trace_config.on_request_exception.append(self._on_request_exception)
+            trace_config.on_connection_create_end.append(self._on_connection_create_end)
+            trace_config.on_connection_reuseconn.append(self._on_connection_reuseconn)
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=WEB_CLIENT_LIMIT,
+                    limit_per_host=WEB_CLIENT_LIMIT_PER_HOST,
+                    ttl_dns_cache=WEB_CLIENT_DNS_TTL,
+                    keepalive_timeout=WEB_CLIENT_KEEPALIVE
+                ),
+                timeout=aiohttp.ClientTimeout(total=WEB_CLIENT_TIMEOUT),
+                trace_configs=[trace_config]
+            )
+        return self._session
+
+    def get(self, url: str, **kwargs):
+        """ Same as aiohttp.ClientSession.get(), use as `async with bot.web.get(url) as resp:` """
+        return self.session.get(url, **kwargs)
+
+    def post(self, url: str, **kwargs):
+        return self.session.post(url, **kwargs)
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+    def json(self) -> dict:
+        return {host: stats.json() for host, stats in self.hosts.items()}
+
+    async def _on_request_start(self, session, ctx: SimpleNamespace, params: aiohttp.TraceRequestStartParams):
+        ctx.stats = self.hosts[params.url.host]
+        ctx.stats.in_flight += 1
+        ctx.stats.max_in_flight = max(ctx.stats.max_in_flight, ctx.stats.in_flight)
+        ctx.started_at = perf_counter()
+
+    async def _on_request_end(self, session, ctx: SimpleNamespace, params: aiohttp.TraceRequestEndParams):
+        ctx.stats.in_flight -= 1
+        ctx.stats.add(perf_counter() - ctx.started_at)
+
+    async def _on_request_exception(
+            self, session, ctx: SimpleNamespace, params: aiohttp.TraceRequestExceptionParams
+    ):
+        ctx.stats.in_flight -= 1
+        ctx.stats.add(perf_counter() - ctx.started_at)
+        ctx.stats.errors += 1
+        ctx.stats.last_error = f'{type(params.exception).__name__}: {params.exception}'
+
+    async def _on_connection_create_end(self, session, ctx: SimpleNamespace, params):
+        ctx.stats.connections += 1
+
+    async def _on_connection_reuseconn(self, session, ctx: SimpleNamespace, params):
+        ctx.stats.reused += 1
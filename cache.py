@@ -1,42 +1,176 @@
+from __future__ import annotations
+from typing import TYPE_CHECKING
+from collections import OrderedDict
 from time import time
-from asyncio import sleep as asleep
 from logging import getLogger
-from typing import Callable
+import asyncio
+import json
+
+if TYPE_CHECKING:
+    from typing import Any, Callable, Awaitable, Hashable
+
+"""
+LRU cache with a time to live per entry and an optional bound on the size of the cached values.
+Concurrent get_or_fetch() misses of a key share a single fetch, and an entry may be served for a while after it
+expired (stale_ttl) while it is fetched again in the background.
+Every Cache registers itself in `caches` by its name, so the hit/miss/eviction counters can be monitored.
+"""
 
 logger = getLogger(__name__)
+caches: dict[str, Cache] = {}
+_MISSING = object()  # get() default telling an absent key from a cached None
+
+
+def _json_size(value: Any) -> int:
+    """ Approximate size of an API response, the length of its JSON """
+    return len(json.dumps(value, default=str))
+
+
+class Cache:
+
+    def __init__(
+            self, name: str, max_entries: int = 100, ttl: int | float = 300, max_bytes: int | None = None,
+            sizeof: Callable[[Any], int] = _json_size
+    ):
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl = ttl  # default time to live of an entry (seconds)
+        self.max_bytes = max_bytes  # values size bound, sizes are not computed without it
+        self.sizeof = sizeof
+        # {key: (value, expires_at, stale_until, size)}
+        self.d: OrderedDict[Hashable, tuple[Any, float, float, int]] = OrderedDict()
+        self.bytes = 0
+        self._fetches: dict[Hashable, asyncio.Task] = {}  # get_or_fetch() fetches in flight
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0  # least recently used entries dropped for the bounds
+        self.expirations = 0  # entries dropped when found expired
+        self.shared = 0  # misses which waited for a fetch already in flight
+        self.stale_hits = 0  # expired entries served while fetched again
+        self.stale_misses = 0  # expired entries kept for get_or_fetch() but not served by get()
+        self.fetch_errors = 0
+        caches[name] = self
+
+    def __len__(self) -> int:
+        return len(self.d)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return (entry := self.d.get(key)) is not None and time() < entry[1]
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        if (entry := self.d.get(key)) is not None:
+            if (now := time()) < entry[1]:
+                self.d.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if now < entry[2]:
+                self.stale_misses += 1
+                return default
+            self._drop(key)
+            self.expirations += 1
+        self.misses += 1
+        return default
+
+    def set(self, key: Hashable, value: Any, ttl: int | float | None = None, stale_ttl: int | float = 0):
+        """ Cache the value for ttl seconds, get_or_fetch() may serve it stale for stale_ttl seconds more """
+        if key in self.d:
+            self._drop(key)
+        size = self.sizeof(value) if self.max_bytes is not None else 0
+        expires_at = time() + (self.ttl if ttl is None else ttl)
+        self.d[key] = (value, expires_at, expires_at + stale_ttl, size)
+        self.bytes += size
+        while len(self.d) > self.max_entries or (self.max_bytes is not None and self.bytes > self.max_bytes):
+            if len(self.d) == 1:
+                break  # a single value larger than max_bytes is still cached
+            self._drop(next(iter(self.d)))
+            self.evictions += 1
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        if key not in self.d:
+            return default
+        return self._drop(key)
+
+    def clear(self):
+        self.d.clear()
+        self.bytes = 0
+
+    async def get_or_fetch(
+            self, key: Hashable, fetch_f: Callable[..., Awaitable], *args,
+            ttl: int | float | None = None, stale_ttl: int | float = 0, **kwargs
+    ) -> Any:
+        """
+        Get the cached value or await fetch_f(*args, **kwargs) and cache its result.
+        A fetch in flight for the key is awaited instead of starting another one.
+        An entry expired less than stale_ttl seconds ago is returned at once and fetched again in the background.
+        """
+        if (entry := self.d.get(key)) is not None and (now := time()) >= entry[1] and now < entry[2]:
+            self.d.move_to_end(key)
+            self.stale_hits += 1
+            if key not in self._fetches:
+                task = self._start_fetch(key, fetch_f, args, kwargs, ttl, stale_ttl)
+                asyncio.create_task(self._revalidate(key, task))
+            return entry[0]
+
+        # a cached None (e.g. an empty answer) is a hit as well
+        if (value := self.get(key, _MISSING)) is not _MISSING:
+            logger.debug(f'Using cached response for {key}.')
+            return value
+
+        if (task := self._fetches.get(key)) is not None:
+            self.shared += 1
+        else:
+            task = self._start_fetch(key, fetch_f, args, kwargs, ttl, stale_ttl)
+        # a cancelled caller does not cancel the fetch the others are waiting for
+        return await asyncio.shield(task)
+
+    def _start_fetch(
+            self, key: Hashable, fetch_f: Callable[..., Awaitable], args: tuple, kwargs: dict,
+            ttl: int | float | None, stale_ttl: int | float
+    ) -> asyncio.Task:
+        async def _fetch():
+            try:
+                value = await fetch_f(*args, **kwargs)
+            except Exception:
+                self.fetch_errors += 1
+                raise
+            self.set(key, value, ttl, stale_ttl)
+            return value
+
+        def _done(done_task: asyncio.Task):
+            if self._fetches.get(key) is done_task:
+                del self._fetches[key]
+
+        task = self._fetches[key] = asyncio.create_task(_fetch())
+        task.add_done_callback(_done)
+        return task
+
+    async def _revalidate(self, key: Hashable, task: asyncio.Task):
+        try:
+            await task
+        except Exception as e:
+            logger.warning(f'Failed to refresh the stale cache entry {key} of {self.name}: {e}')
 
+    def json(self) -> dict:
+        lookups = self.hits + self.misses + self.stale_hits + self.stale_misses
+        return {
+            'entries': len(self.d),
+            'max_entries': self.max_entries,
+            'bytes': self.bytes if self.max_bytes is not None else None,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'stale_hits': self.stale_hits,
+            'stale_misses': self.stale_misses,
+            'shared': self.shared,
+            'hit_rate': (self.hits + self.stale_hits) / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'fetch_errors': self.fetch_errors,
+            'in_flight': len(self._fetches)
+        }
 
-class ApiCache:
-    MAX_ENTRIES = 100
-    EXPIRE_AFTER = 300  # how long it takes for a cached entry to expire
-    FETCH_DELAY = 1.0  # make sure one second is passed between requests
-
-    def __init__(self, fetch_f: Callable):
-        # Cached data for booru API as {route: [data, expires_at]}.
-        # This is used for tag autocompletion and
-        # to throttle requests to the API requirement (1 per second for free acc).
-        self.fetch_f = fetch_f
-        self.d: dict[str, tuple[dict, float | int]] = dict()
-        self.last_fetch = 0
-
-    async def get_or_fetch(self, route: str, *args, **kwargs):
-        """ get or fetch route and update cache """
-        if (r := self.d.get(route)) is not None:
-            if r[1] < time():
-                logger.debug(f'Using cached response for {route}.')
-                return r[0]
-
-        if self.d.__len__() >= self.MAX_ENTRIES:
-            self.d.clear()
-
-        r = await self.fetch_f(route, *args, **kwargs)
-        self.d[route] = (r, time())
-        return r
-
-    async def fetch(self, route: str, *args, **kwargs) -> dict:
-        """ only fetch, do not store result """
-        if time() - self.last_fetch < self.FETCH_DELAY:
-            await asleep(self.FETCH_DELAY - (time() - self.last_fetch))
-
-        self.last_fetch = time()
-        return await self.fetch_f(route, *args, **kwargs)
+    def _drop(self, key: Hashable) -> Any:
+        value, _, _, size = self.d.pop(key)
+        self.bytes -= size
+        return value
@@ -0,0 +1,344 @@
+import os
+import sys
+import ssl
+import json
+import signal
+import asyncio
+import logging
+import itertools
+from pathlib import Path
+from typing import Callable
+from logging import getLogger
+from aiohttp import web, ClientSession, UnixConnector, ClientError
+from multidict import CIMultiDict
+
+from config import (
+    BOT_LOGGING_LEVEL, DC_SHARD_COUNT, DC_SHARD_IDS, CLUSTER_WORKERS, CLUSTER_SOCKET_DIR, CLUSTER_CALL_TIMEOUT,
+    API_HOST, API_PORT, API_SSL_CERT, API_SSL_KEY
+)
+
+"""
+Multi-process shard cluster.
+The supervisor (python cluster.py) splits DC_SHARD_IDS into CLUSTER_WORKERS contiguous ranges
+and runs a LunoDog.py worker process per range, respawning the workers that exit.
+The workers connect to the supervisor unix socket, it relays calls between them (see WorkerLink.call)
+and picks the single worker to run the singleton think tasks, e.g. the twitch poller.
+The supervisor serves the public API and proxies every request to a worker API unix socket:
+guild-scoped requests (guild_id in the query or post data) go to the worker owning the guild,
+/me/guilds is merged from all the workers, anything else goes to the lowest connected worker.
+Without the supervisor LunoDog.py runs all the DC_SHARD_IDS shards in a single process, same as before.
+"""
+
+logger = getLogger(__name__)
+WORKER_ENV = 'LUNODOG_WORKER'
+WORKER_ID: int | None = int(os.environ[WORKER_ENV]) if WORKER_ENV in os.environ else None  # None if not clustered
+WORKERS = CLUSTER_WORKERS if WORKER_ID is not None else 1  # number of results of a complete WorkerLink.call_all()
+RESPAWN_DELAY = 5  # seconds to wait before restarting an exited worker
+STOP_TIMEOUT = 60  # seconds to wait for the workers to save their state on exit before killing them
+PROXY_DROP_HEADERS = ('content-length', 'transfer-encoding', 'content-encoding', 'connection', 'host')
+
+
+def worker_shard_ids(worker_id: int) -> list[int]:
+    """ Contiguous range of DC_SHARD_IDS served by a worker """
+    shard_ids = list(DC_SHARD_IDS)
+    per_worker, extra = divmod(len(shard_ids), CLUSTER_WORKERS)
+    start = worker_id * per_worker + min(worker_id, extra)
+    return shard_ids[start:start + per_worker + (worker_id < extra)]
+
+
+def guild_worker(guild_id: str | int) -> int | None:
+    """ Id of the worker owning a guild, None if the guild shard is not served by this cluster """
+    shard_id = (int(guild_id) >> 22) % DC_SHARD_COUNT
+    for worker_id in range(CLUSTER_WORKERS):
+        if shard_id in worker_shard_ids(worker_id):
+            return worker_id
+
+
+def supervisor_socket() -> str:
+    return os.path.join(CLUSTER_SOCKET_DIR, 'supervisor.sock')
+
+
+def worker_api_socket(worker_id: int) -> str:
+    return os.path.join(CLUSTER_SOCKET_DIR, f'worker-{worker_id}.sock')
+
+
+SHARD_IDS = list(DC_SHARD_IDS) if WORKER_ID is None else worker_shard_ids(WORKER_ID)
+handlers: dict[str, Callable] = {}
+
+
+class WorkerUnreachable(Exception):
+    """ The worker is not connected or did not answer in time, the handler may not have run """
+
+
+def handler(name: str):
+    """ Decorator to register a coroutine other workers can call with WorkerLink.call """
+    def _decorator(callback: Callable):
+        handlers[name] = callback
+        return callback
+    return _decorator
+
+
+async def _send(writer: asyncio.StreamWriter, message: dict):
+    writer.write(json.dumps(message, default=str).encode() + b'\n')
+    await writer.drain()
+
+
+class WorkerLink:
+    """ Worker side of the supervisor connection, without a supervisor every call runs in this process """
+
+    def __init__(self):
+        self.runs_singletons = WORKER_ID is None  # if the singleton think tasks run in this process
+        self._writer: asyncio.StreamWriter | None = None
+        self._calls: dict[int, asyncio.Future] = {}
+        self._call_ids = itertools.count()
+        self._reader_task: asyncio.Task | None = None
+
+    async def connect(self):
+        reader, self._writer = await asyncio.open_unix_connection(supervisor_socket())
+        await _send(self._writer, {'op': 'hello', 'worker': WORKER_ID})
+        self._reader_task = asyncio.create_task(self._read(reader))
+        logger.info(f'Worker {WORKER_ID} connected to the supervisor, serving shards {SHARD_IDS}.')
+
+    async def close(self):
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+        if self._writer is not None:
+            self._writer.close()
+
+    async def _read(self, reader: asyncio.StreamReader):
+        while len(line := await reader.readline()):
+            message = json.loads(line)
+            if message['op'] == 'call':
+                asyncio.create_task(self._answer(message))
+            elif message['op'] == 'result':
+                if (future := self._calls.pop(message['id'], None)) is not None and not future.done():
+                    if message.get('unreachable'):
+                        future.set_exception(WorkerUnreachable(message['error']))
+                    elif 'error' in message:
+                        future.set_exception(RuntimeError(message['error']))
+                    else:
+                        future.set_result(message['result'])
+            elif message['op'] == 'singleton':
+                self.runs_singletons = message['value']
+                logger.info(f"Worker {WORKER_ID} {'runs' if self.runs_singletons else 'stopped'} the singleton tasks.")
+        # a worker without the supervisor can not be reached, exit the same way as on ctrl+c
+        logger.error('Lost connection to the cluster supervisor, exiting.')
+        os.kill(os.getpid(), signal.SIGINT)
+
+    async def _answer(self, message: dict):
+        reply = {'op': 'result', 'id': message['id'], 'to': message['from']}
+        try:
+            reply['result'] = await handlers[message['func']](*message['args'])
+        except Exception as e:
+            logger.error(f"Cluster call {message['func']} from worker {message['from']} failed: {e}")
+            reply['error'] = f'{type(e).__name__}: {e}'
+        await _send(self._writer, reply)
+
+    async def call(self, worker_id: int | None, func: str, *args):
+        """
+        Run a registered handler on a worker and return its result.
+        Raises WorkerUnreachable if the worker could not be reached, RuntimeError if the remote handler failed.
+        """
+        if worker_id is None or worker_id == WORKER_ID or WORKER_ID is None:
+            return await handlers[func](*args)
+        call_id = next(self._call_ids)
+        self._calls[call_id] = future = asyncio.get_running_loop().create_future()
+        try:
+            await _send(self._writer, {'op': 'call', 'id': call_id, 'to': worker_id, 'func': func, 'args': args})
+            return await asyncio.wait_for(future, CLUSTER_CALL_TIMEOUT)
+        except ConnectionError as e:
+            raise WorkerUnreachable(f'Failed to send {func} to worker {worker_id}: {e}')
+        except asyncio.TimeoutError:
+            raise WorkerUnreachable(f'Worker {worker_id} did not answer {func} in {CLUSTER_CALL_TIMEOUT} seconds.')
+        finally:
+            self._calls.pop(call_id, None)
+
+    async def call_guild(self, guild_id: str | int, func: str, *args):
+        """ Run a registered handler on the worker owning the guild """
+        return await self.call(guild_worker(guild_id) if WORKER_ID is not None else None, func, *args)
+
+    async def call_all(self, func: str, *args) -> list:
+        """ Run a registered handler on every worker, results of the workers failed to answer are skipped """
+        if WORKER_ID is None:
+            return [await handlers[func](*args)]
+        results = []
+        for worker_id, result in enumerate(await asyncio.gather(
+                *(self.call(i, func, *args) for i in range(CLUSTER_WORKERS)), return_exceptions=True
+        )):
+            if isinstance(result, BaseException):
+                logger.error(f'Cluster call {func} to worker {worker_id} failed: {result!r}')
+                continue
+            results.append(result)
+        return results
+
+
+link = WorkerLink()
+
+
+class Supervisor:
+
+    def __init__(self):
+        self.processes: dict[int, asyncio.subprocess.Process] = {}
+        self.links: dict[int, asyncio.StreamWriter] = {}
+        self.singleton_worker: int | None = None
+        self.stopping = False
+        self.api = web.Application()
+        self.api.router.add_route('*', '/api/{tail:.*}', self._proxy)
+        self.api_runner = web.AppRunner(self.api)
+        self.sessions: dict[int, ClientSession] = {}
+
+    async def serve(self):
+        Path(CLUSTER_SOCKET_DIR).mkdir(parents=True, exist_ok=True)
+        server = await asyncio.start_unix_server(self._on_worker_connected, supervisor_socket())
+        for worker_id in range(CLUSTER_WORKERS):
+            self.sessions[worker_id] = ClientSession(connector=UnixConnector(path=worker_api_socket(worker_id)))
+        watchers = [asyncio.create_task(self._run_worker(i)) for i in range(CLUSTER_WORKERS)]
+
+        context = None
+        if API_SSL_CERT:
+            context = ssl.SSLContext(ssl.PROTOCOL_TLSv1_2)
+            context.load_cert_chain(certfile=API_SSL_CERT, keyfile=API_SSL_KEY)
+        await self.api_runner.setup()
+        await web.TCPSite(self.api_runner, API_HOST, API_PORT, ssl_context=context).start()
+        logger.info(f'Cluster API proxy serving at {API_HOST}:{API_PORT}')
+
+        stop = asyncio.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            asyncio.get_running_loop().add_signal_handler(sig, stop.set)
+        await stop.wait()
+
+        logger.info('Stopping the workers...')
+        self.stopping = True
+        for process in self.processes.values():
+            if process.returncode is None:
+                process.send_signal(signal.SIGINT)
+        await asyncio.wait(watchers, timeout=STOP_TIMEOUT)
+        for process in self.processes.values():
+            if process.returncode is None:
+                process.kill()
+        server.close()
+        await self.api_runner.cleanup()
+        for session in self.sessions.values():
+            await session.close()
+
+    async def _run_worker(self, worker_id: int):
+        """ Run a worker process, respawn it when it exits """
+        while not self.stopping:
+            logger.info(f'Starting worker {worker_id} for shards {worker_shard_ids(worker_id)}.')
+            # own session, so ctrl+c in the terminal reaches only the supervisor, it stops the workers in order
+            self.processes[worker_id] = process = await asyncio.create_subprocess_exec(
+                sys.executable, str(Path(__file__).with_name('LunoDog.py')),
+                env={**os.environ, WORKER_ENV: str(worker_id)}, start_new_session=True
+            )
+            code = await process.wait()
+            if not self.stopping:
+                logger.error(f'Worker {worker_id} exited with code {code}, restarting in {RESPAWN_DELAY}s.')
+                await asyncio.sleep(RESPAWN_DELAY)
+
+    async def _on_worker_connected(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        worker_id = None
+        try:
+            while len(line := await reader.readline()):
+                message = json.loads(line)
+                if message['op'] == 'hello':
+                    worker_id = message['worker']
+                    self.links[worker_id] = writer
+                    await self._elect_singleton_worker()
+                elif message['op'] == 'call':
+                    if (target := self.links.get(message['to'])) is None:
+                        await self._relay(writer, {
+                            'op': 'result', 'id': message['id'], 'unreachable': True,
+                            'error': f"Worker {message['to']} is not connected."
+                        })
+                        continue
+                    await self._relay(target, {**message, 'from': worker_id})
+                elif message['op'] == 'result' and (target := self.links.get(message['to'])) is not None:
+                    await self._relay(target, message)
+        except (ConnectionError, json.JSONDecodeError) as e:
+            logger.error(f'Worker {worker_id} link failed: {e}')
+        finally:
+            if worker_id is not None and self.links.get(worker_id) is writer:
+                del self.links[worker_id]
+                if not self.stopping:
+                    await self._elect_singleton_worker()
+            writer.close()
+
+    @staticmethod
+    async def _relay(writer: asyncio.StreamWriter, message: dict):
+        """ Send a message to a worker, a worker gone in the meantime is handled by its own connection """
+        try:
+            await _send(writer, message)
+        except ConnectionError as e:
+            logger.warning(f"Failed to send {message['op']} to a worker: {e}")
+
+    async def _elect_singleton_worker(self):
+        """ Run the singleton tasks on the lowest connected worker """
+        worker_id = min(self.links) if len(self.links) else None
+        if worker_id == self.singleton_worker:
+            return
+        if (old := self.links.get(self.singleton_worker)) is not None:
+            await self._relay(old, {'op': 'singleton', 'value': False})
+        self.singleton_worker = worker_id
+        if worker_id is not None:
+            logger.info(f'Worker {worker_id} runs the singleton tasks.')
+            await self._relay(self.links[worker_id], {'op': 'singleton', 'value': True})
+
+    def _route(self, request: web.Request, body: bytes) -> int | None:
+        """ Worker to proxy the request to """
+        guild_id = request.query.get('guild_id')
+        if guild_id is None and request.method == 'POST' and len(body):
+            try:
+                guild_id = json.loads(body).get('guild_id')
+            except (json.JSONDecodeError, AttributeError):
+                pass
+        if guild_id is not None and str(guild_id).isdigit():
+            return guild_worker(guild_id)
+        return min(self.links) if len(self.links) else None
+
+    @staticmethod
+    def _proxy_headers(headers) -> CIMultiDict:
+        return CIMultiDict((k, v) for k, v in headers.items() if k.lower() not in PROXY_DROP_HEADERS)
+
+    async def _forward(self, worker_id: int, request: web.Request, body: bytes) -> tuple[int, CIMultiDict, bytes]:
+        url = f'http://worker{request.rel_url}'
+        headers = self._proxy_headers(request.headers)
+        async with self.sessions[worker_id].request(request.method, url, headers=headers, data=body) as resp:
+            return resp.status, self._proxy_headers(resp.headers), await resp.read()
+
+    async def _proxy(self, request: web.Request) -> web.Response:
+        body = await request.read()
+        try:
+            if request.path == '/api/me/guilds' and request.method == 'GET':
+                return await self._merge_guilds(request, body)
+            if (worker_id := self._route(request, body)) is None or worker_id not in self.links:
+                return self._error(503, 'Bot is under connection.', 'Please try again later...')
+            status, headers, data = await self._forward(worker_id, request, body)
+        except ClientError as e:
+            logger.error(f'Proxying {request.rel_url} failed: {e}')
+            return self._error(503, 'Bot is under connection.', 'Please try again later...')
+        return web.Response(status=status, headers=headers, body=data)
+
+    async def _merge_guilds(self, request: web.Request, body: bytes) -> web.Response:
+        """ Every worker knows only its own guilds, concatenate their lists """
+        responses = await asyncio.gather(*(self._forward(i, request, body) for i in self.links))
+        if not len(responses):
+            return self._error(503, 'Bot is under connection.', 'Please try again later...')
+        if (failed := next((i for i in responses if i[0] != 200), None)) is not None:
+            status, headers, data = failed
+            return web.Response(status=status, headers=headers, body=data)
+        guilds = list(itertools.chain.from_iterable(json.loads(data) for _, _, data in responses))
+        return web.Response(status=200, headers=responses[0][1], body=json.dumps(guilds))
+
+    @staticmethod
+    def _error(code: int, title: str, message: str) -> web.Response:
+        return web.Response(
+            status=code, content_type='application/json',
+            body=json.dumps({'error': {'status': title, 'message': message}})
+        )
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=BOT_LOGGING_LEVEL, format='[supervisor] %(levelname)s %(name)s: %(message)s')
+    if CLUSTER_WORKERS < 1 or CLUSTER_WORKERS > len(DC_SHARD_IDS):
+        sys.exit('CLUSTER_WORKERS must be between 1 and the number of DC_SHARD_IDS.')
+    asyncio.run(Supervisor().serve())
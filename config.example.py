@@ -7,21 +7,50 @@ DC_BOT_TOKEN = ''
 DC_APPLICATION_ID = ''
 DC_CLIENT_ID = ''
 DC_CLIENT_SECRET = ''
-DC_BOT_INTENTS = (
-    1 << 0 |  # GUILDS
-    1 << 1 |  # GUILD_MEMBERS
-    1 << 8 |  # GUILD_PRESENCES
-    1 << 9 |  # GUILD_MESSAGES
-    1 << 10  # GUILD_MESSAGE_REACTIONS
-)
-DC_SHARD_COUNT = 1
-DC_SHARD_ID = 0
+DC_BOT_INTENTS = None  # computed from the enabled modules listeners, or set the intents by hand, e.g. 1 << 0 | 1 << 1
+DC_SHARD_COUNT = 1  # total number of shards across all the bot processes
+DC_SHARD_IDS = range(0, 1)  # shards served by this process, e.g. range(0, 4) and range(4, 8) for two processes
+CLUSTER_WORKERS = 1  # worker processes to split DC_SHARD_IDS between when launched with python cluster.py
+CLUSTER_SOCKET_DIR = '/tmp/lunodog'  # unix sockets of the cluster supervisor and workers
+CLUSTER_CALL_TIMEOUT = 30  # seconds to wait for another worker to answer a call
+
+DB_BACKEND = 'mysql'  # or 'sqlite' for an embedded database file, no database server needed
+SQLITE_PATH = 'lunodog.db'
+SQLITE_POOL_SIZE = 4  # concurrent readers, writes are serialized by sqlite anyway
+DB_SLOW_QUERY_TIME = 0.2  # log queries slower than this (seconds)
+DB_SLOW_QUERY_EXPLAIN_RATE = 0.1  # share of slow queries to capture EXPLAIN for
 
 MYSQL_HOST = '127.0.0.1'
 MYSQL_PORT = 3306
 MYSQL_DB = 'your-db-name'
 MYSQL_USER = 'db-user'
 MYSQL_PASS = 'db-password'
+MYSQL_POOL_MINSIZE = 3  # connections opened on start
+MYSQL_POOL_MAXSIZE = 10  # the pool grows up to this size while queries have to wait for a free connection
+MYSQL_POOL_GROW_WAIT = 0.05  # average wait for a connection (seconds) to grow the pool at
+
+# days to keep raw stats rows for, None to keep forever. /profile reads the last 30 days of mbr_stats_reactions,
+# other counts are served from the daily rollups
+STATS_RETENTION_DAYS = {
+    'mbr_stats_messages': 90,
+    'mbr_stats_reactions': 90,
+    'mbr_stats_presence': 90,
+    'twitch_stat': 90,
+}
+STATS_PRUNE_DELAY = 60 * 60  # run the pruning job every hour (seconds)
+STATS_PRUNE_CHUNK = 1000  # rows deleted per statement
+STATS_PRUNE_PAUSE = 0.5  # pause between the chunks (seconds)
+
+# presences snapshot for continuous presence stats across restarts, None to disable
+STATE_SNAPSHOT_PATH = 'state.snapshot'
+STATE_SNAPSHOT_MAX_AGE = 15 * 60  # presences of an older snapshot are not continued (seconds)
+
+# pooled HTTP client for the third-party APIs
+WEB_CLIENT_LIMIT = 100  # max open connections
+WEB_CLIENT_LIMIT_PER_HOST = 10  # max open connections to a host
+WEB_CLIENT_TIMEOUT = 30  # default request timeout (seconds)
+WEB_CLIENT_DNS_TTL = 5 * 60  # resolved hosts cache time (seconds)
+WEB_CLIENT_KEEPALIVE = 30  # idle connections are kept open for this long (seconds)
 
 API_HOST = '127.0.0.1'  # listen on this host (0.0.0.0 for any)
 API_PORT = 3355
@@ -1,61 +1,261 @@
-from typing import Iterable, Literal
+import re
+import random
+import asyncio
+from abc import ABC, abstractmethod
+from typing import Iterable, Literal, AsyncIterator, AsyncContextManager, Callable
 from logging import getLogger
+from collections import defaultdict, deque
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from functools import lru_cache
+from time import monotonic, perf_counter, time
 import aiomysql
 
-from config import MYSQL_HOST, MYSQL_PORT, MYSQL_DB, MYSQL_USER, MYSQL_PASS
+from config import (
+    DB_BACKEND, MYSQL_HOST, MYSQL_PORT, MYSQL_DB, MYSQL_USER, MYSQL_PASS,
+    MYSQL_POOL_MINSIZE, MYSQL_POOL_MAXSIZE, MYSQL_POOL_GROW_WAIT,
+    SQLITE_PATH, SQLITE_POOL_SIZE, DB_SLOW_QUERY_TIME, DB_SLOW_QUERY_EXPLAIN_RATE
+)
+import db_sqlite
 
 logger = getLogger('mysql')
+STATEMENT_CACHE_SIZE = 512  # max number of cached generated SQL statements per statement type
+POOL_CHECK_DELAY = 10  # how often to consider growing the connections pool (seconds)
+QUERY_SAMPLES = 1000  # recent durations kept per normalized statement for the percentiles
+SLOW_QUERY_RING_SIZE = 200  # recent slow queries kept in memory
 
+# Caller tag for the connection pool stats, set by the entry points (slash commands, api routes, think tasks, etc)
+db_tag: ContextVar[str] = ContextVar('db_tag', default='untagged')
 
-class Database:
-    pool: aiomysql.Pool
 
-    async def connect(self, loop):
-        self.pool = await aiomysql.create_pool(
-            maxsize=3,
-            host=MYSQL_HOST,
-            port=MYSQL_PORT,
-            user=MYSQL_USER,
-            password=MYSQL_PASS,
-            db=MYSQL_DB,
-            autocommit=True,
-            cursorclass=aiomysql.DictCursor,
-            loop=loop
+class PoolTagStats:
+    """ Connection pool usage by a single caller tag """
+
+    def __init__(self):
+        self.acquired = 0  # total connections acquired
+        self.waiting = 0  # current number of callers waiting for a connection
+        self.in_flight = 0  # current number of connections held
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+        self.hold_time = 0.0
+        self.max_hold_time = 0.0
+
+    def json(self) -> dict:
+        return {
+            'acquired': self.acquired,
+            'waiting': self.waiting,
+            'in_flight': self.in_flight,
+            'avg_wait_time': self.wait_time / self.acquired if self.acquired else 0.0,
+            'max_wait_time': self.max_wait_time,
+            'avg_hold_time': self.hold_time / self.acquired if self.acquired else 0.0,
+            'max_hold_time': self.max_hold_time
+        }
+
+
+@lru_cache(maxsize=STATEMENT_CACHE_SIZE)
+def normalize_query(query: str) -> str:
+    """ Replace literals and placeholders with ?, collapse IN lists and whitespace """
+    query = re.sub(r"'(?:[^'\\]|\\.)*'", '?', query)
+    query = re.sub(r'\b\d+\b', '?', query.replace('%s', '?'))
+    query = re.sub(r'\bIN\s*\(\s*\?(?:\s*,\s*\?)*\s*\)', 'IN (...)', query, flags=re.I)
+    return ' '.join(query.split())
+
+
+def args_shape(args) -> str:
+    """ Argument types of a statement, values are never logged by the slow query log """
+    if args is None:
+        return '()'
+    if isinstance(args, dict):
+        return '{' + ', '.join(f'{key}: {type(value).__name__}' for key, value in args.items()) + '}'
+    return '(' + ', '.join(type(i).__name__ for i in args) + ')'
+
+
+class QueryStats:
+    """ Timings of a single normalized statement """
+
+    def __init__(self):
+        self.count = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.slow_count = 0
+        self.samples: deque[float] = deque(maxlen=QUERY_SAMPLES)
+
+    def p95(self) -> float:
+        if not len(self.samples):
+            return 0.0
+        samples = sorted(self.samples)
+        return samples[int(len(samples) * 0.95) if len(samples) > 1 else 0]
+
+    def json(self) -> dict:
+        return {
+            'count': self.count,
+            'slow_count': self.slow_count,
+            'total_time': self.total_time,
+            'avg_time': self.total_time / self.count if self.count else 0.0,
+            'p95_time': self.p95(),
+            'max_time': self.max_time
+        }
+
+
+class QueryLog:
+    """
+    Per statement timings, statements slower than DB_SLOW_QUERY_TIME are logged and kept in a ring
+    along with a sampled EXPLAIN of the statement.
+    """
+
+    def __init__(self):
+        self.stats: defaultdict[str, QueryStats] = defaultdict(QueryStats)
+        self.slow: deque[dict] = deque(maxlen=SLOW_QUERY_RING_SIZE)
+
+    async def record(self, conn, query: str, args, duration: float, rows: int | None, many: bool = False):
+        """ Account a statement, conn is used to EXPLAIN it if it is slow, None to never explain """
+        stats = self.stats[normalize_query(query)]
+        stats.count += 1
+        stats.total_time += duration
+        stats.max_time = max(stats.max_time, duration)
+        stats.samples.append(duration)
+        if duration < DB_SLOW_QUERY_TIME:
+            return
+
+        stats.slow_count += 1
+        if many:
+            shape = f'{len(args)} x {args_shape(args[0])}' if isinstance(args, (list, tuple)) and len(args) else 'many'
+        else:
+            shape = args_shape(args)
+        logger.warning(
+            'Slow query %.3fs, %s rows, %s: %s -- %s', duration, rows, db_tag.get(), normalize_query(query), shape
         )
 
-    async def close(self):
-        self.pool.close()
-        await self.pool.wait_closed()
+        explain = None
+        if (
+            conn is not None and not many and random.random() < DB_SLOW_QUERY_EXPLAIN_RATE
+            and re.match(r'\s*(SELECT|UPDATE|DELETE)\b', query, flags=re.I)
+        ):
+            try:
+                async with conn.cursor() as cur:
+                    await cur.execute(
+                        ('EXPLAIN QUERY PLAN ' if DB_BACKEND == 'sqlite' else 'EXPLAIN ') + query, args
+                    )
+                    explain = list(await cur.fetchall())
+            except Exception as e:
+                explain = [{'error': str(e)}]
+
+        self.slow.append({
+            'at': int(time()),
+            'tag': db_tag.get(),
+            'query': normalize_query(query),
+            'args': shape,
+            'duration': duration,
+            'rows': rows,
+            'explain': explain
+        })
+
+    def top(self, by: Literal['total', 'p95'] = 'total', limit: int = 10) -> list[tuple[str, QueryStats]]:
+        key = (lambda i: i[1].total_time) if by == 'total' else (lambda i: i[1].p95())
+        return sorted(self.stats.items(), key=key, reverse=True)[:limit]
+
+    def json(self, limit: int = 10) -> dict:
+        return {
+            'slow_query_time': DB_SLOW_QUERY_TIME,
+            'top_total': [{'query': query, **stats.json()} for query, stats in self.top('total', limit)],
+            'top_p95': [{'query': query, **stats.json()} for query, stats in self.top('p95', limit)],
+            'slow': list(self.slow)
+        }
+
+
+query_log = QueryLog()
+
+
+class Executor(ABC):
+    """ Query methods and SQL statements helpers, executed on a connection provided by self._connection() """
+
+    @abstractmethod
+    def _connection(self) -> AsyncContextManager[aiomysql.Connection]:
+        ...
 
     async def execute(self, query, args=None) -> int:
-        async with self.pool.acquire() as conn:
+        async with self._connection() as conn:
             async with conn.cursor() as cur:
-                logger.debug(f'{query} -- {args}')
-                await cur.execute(query, args)
+                logger.debug('%s -- %s', query, args)
+                started_at = perf_counter()
+                rows = await cur.execute(query, args)
+                await query_log.record(conn, query, args, perf_counter() - started_at, rows)
                 return cur.lastrowid
 
+    async def execute_rowcount(self, query, args=None) -> int:
+        """ Same as execute but return the number of affected rows """
+        async with self._connection() as conn:
+            async with conn.cursor() as cur:
+                logger.debug('%s -- %s', query, args)
+                started_at = perf_counter()
+                rows = await cur.execute(query, args)
+                await query_log.record(conn, query, args, perf_counter() - started_at, rows)
+                return rows
+
     async def executemany(self, query, args=None) -> int:
-        async with self.pool.acquire() as conn:
+        async with self._connection() as conn:
             async with conn.cursor() as cur:
-                logger.debug(f'{query} -- (...)')
-                return await cur.executemany(query, args)
+                logger.debug('%s -- (...)', query)
+                started_at = perf_counter()
+                rows = await cur.executemany(query, args)
+                await query_log.record(conn, query, args, perf_counter() - started_at, rows, many=True)
+                return rows
 
     async def fetch_one(self, query, args=None) -> dict | None:
-        async with self.pool.acquire() as conn:
+        async with self._connection() as conn:
             async with conn.cursor() as cur:
-                logger.debug(f'{query} -- {args}')
+                logger.debug('%s -- %s', query, args)
+                started_at = perf_counter()
                 await cur.execute(query, args)
-                return await cur.fetchone()
+                row = await cur.fetchone()
+                await query_log.record(conn, query, args, perf_counter() - started_at, int(row is not None))
+                return row
 
     async def fetch_all(self, query, args=None) -> list[dict]:
-        async with self.pool.acquire() as conn:
+        async with self._connection() as conn:
             async with conn.cursor() as cur:
-                logger.debug(f'{query} -- {args}')
+                logger.debug('%s -- %s', query, args)
+                started_at = perf_counter()
                 await cur.execute(query, args)
-                return await cur.fetchall()
+                rows = await cur.fetchall()
+                await query_log.record(conn, query, args, perf_counter() - started_at, len(rows))
+                return rows
+
+    async def iterate(
+            self, query, args=None, batch_size: int = 1000, as_tuples: bool = False
+    ) -> AsyncIterator[dict | tuple]:
+        """
+        Stream rows of a large result set with an unbuffered server-side cursor, in constant memory.
+        Rows are yielded as dicts, or as plain tuples in the order of selected columns if as_tuples is set.
+        The connection is held until the iteration is over, wrap it in contextlib.aclosing() if it may stop early.
+        Only the time spent in the database is accounted to the query log, not the time spent by the consumer.
+        """
+        async with self._connection() as conn:
+            async with conn.cursor(aiomysql.SSCursor if as_tuples else aiomysql.SSDictCursor) as cur:
+                logger.debug('%s -- %s', query, args)
+                started_at = perf_counter()
+                await cur.execute(query, args)
+                duration, rows_count = perf_counter() - started_at, 0
+                try:
+                    while True:
+                        started_at = perf_counter()
+                        rows = await cur.fetchmany(batch_size)
+                        duration += perf_counter() - started_at
+                        if not len(rows):
+                            break
+                        rows_count += len(rows)
+                        for row in rows:
+                            yield row
+                finally:
+                    # can not EXPLAIN on a connection with an unread result set
+                    await query_log.record(None, query, args, duration, rows_count)
+
+    # SQL statements builders are memoized by (table, columns tuple, conflict mode),
+    # so the arguments must be hashable
 
     @staticmethod
-    def _insert(table: str, keys: Iterable[str], on_conflict: str | None) -> str:
+    @lru_cache(maxsize=STATEMENT_CACHE_SIZE)
+    def _insert(table: str, keys: tuple[str, ...], on_conflict: str | None) -> str:
         return {'ignore': 'INSERT IGNORE', 'replace': 'REPLACE', None: 'INSERT'}[on_conflict] + \
                ' INTO `{}` ({}) VALUES ({})'.format(
                    table,
@@ -69,10 +269,11 @@ class Database:
     async def insert_many(
             self, table: str, keys: Iterable[str], values: Iterable, on_conflict: Literal['ignore', 'replace'] = None
     ) -> int | None:
-        return await self.executemany(query=self._insert(table, keys, on_conflict), args=values)
+        return await self.executemany(query=self._insert(table, tuple(keys), on_conflict), args=values)
 
     @staticmethod
-    def _select(table: str, keys: Iterable[str]) -> str:
+    @lru_cache(maxsize=STATEMENT_CACHE_SIZE)
+    def _select(table: str, keys: tuple[str, ...]) -> str:
         return 'SELECT * FROM `{}` WHERE {}'.format(
             table,
             ' AND '.join(f'`{i}`=%s' for i in keys)
@@ -85,7 +286,8 @@ class Database:
         return await self.fetch_one(query=self._select(table, tuple(q.keys())), args=tuple(q.values()))
 
     @staticmethod
-    def _update(table: str, keys: Iterable[str], where_keys: Iterable[str]) -> str:
+    @lru_cache(maxsize=STATEMENT_CACHE_SIZE)
+    def _update(table: str, keys: tuple[str, ...], where_keys: tuple[str, ...]) -> str:
         return 'UPDATE `{}` SET {} WHERE {}'.format(
             table,
             ', '.join(f'`{i}`=%s' for i in keys),
@@ -99,28 +301,42 @@ class Database:
         )
 
     @staticmethod
-    def _on_dup_update(keys: Iterable[str]):
-        return ' ON DUPLICATE KEY UPDATE {}'.format(
-            ', '.join(f'`{key}`=VALUES(`{key}`)' for key in keys)
+    @lru_cache(maxsize=STATEMENT_CACHE_SIZE)
+    def _insert_update(table: str, keys: tuple[str, ...], update_keys: tuple[str, ...]) -> str:
+        return Executor._insert(table, keys, on_conflict=None) + ' ON DUPLICATE KEY UPDATE {}'.format(
+            ', '.join(f'`{key}`=VALUES(`{key}`)' for key in update_keys)
         )
 
     async def insert_update(self, table: str, data: dict, update_keys: list[str]) -> int:
         """ Insert, on duplicate keys update"""
         return await self.execute(
-            query=self._insert(table, data.keys(), on_conflict=None) + self._on_dup_update(keys=update_keys),
-            args=data.values()
+            query=self._insert_update(table, tuple(data.keys()), tuple(update_keys)),
+            args=tuple(data.values())
         )
 
     async def insert_update_many(self, table: str, base_keys: list[str], update_keys: list[str], values: Iterable):
-        q = self._insert(table, base_keys+update_keys, on_conflict=None) + self._on_dup_update(keys=update_keys)
-        logger.warning(q)
         return await self.executemany(
-            query=q,
+            query=self._insert_update(table, (*base_keys, *update_keys), tuple(update_keys)),
             args=values
         )
 
     @staticmethod
-    def _delete(table: str, keys: Iterable[str]):
+    @lru_cache(maxsize=STATEMENT_CACHE_SIZE)
+    def _insert_increment(table: str, keys: tuple[str, ...], inc_keys: tuple[str, ...]) -> str:
+        return Executor._insert(table, keys, on_conflict=None) + ' ON DUPLICATE KEY UPDATE {}'.format(
+            ', '.join(f'`{key}`=`{key}`+VALUES(`{key}`)' for key in inc_keys)
+        )
+
+    async def insert_increment_many(self, table: str, base_keys: list[str], inc_keys: list[str], values: Iterable):
+        """ Insert, on duplicate keys add inc_keys values to the existing row values """
+        return await self.executemany(
+            query=self._insert_increment(table, (*base_keys, *inc_keys), tuple(inc_keys)),
+            args=values
+        )
+
+    @staticmethod
+    @lru_cache(maxsize=STATEMENT_CACHE_SIZE)
+    def _delete(table: str, keys: tuple[str, ...]):
         return 'DELETE FROM `{}` WHERE {}'.format(
             table,
             ' AND '.join(f'`{i}`=%s' for i in keys)
@@ -129,5 +345,367 @@ class Database:
     async def delete(self, table: str, q: dict) -> int:
         return await self.execute(query=self._delete(table, tuple(q.keys())), args=tuple(q.values()))
 
+    @staticmethod
+    def statement_cache_info() -> dict:
+        """ Hit/miss counters of the SQL statements cache """
+        return {
+            name: f.cache_info()._asdict() for name, f in (
+                ('insert', Executor._insert),
+                ('insert_update', Executor._insert_update),
+                ('insert_increment', Executor._insert_increment),
+                ('select', Executor._select),
+                ('update', Executor._update),
+                ('delete', Executor._delete)
+            )
+        }
+
+
+class Transaction(Executor):
+    """
+    Executes all statements on a single pinned connection, see Database.transaction().
+    Must not be shared between concurrently running tasks.
+    """
+
+    def __init__(self, conn: aiomysql.Connection):
+        self.conn = conn
+
+    @asynccontextmanager
+    async def _connection(self):
+        yield self.conn
+
+
+class Database(Executor):
+    pool: aiomysql.Pool | db_sqlite.Pool
+
+    def __init__(self):
+        self.pool_stats: defaultdict[str, PoolTagStats] = defaultdict(PoolTagStats)
+        # (acquired_at, wait_time) of recent acquires, used to decide if the pool should grow
+        self._recent_waits: deque[tuple[float, float]] = deque(maxlen=1000)
+        self._last_pool_check = 0.0
+        self._pool_growth = True  # disabled if the aiomysql pool internals are not the expected ones
+
+    async def connect(self, loop, db_name: str = None):
+        """ Open the connections pool, db_name is a database name for mysql or a file path for sqlite """
+        if DB_BACKEND == 'sqlite':
+            self.pool = await db_sqlite.create_pool(db_name or SQLITE_PATH, size=SQLITE_POOL_SIZE, loop=loop)
+            return
+
+        self.pool = await aiomysql.create_pool(
+            minsize=MYSQL_POOL_MINSIZE,
+            maxsize=MYSQL_POOL_MINSIZE,  # grows up to MYSQL_POOL_MAXSIZE, see self.think()
+            host=MYSQL_HOST,
+            port=MYSQL_PORT,
+            user=MYSQL_USER,
+            password=MYSQL_PASS,
+            db=db_name or MYSQL_DB,
+            autocommit=True,
+            cursorclass=aiomysql.DictCursor,
+            loop=loop
+        )
+
+    async def close(self):
+        self.pool.close()
+        await self.pool.wait_closed()
+
+    @asynccontextmanager
+    async def acquire(self, tag: str = None):
+        """ Acquire a connection from the pool, record wait and hold times for the caller tag """
+        stats = self.pool_stats[tag or db_tag.get()]
+        stats.waiting += 1
+        started_at = monotonic()
+        try:
+            conn = await self.pool.acquire()
+        finally:
+            stats.waiting -= 1
+
+        acquired_at = monotonic()
+        wait_time = acquired_at - started_at
+        stats.acquired += 1
+        stats.wait_time += wait_time
+        stats.max_wait_time = max(stats.max_wait_time, wait_time)
+        self._recent_waits.append((acquired_at, wait_time))
+        stats.in_flight += 1
+        try:
+            yield conn
+        finally:
+            stats.in_flight -= 1
+            hold_time = monotonic() - acquired_at
+            stats.hold_time += hold_time
+            stats.max_hold_time = max(stats.max_hold_time, hold_time)
+            await self.pool.release(conn)
+
+    def _connection(self):
+        return self.acquire()
+
+    @asynccontextmanager
+    async def transaction(
+            self, begin: bool = False, tag: str = None, read_only: bool = False
+    ) -> AsyncIterator[Transaction]:
+        """
+        Pin a single pooled connection for a block of statements:
+            async with db.transaction() as tx:
+                await tx.select(...)
+        If begin is set, the block runs inside BEGIN/COMMIT and is rolled back on an exception.
+        If read_only is set, the block reads from a consistent snapshot without taking any write lock.
+        """
+        async with self.acquire(tag) as conn:
+            if not begin and not read_only:
+                yield Transaction(conn)
+                return
+
+            if read_only:
+                await self._begin_read(conn)
+            else:
+                await conn.begin()
+            try:
+                yield Transaction(conn)
+            except BaseException:
+                await conn.rollback()
+                raise
+            await conn.commit()
+
+    @staticmethod
+    async def _begin_read(conn: aiomysql.Connection | db_sqlite.Connection):
+        if DB_BACKEND == 'sqlite':
+            await conn.begin_read()
+            return
+        async with conn.cursor() as cur:
+            await cur.execute('START TRANSACTION WITH CONSISTENT SNAPSHOT, READ ONLY')
+
+    async def think(self, frame_time: float):
+        """ Grow the pool by one connection while average wait time is above MYSQL_POOL_GROW_WAIT """
+        if DB_BACKEND == 'sqlite' or not self._pool_growth:  # fixed size pool
+            return
+        now = monotonic()
+        if now - self._last_pool_check < POOL_CHECK_DELAY:
+            return
+        since, self._last_pool_check = self._last_pool_check, now
+
+        waits = [wait_time for acquired_at, wait_time in self._recent_waits if acquired_at > since]
+        if not len(waits) or sum(waits) / len(waits) < MYSQL_POOL_GROW_WAIT:
+            return
+        if self.pool.maxsize >= MYSQL_POOL_MAXSIZE:
+            return
+
+        # aiomysql has no public api for resizing, the pool size is limited by the free connections deque length,
+        # tested with aiomysql 0.3.2 (pinned in requirements.txt)
+        if not isinstance(getattr(self.pool, '_free', None), deque) or not hasattr(self.pool, '_wakeup'):
+            logger.error(f'Unsupported aiomysql {aiomysql.__version__} pool internals, the pool will not grow.')
+            self._pool_growth = False
+            return
+        self.pool._free = deque(self.pool._free, maxlen=self.pool.maxsize + 1)
+        await self.pool._wakeup()  # let a waiting caller open the new connection
+        logger.info(f'Connection pool size increased to {self.pool.maxsize} (avg wait {sum(waits) / len(waits):.3f}s).')
+
+    @staticmethod
+    def query_info(limit: int = 10) -> dict:
+        """ Top statements by total and p95 time, and recent slow queries with their EXPLAIN """
+        return query_log.json(limit)
+
+    @staticmethod
+    def top_queries(by: Literal['total', 'p95'] = 'total', limit: int = 10) -> str:
+        """ Top statements by total or p95 time as a text table, for the CLI """
+        lines = [f'{"count":>8}{"total, s":>10}{"avg, ms":>9}{"p95, ms":>9}{"max, ms":>9}{"slow":>6}  query']
+        for query, stats in query_log.top(by, limit):
+            lines.append(
+                f'{stats.count:>8}{stats.total_time:>10.2f}{stats.total_time / stats.count * 1000:>9.2f}'
+                f'{stats.p95() * 1000:>9.2f}{stats.max_time * 1000:>9.2f}{stats.slow_count:>6}  {query[:200]}'
+            )
+        return '\n'.join(lines)
+
+    def pool_info(self) -> dict:
+        """ Connection pool state and usage stats per caller tag """
+        return {
+            'size': self.pool.size,
+            'free': self.pool.freesize,
+            'maxsize': self.pool.maxsize,
+            'maxsize_limit': SQLITE_POOL_SIZE if DB_BACKEND == 'sqlite' else MYSQL_POOL_MAXSIZE,
+            'queue_length': sum(i.waiting for i in self.pool_stats.values()),
+            'in_flight': sum(i.in_flight for i in self.pool_stats.values()),
+            'tags': {tag: stats.json() for tag, stats in self.pool_stats.items()}
+        }
+
+
+class _TableBuffer:
+    """ Pending rows for a single table, stored as tuples in the order of keys """
+
+    def __init__(self, table: str, keys: Iterable[str], on_conflict: Literal['ignore', 'replace'] | None):
+        self.table = table
+        self.keys = tuple(keys)
+        self.on_conflict = on_conflict
+        self.rows: list[tuple] = []
+        self.first_at = 0.0  # monotonic time the oldest pending row was added at
+        self.in_flight: list[list[tuple]] = []  # batches being written
+        self.deletes: list[tuple] = []  # discard() matches of the rows in flight, deleted once they are written
+        self.flush_task: asyncio.Task | None = None  # flush started by put() once max_rows rows are pending
+
+    def matcher(self, where: dict) -> Callable[[tuple], bool]:
+        match = [(self.keys.index(key), value) for key, value in where.items()]
+        return lambda row: all(row[i] == value for i, value in match)
+
+
+class WriteBuffer:
+    """
+    Write-behind buffer for frequent inserts (gateway events stats and such).
+    Rows are collected in memory per table and written with a single executemany
+    once max_rows rows are pending for a table or the oldest pending row is older than max_delay seconds.
+    A failed batch is written row by row, only the failing rows are dropped.
+    """
+
+    def __init__(self, database: Database, max_rows: int = 500, max_delay: float = 5.0):
+        self.db = database
+        self.max_rows = max_rows
+        self.max_delay = max_delay
+        self.tables: dict[str, _TableBuffer] = {}
+
+        # counters
+        self.flushes = 0
+        self.rows_written = 0
+        self.rows_discarded = 0
+        self.rows_failed = 0
+        self.batches_failed = 0  # batches written row by row after the executemany failed
+        self.last_flush_latency = 0.0
+        self.max_flush_latency = 0.0
+        self.total_flush_latency = 0.0
+
+    def register(self, table: str, keys: Iterable[str], on_conflict: Literal['ignore', 'replace'] = None):
+        """ Declare a buffered table and its columns """
+        self.tables[table] = _TableBuffer(table, keys, on_conflict)
+
+    def put(self, table: str, row: dict):
+        """ Add a row to the table buffer, start flushing the table in the background if it is full """
+        buf = self.tables[table]
+        if not len(buf.rows):
+            buf.first_at = monotonic()
+        buf.rows.append(tuple(row[key] for key in buf.keys))
+        if len(buf.rows) >= self.max_rows and (buf.flush_task is None or buf.flush_task.done()):
+            buf.flush_task = asyncio.create_task(self._flush_table(buf))
+
+    def discard(self, table: str, where: dict) -> list[dict]:
+        """
+        Remove pending rows matching the where dict, return removed rows.
+        Matching rows of a batch being written are returned as well and deleted once their batch is written.
+        """
+        buf = self.tables[table]
+        matches = buf.matcher(where)
+        rows, discarded = [], []
+        for row in buf.rows:
+            (discarded if matches(row) else rows).append(row)
+        if len(in_flight := [row for batch in buf.in_flight for row in batch if matches(row)]):
+            buf.deletes += in_flight
+            discarded += in_flight
+        if len(discarded):
+            buf.rows = rows
+            self.rows_discarded += len(discarded)
+        return [dict(zip(buf.keys, row)) for row in discarded]
+
+    async def think(self, frame_time: float = None):
+        """ Flush tables with rows pending for longer than max_delay """
+        now = monotonic()
+        for buf in self.tables.values():
+            if len(buf.rows) and now - buf.first_at >= self.max_delay:
+                await self._flush_table(buf)
+
+    async def flush(self):
+        """ Write all pending rows """
+        for buf in self.tables.values():
+            if buf.flush_task is not None:
+                await buf.flush_task
+            if len(buf.rows):
+                await self._flush_table(buf)
+
+    async def _flush_table(self, buf: _TableBuffer):
+        # swap the rows list first, so rows added during the write go to the next batch
+        rows, buf.rows = buf.rows, []
+        buf.in_flight.append(rows)
+        started_at = monotonic()
+        try:
+            written = await self._write_rows(buf, rows)
+        finally:
+            buf.in_flight.remove(rows)
+            await self._apply_deletes(buf, rows)
+        if not written:
+            return
+
+        latency = monotonic() - started_at
+        self.flushes += 1
+        self.rows_written += written
+        self.last_flush_latency = latency
+        self.max_flush_latency = max(self.max_flush_latency, latency)
+        self.total_flush_latency += latency
+
+    async def _write_rows(self, buf: _TableBuffer, rows: list[tuple]) -> int:
+        """ Write a batch, return the number of rows written """
+        try:
+            # in a transaction, so a failed batch leaves no rows behind to conflict with the row by row writes
+            async with self.db.transaction(begin=True) as tx:
+                await tx.insert_many(buf.table, buf.keys, rows, on_conflict=buf.on_conflict)
+            return len(rows)
+        except Exception as e:
+            batch_error = e
+
+        # a single bad row (duplicate key, NULL in a NOT NULL column...) fails the batch, write the rows one by one
+        # and drop only the failing ones
+        self.batches_failed += 1
+        failed = []
+        for row in rows:
+            try:
+                await self.db.insert(buf.table, dict(zip(buf.keys, row)), on_conflict=buf.on_conflict)
+            except Exception as e:
+                failed.append((row, e))
+        if len(failed) < len(rows):
+            self.rows_failed += len(failed)
+            for row, e in failed:
+                logger.error(f'Failed to write a row to {buf.table}, dropping {dict(zip(buf.keys, row))}: {e}')
+            return len(rows) - len(failed)
+
+        # nothing could be written, the database is likely unavailable,
+        # put the rows back unless the buffer is overgrown, in this case rows are lost
+        if len(buf.rows) + len(rows) <= self.max_rows * 10:
+            buf.rows = rows + buf.rows
+            buf.first_at = monotonic()
+            logger.error(f'Failed to flush {len(rows)} rows to {buf.table}, will retry: {batch_error}')
+        else:
+            self.rows_failed += len(rows)
+            logger.error(f'Failed to flush {len(rows)} rows to {buf.table}, dropping: {batch_error}')
+        return 0
+
+    async def _apply_deletes(self, buf: _TableBuffer, batch: list[tuple]):
+        """
+        Delete the rows of the batch discarded while it was in flight, from the buffer if they were put back.
+        Rows are told apart by identity, so an equal row added again meanwhile is kept.
+        """
+        batch_ids = {id(row) for row in batch}
+        deletes = [row for row in buf.deletes if id(row) in batch_ids]
+        if not len(deletes):
+            return
+        delete_ids = {id(row) for row in deletes}
+        buf.deletes = [row for row in buf.deletes if id(row) not in delete_ids]
+        pending_ids = {id(row) for row in buf.rows}
+        if len(put_back := delete_ids & pending_ids):
+            buf.rows = [row for row in buf.rows if id(row) not in put_back]
+        for row in deletes:
+            if id(row) in put_back:
+                continue
+            # buffered rows do not know their database ids, the written row is matched by its values (but NULLs)
+            where = {key: value for key, value in zip(buf.keys, row) if value is not None}
+            try:
+                await self.db.delete(buf.table, where)
+            except Exception as e:
+                logger.error(f'Failed to delete the discarded row of {buf.table} {where}: {e}')
+
+    def stats(self) -> dict:
+        return {
+            'queue_depth': {table: len(buf.rows) for table, buf in self.tables.items()},
+            'flushes': self.flushes,
+            'rows_written': self.rows_written,
+            'rows_discarded': self.rows_discarded,
+            'rows_failed': self.rows_failed,
+            'batches_failed': self.batches_failed,
+            'last_flush_latency': self.last_flush_latency,
+            'max_flush_latency': self.max_flush_latency,
+            'avg_flush_latency': self.total_flush_latency / self.flushes if self.flushes else 0.0
+        }
+
 
 db = Database()
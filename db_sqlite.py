@@ -0,0 +1,195 @@
+import re
+import asyncio
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+import aiomysql
+
+"""
+SQLite backend for db.Database, selected with DB_BACKEND = 'sqlite'.
+Provides a connections pool with the subset of the aiomysql Pool/Connection/Cursor interface Database uses,
+every connection runs its statements in its own thread, so the event loop is never blocked on disk io.
+MySQL-specific SQL emitted by the bot is translated to the SQLite dialect, see translate().
+"""
+
+BUSY_TIMEOUT = 5000  # wait for a concurrent writer to commit before failing with 'database is locked' (ms)
+TRANSLATE_CACHE_SIZE = 512
+
+
+@lru_cache(maxsize=TRANSLATE_CACHE_SIZE)
+def translate(query: str) -> str:
+    """ Translate a MySQL statement to SQLite """
+    if (match := re.match(r'^(EXPLAIN(?: QUERY PLAN)?\s+)(.*)$', query, flags=re.S)) is not None:
+        # the explained statement is translated the same way, e.g. a sampled slow DELETE ... LIMIT of db.QueryLog
+        return match.group(1) + translate(match.group(2))
+    query = query.replace('%s', '?')
+    query = re.sub(r'^INSERT IGNORE\b', 'INSERT OR IGNORE', query)  # REPLACE INTO is the same in both
+    if (match := re.search(r'\bON DUPLICATE KEY UPDATE\b(.*)$', query, flags=re.S)) is not None:
+        # sqlite upsert without a conflict target applies to any unique constraint, same as mysql
+        query = query[:match.start()] + 'ON CONFLICT DO UPDATE SET' + re.sub(
+            r'\bVALUES\((`?\w+`?)\)', r'excluded.\1', match.group(1)
+        )
+    query = re.sub(r'\bcollate\s+utf8mb4_\w+', 'COLLATE NOCASE', query, flags=re.I)
+    if (match := re.match(r'^DELETE FROM (\S+) WHERE (.*?)\s+(ORDER BY .*?LIMIT .*)$', query, flags=re.S)) is not None:
+        # DELETE ... ORDER BY ... LIMIT is not available in the default sqlite build
+        table, where, order_limit = match.groups()
+        query = f'DELETE FROM {table} WHERE rowid IN (SELECT rowid FROM {table} WHERE {where} {order_limit})'
+    return query
+
+
+def _dict_factory(cursor: sqlite3.Cursor, row: tuple) -> dict:
+    return {column[0]: value for column, value in zip(cursor.description, row)}
+
+
+class Cursor:
+    """ aiomysql.Cursor alike wrapper, returns rows as dicts unless as_dict is unset """
+
+    def __init__(self, conn: 'Connection', as_dict: bool):
+        self._conn = conn
+        self._cur = conn.sqlite.cursor()
+        self._cur.row_factory = _dict_factory if as_dict else None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        self._cur.close()
+
+    @property
+    def lastrowid(self) -> int:
+        return self._cur.lastrowid
+
+    @property
+    def rowcount(self) -> int:
+        return self._cur.rowcount
+
+    async def execute(self, query: str, args=None) -> int:
+        await self._conn.run(self._cur.execute, translate(query), args or ())
+        return self._cur.rowcount
+
+    async def executemany(self, query: str, args) -> int:
+        await self._conn.run(self._cur.executemany, translate(query), args)
+        return self._cur.rowcount
+
+    async def fetchone(self) -> dict | tuple | None:
+        return await self._conn.run(self._cur.fetchone)
+
+    async def fetchmany(self, size: int) -> list[dict | tuple]:
+        return await self._conn.run(self._cur.fetchmany, size)
+
+    async def fetchall(self) -> list[dict | tuple]:
+        return await self._conn.run(self._cur.fetchall)
+
+
+class Connection:
+    """ A sqlite connection bound to a single worker thread """
+
+    def __init__(self, sqlite: sqlite3.Connection, loop: asyncio.AbstractEventLoop):
+        self.sqlite = sqlite
+        self.loop = loop
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='sqlite')
+
+    @staticmethod
+    def open(path: str) -> sqlite3.Connection:
+        # isolation_level=None is autocommit, transactions are started explicitly by begin()
+        conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')  # durable across application crashes in WAL mode
+        conn.execute(f'PRAGMA busy_timeout={BUSY_TIMEOUT}')
+        return conn
+
+    async def run(self, func, *args):
+        return await self.loop.run_in_executor(self._executor, func, *args)
+
+    def cursor(self, cursor_class=None) -> Cursor:
+        return Cursor(self, as_dict=cursor_class not in (aiomysql.Cursor, aiomysql.SSCursor))
+
+    async def begin(self):
+        # take the write lock upfront, a deferred transaction fails to upgrade to a writer if another one commits first
+        await self.run(self.sqlite.execute, 'BEGIN IMMEDIATE')
+
+    async def begin_read(self):
+        # a deferred transaction reads from a single snapshot and does not block the writers
+        await self.run(self.sqlite.execute, 'BEGIN DEFERRED')
+
+    async def commit(self):
+        await self.run(self.sqlite.commit)
+
+    async def rollback(self):
+        await self.run(self.sqlite.rollback)
+
+    async def close(self):
+        await self.run(self.sqlite.close)
+        self._executor.shutdown()
+
+
+class Pool:
+    """ Fixed size pool of sqlite connections, WAL mode allows concurrent readers along with a single writer """
+
+    def __init__(self, path: str, size: int, loop: asyncio.AbstractEventLoop):
+        self.path = path
+        self.maxsize = size
+        self._loop = loop
+        self._free: asyncio.Queue[Connection] = asyncio.Queue()
+        self._all: list[Connection] = []
+        self._size = 0  # opened and being opened connections
+        self._closing = False
+        self._closed = asyncio.Event()  # set once every connection is closed after close()
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    @property
+    def freesize(self) -> int:
+        return self._free.qsize()
+
+    async def acquire(self) -> Connection:
+        if self._closing:
+            raise RuntimeError('Cannot acquire a connection after closing the pool.')
+        if self._free.empty() and self._size < self.maxsize:
+            self._size += 1
+            try:
+                conn = Connection(await self._loop.run_in_executor(None, Connection.open, self.path), self._loop)
+            except BaseException:
+                self._size -= 1
+                raise
+            self._all.append(conn)
+            return conn
+        return await self._free.get()
+
+    async def release(self, conn: Connection):
+        if conn.sqlite.in_transaction:
+            await conn.rollback()
+        if self._closing:
+            await conn.close()
+            self._forget(conn)
+            return
+        self._free.put_nowait(conn)
+
+    def close(self):
+        """ Close the free connections, the acquired ones are closed once released, see wait_closed() """
+        self._closing = True
+        while not self._free.empty():
+            conn = self._free.get_nowait()
+            conn.sqlite.close()  # idle, its thread is not running a statement
+            conn._executor.shutdown(wait=False)
+            self._forget(conn)
+        if not self._size:
+            self._closed.set()
+
+    async def wait_closed(self):
+        """ Wait until the acquired connections are released and closed """
+        await self._closed.wait()
+
+    def _forget(self, conn: Connection):
+        self._all.remove(conn)
+        self._size -= 1
+        if self._closing and not self._size:
+            self._closed.set()
+
+
+async def create_pool(path: str, size: int, loop: asyncio.AbstractEventLoop) -> Pool:
+    pool = Pool(path, size, loop)
+    await pool.release(await pool.acquire())  # fail early on a bad path
+    return pool
@@ -0,0 +1,91 @@
+import re
+import sys
+import asyncio
+from pathlib import Path
+from time import time
+
+from db import db
+from config import DB_BACKEND
+
+"""
+Database schema migrations.
+Migrations are numbered sql files in sql/migrations (0001_name.sql, 0002_name.sql, ...),
+applied versions are recorded in the schema_version table.
+SQLite versions of the migrations and of create_tables.sql are in sql/migrations/sqlite and sql/sqlite.
+Usage:
+    python migrate.py          # apply pending migrations
+    python migrate.py status   # list migrations and their state
+"""
+
+SQL_DIR = Path(__file__).parent / 'sql'
+if DB_BACKEND == 'sqlite':
+    CREATE_TABLES = SQL_DIR / 'sqlite' / 'create_tables.sql'
+    MIGRATIONS_DIR = SQL_DIR / 'migrations' / 'sqlite'
+else:
+    CREATE_TABLES = SQL_DIR / 'create_tables.sql'
+    MIGRATIONS_DIR = SQL_DIR / 'migrations'
+
+
+def load_migrations() -> dict[int, Path]:
+    """ Return migration files as {version: path} sorted by version """
+    migrations = {}
+    for path in MIGRATIONS_DIR.glob('*.sql'):
+        if (match := re.match(r'^(\d+)_\w+\.sql$', path.name)) is None:
+            continue
+        migrations[int(match.group(1))] = path
+    return dict(sorted(migrations.items()))
+
+
+def split_statements(sql: str) -> list[str]:
+    """ Split a migration file into single statements, drop comments """
+    sql = re.sub(r'--[^\n]*', '', sql)
+    return [i.strip() for i in sql.split(';') if len(i.strip())]
+
+
+async def applied_versions() -> set[int]:
+    await db.execute(
+        "CREATE TABLE IF NOT EXISTS `schema_version` ("
+        "`version` INT UNSIGNED NOT NULL, `name` VARCHAR(191) NOT NULL, `applied_at` BIGINT UNSIGNED NOT NULL, "
+        "PRIMARY KEY (`version`))"
+    )
+    return {i['version'] for i in await db.fetch_all("SELECT `version` FROM `schema_version`")}
+
+
+async def migrate() -> list[str]:
+    """ Apply pending migrations in order, return names of applied migrations """
+    applied = await applied_versions()
+    done = []
+    for version, path in load_migrations().items():
+        if version in applied:
+            continue
+        print(f'Applying {path.name}...')
+        # MySQL DDL statements commit implicitly, so a failed migration has to be fixed up by hand
+        for statement in split_statements(path.read_text()):
+            await db.execute(statement)
+        await db.insert('schema_version', {'version': version, 'name': path.name, 'applied_at': int(time())})
+        done.append(path.name)
+    return done
+
+
+async def status() -> list[str]:
+    applied = await applied_versions()
+    return [
+        f"{path.name}: {'applied' if version in applied else 'pending'}"
+        for version, path in load_migrations().items()
+    ]
+
+
+async def main(command: str):
+    await db.connect(loop=asyncio.get_running_loop())
+    try:
+        if command == 'status':
+            print('\n'.join(await status()) or 'No migrations.')
+        else:
+            done = await migrate()
+            print(f'Applied {len(done)} migrations.' if len(done) else 'Database is up to date.')
+    finally:
+        await db.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(main(sys.argv[1] if len(sys.argv) > 1 else 'migrate'))
@@ -8,3 +8,4 @@ from . import qstat
 from . import isolator
 from . import twitch
 from . import booru
+from . import stats_retention
@@ -23,7 +23,8 @@ async def autocomplete_emoji(sai: SlashAutocompleteInteraction) -> list[dict]:
     value = sai.value.lower()
     return [
         {'name': i['name'], 'value': i['name']}
-        for i in await sai.bot.api_get_cached(f'/guilds/{sai.guild.id}/emojis')
+        # the emojis list rarely changes, an outdated one is fine for the suggestions while it is refreshed
+        for i in await sai.bot.api_get_cached(f'/guilds/{sai.guild.id}/emojis', stale_delay=60)
         if i['name'].find(value) >= 0
     ][:25]
 
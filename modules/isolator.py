@@ -9,6 +9,7 @@ from nextcore.http.errors import HTTPRequestStatusError
 from common import parse_duration
 from db import db
 from bot import bot, FakeMember
+import cluster
 from bot.errors import BotNotFoundError, BotSyntaxError, BotValueError
 
 if TYPE_CHECKING:
@@ -80,19 +81,37 @@ async def isolate(sci: SlashCommandInteraction, user: str, duration: str, reason
     if duration < 0 or duration > 311040000:
         raise BotValueError("Duration must be lesser that 10 years, bud.")
 
-    # Update existing isolator record if possible
-    case = await db.select_one(
-        'isolator',
-        {'guild_id': sci.guild.id, 'user_id': member.id, 'is_active': True}
-    )
+    # Update existing isolator record if possible or create a new one
+    async with db.transaction(begin=True) as tx:
+        case = await tx.select_one(
+            'isolator',
+            {'guild_id': sci.guild.id, 'user_id': member.id, 'is_active': True}
+        )
+        if case is not None:
+            update_data = {
+                'user_id': member.id, 'duration': duration,
+                'author_id': sci.author.id, 'author_username': sci.author.username
+            }
+            if reason:
+                update_data['reason'] = reason
+            await tx.update('isolator', where={'case_id': case['case_id']}, data=update_data)
+        else:
+            await tx.insert(
+                'isolator',
+                {
+                    'guild_id': sci.guild.id,
+                    'user_id': member.id,
+                    'username': member.username,
+                    'name': member.display_name,
+                    'at': int(time()),
+                    'duration': duration,
+                    'author_id': sci.author.id,
+                    'author_username': sci.author.username,
+                    'reason': reason
+                }
+            )
+
     if case is not None:
-        update_data = {
-            'user_id': member.id, 'duration': duration,
-            'author_id': sci.author.id, 'author_username': sci.author.username
-        }
-        if reason:
-            update_data['reason'] = reason
-        await db.update('isolator', where={'case_id': case['case_id']}, data=update_data)
         await sci.reply(f"Updated `{case['username']}`'s case.")
         await _add_roles(sci.guild, member.id, isolated=True, muted=case['is_muted'])
         await _post_audit_string(
@@ -106,21 +125,6 @@ async def isolate(sci: SlashCommandInteraction, user: str, duration: str, reason
         )
         return
 
-    # Create new isolator record
-    await db.insert(
-        'isolator',
-        {
-            'guild_id': sci.guild.id,
-            'user_id': member.id,
-            'username': member.username,
-            'name': member.display_name,
-            'at': int(time()),
-            'duration': duration,
-            'author_id': sci.author.id,
-            'author_username': sci.author.username,
-            'reason': reason
-        }
-    )
     await sci.reply(f'`{member.username}` is taken to the isolation ward.')
     await _add_roles(sci.guild, member.id, isolated=True, muted=False)
     await _post_audit_string(sci.guild, "`{author}` has isolated `{prisoner}`. Duration: `{left}`.{reason}".format(
@@ -236,7 +240,7 @@ async def on_member_remove(data: GuildMemberRemoveData):
     ))
 
 
-@bot.on_think
+@bot.on_think(singleton=True)
 async def check_isolator(frame_time: float):
     global LAST_ISOLATOR_CHECK
     if frame_time - LAST_ISOLATOR_CHECK < ISOLATOR_CHECK_DELAY:
@@ -247,12 +251,20 @@ async def check_isolator(frame_time: float):
         (int(frame_time),)
     )
     for case in to_release_cases:
-        await _release_expired_case(case)
+        # the guild could be served by another worker of the cluster, the case stays active if it can not be reached
+        try:
+            await cluster.link.call_guild(case['guild_id'], 'isolator.release_case', case)
+        except cluster.WorkerUnreachable as e:
+            logger.error(f"Failed to release isolator case {case['case_id']}, will retry: {e}")
+            continue
+        except Exception as e:
+            # the release itself failed, retrying would only repeat it
+            logger.error(f"Failed to release isolator case {case['case_id']}: {e!r}")
+        await db.update('isolator', data={'is_active': False}, where={'case_id': case['case_id']})
 
 
+@cluster.handler('isolator.release_case')
 async def _release_expired_case(case: dict):
-    await db.update('isolator', data={'is_active': False}, where={'case_id': case['case_id']})
-
     if (guild := bot.guilds.get(str(case['guild_id']))) is None:
         logger.warning(f"Missing guild {case['guild_id']} for an isolator record {case['case_id']}.")
         return
@@ -265,9 +277,9 @@ async def _release_expired_case(case: dict):
             ))
         return
 
+    await _remove_roles(guild, member.id, isolated=False, muted=False)
     await _post_audit_string(
         guild,
         "Prisoner `{prisoner}` was released from the isolation ward (the time served has expired).".format(
             prisoner=case['username']
         ))
-    await _remove_roles(guild, member.id, isolated=False, muted=False)
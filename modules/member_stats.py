@@ -3,14 +3,15 @@ from typing import TYPE_CHECKING
 from logging import getLogger
 from time import time
 from datetime import timedelta
+from collections import defaultdict
 
 from bot import bot
 from bot import errors
-from db import db
+from db import db, WriteBuffer
 from common import parse_user_mention, Colors
 
 if TYPE_CHECKING:
-    from discord_typings import MessageCreateData, PresenceUpdateData, MessageReactionAddData, MessageReactionRemoveData
+    from discord_typings import MessageCreateData, MessageReactionAddData, MessageReactionRemoveData
     from bot import SlashCommandInteraction, MemberPresence
 
 """
@@ -18,6 +19,100 @@ Guild member stats profile.
 """
 
 logger = getLogger(__name__)
+DAY = 60 * 60 * 24
+PROFILE_DAYS = 30  # /profile stats period
+BUFFER_MAX_ROWS = 500  # flush a table once this many rows are pending
+BUFFER_MAX_DELAY = 5  # or once the oldest pending row is older than this (seconds)
+
+stats_buffer = WriteBuffer(db, max_rows=BUFFER_MAX_ROWS, max_delay=BUFFER_MAX_DELAY)
+stats_buffer.register(
+    'mbr_stats_messages', ['guild_id', 'channel_id', 'user_id', 'message_id', 'reply_to_user', 'at']
+)
+stats_buffer.register(
+    'mbr_stats_reactions', ['guild_id', 'message_id', 'message_author_id', 'user_id', 'emoji', 'emoji_id', 'at']
+)
+stats_buffer.register(
+    'mbr_stats_presence', ['guild_id', 'user_id', 'status', 'started_at', 'ended_at', 'duration']
+)
+stats_buffer.register('mbr_stats_last_logoff', ['guild_id', 'user_id', 'at'], on_conflict='replace')
+
+
+class DailyRollup:
+    """
+    In-memory increments of per (guild, user, day) counters, added to mbr_stats_daily rows on flush,
+    and of the reactions sent per (guild, user, day, emoji), added to mbr_stats_emoji_daily rows.
+    Days are counted since the unix epoch, presence durations are split between the days they span.
+    """
+    COLUMNS = ('messages', 'replies', 'reactions_sent', 'reactions_recv', 'online', 'idle', 'dnd', 'offline')
+    _column_index = {column: n for n, column in enumerate(COLUMNS)}
+
+    def __init__(self, max_delay: float):
+        self.max_delay = max_delay
+        self.counters: defaultdict[tuple[str, str, int], list[int]] = defaultdict(lambda: [0] * len(self.COLUMNS))
+        self.emojis: defaultdict[tuple[str, str, int, str, str | None], int] = defaultdict(int)
+        self.last_flush = time()
+
+    def add(self, guild_id: str, user_id: str, at: int, column: str, value: int = 1):
+        self.counters[(guild_id, user_id, at // DAY)][self._column_index[column]] += value
+
+    def add_duration(self, guild_id: str, user_id: str, status: str, started_at: int, ended_at: int):
+        """ Add a presence interval to the status counters of every day it spans """
+        for day, seconds in day_spans(started_at, ended_at):
+            self.counters[(guild_id, user_id, day)][self._column_index[status]] += seconds
+
+    def add_emoji(self, guild_id: str, user_id: str, at: int, emoji: str, emoji_id: str | None, value: int = 1):
+        self.emojis[(guild_id, user_id, at // DAY, emoji, emoji_id)] += value
+
+    async def think(self, frame_time: float):
+        if frame_time - self.last_flush >= self.max_delay:
+            await self.flush()
+
+    async def flush(self):
+        self.last_flush = time()
+        if not len(self.counters) and not len(self.emojis):
+            return
+        counters, self.counters = self.counters, defaultdict(lambda: [0] * len(self.COLUMNS))
+        emojis, self.emojis = self.emojis, defaultdict(int)
+        try:
+            # in a transaction, so a failed flush leaves no partial increments behind to be added again
+            async with db.transaction(begin=True) as tx:
+                if len(counters):
+                    await tx.insert_increment_many(
+                        'mbr_stats_daily',
+                        ['guild_id', 'user_id', 'day'],
+                        list(self.COLUMNS),
+                        [(*key, *values) for key, values in counters.items()]
+                    )
+                if len(emojis):
+                    await tx.insert_increment_many(
+                        'mbr_stats_emoji_daily',
+                        ['guild_id', 'user_id', 'day', 'emoji', 'emoji_id'],
+                        ['reactions'],
+                        [(*key, value) for key, value in emojis.items()]
+                    )
+        except Exception as e:
+            # merge the increments back, they are retried with the next flush
+            for key, values in counters.items():
+                pending = self.counters[key]
+                for n, value in enumerate(values):
+                    pending[n] += value
+            for key, value in emojis.items():
+                self.emojis[key] += value
+            logger.error(f'Failed to flush {len(counters) + len(emojis)} daily rollup rows, will retry: {e}')
+
+
+def day_spans(started_at: int, ended_at: int) -> list[tuple[int, int]]:
+    """ Split an interval into (day, seconds) parts by the day boundaries """
+    spans = []
+    while started_at < ended_at:
+        day = started_at // DAY
+        part_end = min(ended_at, (day + 1) * DAY)
+        spans.append((day, part_end - started_at))
+        started_at = part_end
+    return spans
+
+
+daily_rollup = DailyRollup(max_delay=BUFFER_MAX_DELAY)
 
 
 @bot.event_dispatcher.listen('MESSAGE_CREATE')
@@ -31,12 +126,13 @@ async def on_message(data: MessageCreateData):
         return
 
     # if the message is a reply get user_id of the referenced message author
-    if data['type'] == 19 and (ref := data.get('referenced_mesage')) is not None:
+    if data['type'] == 19 and (ref := data.get('referenced_message')) is not None:
         reply_to_user = None if ref.get('webhook_id') else ref['author']['id']
     else:
         reply_to_user = None
 
-    await db.insert(
+    now = int(time())
+    stats_buffer.put(
         'mbr_stats_messages',
         {
             'guild_id': data['guild_id'],
@@ -44,9 +140,12 @@ async def on_message(data: MessageCreateData):
             'user_id': data['author']['id'],
             'message_id': data['id'],
             'reply_to_user': reply_to_user,
-            'at': int(time())
+            'at': now
         }
     )
+    daily_rollup.add(data['guild_id'], data['author']['id'], now, 'messages')
+    if reply_to_user is not None and reply_to_user != data['author']['id']:
+        daily_rollup.add(data['guild_id'], reply_to_user, now, 'replies')
 
 
 @bot.event_dispatcher.listen('MESSAGE_REACTION_ADD')
@@ -55,18 +154,37 @@ async def on_reaction_add(data: MessageReactionAddData):
     if 'guild_id' not in data:
         return
 
-    await db.insert(
+    # skip reactions to webhook and system messages, message_author_id is missing and the column is NOT NULL
+    if data.get('message_author_id') is None:
+        return
+
+    now = int(time())
+    stats_buffer.put(
         'mbr_stats_reactions',
         {
             'guild_id': data['guild_id'],
             'message_id': data['message_id'],
-            'message_author_id': data.get('message_author_id'),  # this could be missing on webhook messages
+            'message_author_id': data['message_author_id'],
             'user_id': data['user_id'],
             'emoji': data['emoji']['name'],
             'emoji_id': data['emoji']['id'],
-            'at': int(time())
+            'at': now
         }
     )
+    _rollup_reaction(
+        data['guild_id'], data['user_id'], data['message_author_id'], data['emoji']['name'], data['emoji']['id'], now, 1
+    )
+
+
+def _rollup_reaction(
+        guild_id: str, user_id: str, message_author_id: str | None, emoji: str | None, emoji_id: str | None,
+        at: int, value: int
+):
+    daily_rollup.add(guild_id, user_id, at, 'reactions_sent', value)
+    if message_author_id is not None and str(message_author_id) != str(user_id):
+        daily_rollup.add(guild_id, str(message_author_id), at, 'reactions_recv', value)
+    if emoji is not None:  # the name of a deleted custom emoji is missing
+        daily_rollup.add_emoji(guild_id, user_id, at, emoji, emoji_id, value)
 
 
 @bot.event_dispatcher.listen('MESSAGE_REACTION_REMOVE')
@@ -76,106 +194,189 @@ async def on_reaction_remove(data: MessageReactionRemoveData):
         return
 
     emoji_id = data['emoji']['id']
-    await db.delete(
-        'mbr_stats_reactions',
-        {
-            'user_id': data['user_id'],
-            'message_id': data['message_id'],
-            # delete either by emoji_id if exists or by emoji name
-            **({'emoji_id': emoji_id} if emoji_id is not None else {'emoji': data['emoji']['name']})
-        }
-    )
+    where = {
+        'user_id': data['user_id'],
+        'message_id': data['message_id'],
+        # delete either by emoji_id if exists or by emoji name
+        **({'emoji_id': emoji_id} if emoji_id is not None else {'emoji': data['emoji']['name']})
+    }
+    # the reaction row is not written yet
+    if not len(rows := stats_buffer.discard('mbr_stats_reactions', where)):
+        rows = await db.select('mbr_stats_reactions', where)
+        if not len(rows):
+            return
+        await db.delete('mbr_stats_reactions', where)
+
+    for row in rows:
+        _rollup_reaction(
+            data['guild_id'], data['user_id'], row['message_author_id'], row['emoji'], row['emoji_id'], row['at'], -1
+        )
 
 
 @bot.event_dispatcher.listen('BOT_MEMBER_PRESENCE_CHANGE')
-async def on_bot_member_presence_change(old_presence: MemberPresence, presence_data: PresenceUpdateData):
-    if old_presence.status == presence_data['status']:
+async def on_bot_member_presence_change(
+        guild_id: str, user_id: str, old_presence: MemberPresence, new_presence: MemberPresence
+):
+    if old_presence.status == new_presence.status:
         return
 
-    now = int(time())
-    await db.insert(
+    # the change is dispatched once settled, it happened at new_presence.at
+    now = new_presence.at
+    stats_buffer.put(
         'mbr_stats_presence',
         {
-            'guild_id': presence_data['guild_id'],
-            'user_id': presence_data['user']['id'],
+            'guild_id': guild_id,
+            'user_id': user_id,
             'status': old_presence.status,
             'started_at': old_presence.at,
             'ended_at': now,
             'duration': now-old_presence.at
         }
     )
+    daily_rollup.add_duration(guild_id, user_id, old_presence.status, old_presence.at, now)
 
-    if presence_data['status'] == 'offline':
-        await db.insert(
+    if new_presence.status == 'offline':
+        stats_buffer.put(
             'mbr_stats_last_logoff',
             {
-                'guild_id': presence_data['guild_id'],
-                'user_id': presence_data['user']['id'],
+                'guild_id': guild_id,
+                'user_id': user_id,
                 'at': now
-            },
-            on_conflict='replace'
+            }
         )
 
 
+@bot.on_think
+async def flush_stats_buffer(frame_time: float):
+    await stats_buffer.think(frame_time)
+    await daily_rollup.think(frame_time)
+
+
 @bot.on_close()
 async def on_bot_close():
+    # the open intervals of the guilds written to the state snapshot continue on the next start
     logger.info('Saving presences...')
     now = int(time())
     for guild in bot.guilds.values():
-        await db.insert_many(
-            'mbr_stats_presence',
-            ['guild_id', 'user_id', 'status', 'started_at', 'ended_at', 'duration'],
-            [
-                [guild.id, user_id, presence.status, presence.at, now, now-presence.at]
-                for user_id, presence in guild.presences.items()
-            ]
+        if guild.id not in bot.snapshot.saved_guilds:
+            await save_presences(guild.id, list(guild.presences.items()), now)
+    logger.info('Flushing stats buffer...')
+    await stats_buffer.flush()
+    await daily_rollup.flush()
+
+
+@bot.event_dispatcher.listen('BOT_PRESENCES_ENDED')
+async def on_bot_presences_ended(guild_id: str, presences: list[tuple[str, MemberPresence]], ended_at: int):
+    # the state snapshot intervals which did not continue after the restart
+    await save_presences(guild_id, presences, ended_at)
+
+
+async def save_presences(guild_id: str, presences: list[tuple[str, MemberPresence]], ended_at: int):
+    """ Write the presence intervals ended at once """
+    await db.insert_many(
+        'mbr_stats_presence',
+        ['guild_id', 'user_id', 'status', 'started_at', 'ended_at', 'duration'],
+        [
+            [guild_id, user_id, presence.status, presence.at, ended_at, ended_at-presence.at]
+            for user_id, presence in presences
+        ]
+    )
+    for user_id, presence in presences:
+        daily_rollup.add_duration(guild_id, user_id, presence.status, presence.at, ended_at)
+
+
+async def backfill_rollups(batch_size: int = 5000) -> str:
+    """
+    Rebuild mbr_stats_daily rows from the raw stats tables, run once from the CLI after deploying the rollups:
+        modules.member_stats.backfill_rollups()
+    Only days before the current one are rebuilt, the current day is left to the live counters.
+    """
+    await stats_buffer.flush()
+    await daily_rollup.flush()
+    today_at = int(time()) // DAY * DAY
+    counters = defaultdict(lambda: [0] * len(DailyRollup.COLUMNS))
+    index = {column: n for n, column in enumerate(DailyRollup.COLUMNS)}
+
+    async for guild_id, user_id, reply_to_user, at in db.iterate(
+            "SELECT guild_id, user_id, reply_to_user, at FROM mbr_stats_messages WHERE at<%s", (today_at, ),
+            as_tuples=True
+    ):
+        counters[(guild_id, user_id, at // DAY)][index['messages']] += 1
+        if reply_to_user is not None and reply_to_user != user_id:
+            counters[(guild_id, reply_to_user, at // DAY)][index['replies']] += 1
+
+    emojis = {}  # {(guild_id, user_id, day, emoji name lowercased): [emoji, emoji_id, reactions]}
+    async for guild_id, user_id, message_author_id, emoji, emoji_id, at in db.iterate(
+            "SELECT guild_id, user_id, message_author_id, emoji, emoji_id, at FROM mbr_stats_reactions WHERE at<%s",
+            (today_at, ), as_tuples=True
+    ):
+        counters[(guild_id, user_id, at // DAY)][index['reactions_sent']] += 1
+        if message_author_id is not None and message_author_id != user_id:
+            counters[(guild_id, message_author_id, at // DAY)][index['reactions_recv']] += 1
+        if emoji is not None:
+            # the emoji column is case insensitive
+            emojis.setdefault((guild_id, user_id, at // DAY, emoji.lower()), [emoji, emoji_id, 0])[2] += 1
+
+    async for guild_id, user_id, status, started_at, ended_at in db.iterate(
+            "SELECT guild_id, user_id, status, started_at, ended_at FROM mbr_stats_presence WHERE started_at<%s",
+            (today_at, ), as_tuples=True
+    ):
+        if status in index:
+            # the part of an interval ended today is left to the live counters as well
+            for day, seconds in day_spans(started_at, min(ended_at, today_at)):
+                counters[(guild_id, user_id, day)][index[status]] += seconds
+
+    # the raw tables are the source of truth for the past days, so the counters are overwritten, not incremented
+    values = [(*key, *values) for key, values in counters.items()]
+    for n in range(0, len(values), batch_size):
+        await db.insert_update_many(
+            'mbr_stats_daily', ['guild_id', 'user_id', 'day'], list(DailyRollup.COLUMNS), values[n:n+batch_size]
+        )
+    emoji_values = [(*key[:3], *values) for key, values in emojis.items()]
+    for n in range(0, len(emoji_values), batch_size):
+        await db.insert_update_many(
+            'mbr_stats_emoji_daily', ['guild_id', 'user_id', 'day', 'emoji'], ['emoji_id', 'reactions'],
+            emoji_values[n:n+batch_size]
         )
+    logger.info(f'Rebuilt {len(values)} daily rollup rows and {len(emoji_values)} emoji rollup rows.')
+    return f'Rollups backfill is done, {len(values) + len(emoji_values)} rows written.'
 
 
 @bot.slash_command('profile')
 async def show_member_profile(sci: SlashCommandInteraction, user: str):
     target = sci.get_resolved_member(user)
     now = int(time())
-    at_after = now-60*60*24*30
-    messages_cnt = (await db.fetch_one(
-        "SELECT COUNT(*) as cnt FROM mbr_stats_messages WHERE guild_id=%s AND user_id=%s AND at>%s",
-        (sci.guild.id, target.id, at_after)
-    ))['cnt']
-    replies_cnt = (await db.fetch_one(
-        "SELECT COUNT(*) as cnt FROM mbr_stats_messages WHERE guild_id=%s AND reply_to_user=%s AND user_id!=%s AND at>%s",
-        (sci.guild.id, target.id, target.id, at_after)
-    ))['cnt']
-    reactions_sent_cnt = (await db.fetch_one(
-        "SELECT COUNT(*) as cnt FROM mbr_stats_reactions WHERE guild_id=%s AND user_id=%s AND at>%s",
-        (sci.guild.id, target.id, at_after)
-    ))['cnt']
-    reactions_recv_cnt = (await db.fetch_one(
-        "SELECT COUNT(*) as cnt FROM mbr_stats_reactions WHERE guild_id=%s AND message_author_id=%s AND user_id!=%s AND at>%s",
-        (sci.guild.id, target.id, target.id, at_after)
-    ))['cnt']
-
-    presences_stats = await db.fetch_all(
-        "SELECT status, SUM(duration) as duration FROM mbr_stats_presence WHERE guild_id=%s AND user_id=%s AND started_at>%s GROUP BY status",
-        (sci.guild.id, target.id, at_after)
-    )
-    presences = {'online': 0, 'idle': 0, 'dnd': 0, 'offline': 0}
+    # read all stats from a single connection and a consistent snapshot
+    async with db.transaction(read_only=True) as tx:
+        stats = await tx.fetch_one(
+            "SELECT SUM(messages) as messages, SUM(replies) as replies, "
+            "SUM(reactions_sent) as reactions_sent, SUM(reactions_recv) as reactions_recv, "
+            "SUM(online) as online, SUM(idle) as idle, SUM(dnd) as dnd, SUM(offline) as offline "
+            "FROM mbr_stats_daily WHERE guild_id=%s AND user_id=%s AND day>%s",
+            (sci.guild.id, target.id, now // DAY - PROFILE_DAYS)
+        )
+        emojis = await tx.fetch_all(
+            "SELECT emoji, MAX(emoji_id) as emoji_id, SUM(reactions) as cnt FROM mbr_stats_emoji_daily "
+            "WHERE guild_id=%s AND user_id=%s AND day>%s GROUP BY emoji HAVING cnt>0 ORDER BY cnt DESC LIMIT 3",
+            (sci.guild.id, target.id, now // DAY - PROFILE_DAYS)
+        )
+
+        last_logoff = await tx.select_one('mbr_stats_last_logoff', {'guild_id': sci.guild.id, 'user_id': target.id})
+
+    messages_cnt, replies_cnt = int(stats['messages'] or 0), int(stats['replies'] or 0)
+    reactions_sent_cnt, reactions_recv_cnt = int(stats['reactions_sent'] or 0), int(stats['reactions_recv'] or 0)
+
+    presences = {i: int(stats[i] or 0) for i in ('online', 'idle', 'dnd', 'offline')}
     if (presence_now := sci.guild.presences.get(target.id)) is not None:
-        presences[presence_now.status] = now - presence_now.at
-    for i in presences_stats:
-        presences[i['status']] += i['duration']
+        presences[presence_now.status] += now - presence_now.at
     presences_total = sum(presences.values())
     presences = {i: int((presences[i] / presences_total) * 100) for i in presences}
 
-    emojis = await db.fetch_all(
-        "SELECT emoji, emoji_id, COUNT(*) as cnt FROM mbr_stats_reactions WHERE guild_id=%s AND user_id=%s AND at>%s GROUP BY emoji collate utf8mb4_unicode_520_ci ORDER BY cnt DESC LIMIT 3",
-        (sci.guild.id, target.id, at_after)
-    )
     emojis = [
         (f"<:{i['emoji']}:{i['emoji_id']}>" if i['emoji_id'] else i['emoji']) + f" __{i['cnt']}__"
         for i in emojis
     ]
 
-    last_logoff = await db.select_one('mbr_stats_last_logoff', {'guild_id': sci.guild.id, 'user_id': target.id})
     last_logoff = f"{timedelta(seconds=now-last_logoff['at'])} ago" if last_logoff else 'no data'
 
     embed = dict(
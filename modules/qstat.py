@@ -5,7 +5,6 @@ import json
 import GeoIP
 import re
 import socket
-import aiohttp
 from time import time
 from collections import defaultdict
 from string import Formatter
@@ -105,9 +104,8 @@ async def inject_flag_icons(guild: Guild, servers: list[dict]):
         logger.debug('Fetching flags from ip-api.com...')
         payload = list(set((i['address'] for i in missing)))
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post('http://ip-api.com/batch?countryCode', json=payload) as response:
-                    data = await response.json()
+            async with bot.web.post('http://ip-api.com/batch?countryCode', json=payload) as response:
+                data = await response.json()
         except Exception as e:
             logger.error(f"Failed to fetch data from ip-api.com: {e}.")
         else:
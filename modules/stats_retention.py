@@ -0,0 +1,34 @@
+import asyncio
+from logging import getLogger
+from time import time
+
+from bot import bot
+from config import STATS_PRUNE_DELAY
+import retention
+
+"""
+Periodic raw stats tables pruning, see retention.py.
+"""
+
+logger = getLogger(__name__)
+LAST_PRUNE = time()
+PRUNE_TASK: asyncio.Task | None = None
+last_report: dict = {}  # rows pruned and time spent per table on the last run
+
+
+async def _prune():
+    global last_report
+    try:
+        last_report = await retention.prune()
+    except Exception as e:
+        logger.error(f'Stats pruning failed: {e}')
+
+
+@bot.on_think(singleton=True)
+async def prune_stats(frame_time: float):
+    """ Run the pruning in a background task, so the think loop is never held by it """
+    global LAST_PRUNE, PRUNE_TASK
+    if frame_time - LAST_PRUNE < STATS_PRUNE_DELAY or (PRUNE_TASK is not None and not PRUNE_TASK.done()):
+        return
+    LAST_PRUNE = frame_time
+    PRUNE_TASK = asyncio.create_task(_prune())
@@ -1,6 +1,5 @@
 from __future__ import annotations
 from typing import TYPE_CHECKING
-import aiohttp
 
 from bot import bot, errors
 
@@ -17,8 +16,7 @@ async def translate_msg(sci: SlashCommandInteraction):
     except (KeyError, StopIteration):
         raise errors.BotValueError('Message content not found.')
 
-    async with aiohttp.ClientSession() as session:
-        async with session.get(TRANSLATE_ROUTE.format(msg_text)) as resp:
-            data = await resp.json()
+    async with bot.web.get(TRANSLATE_ROUTE.format(msg_text)) as resp:
+        data = await resp.json()
 
     await sci.reply(data[0][0][0])
@@ -4,14 +4,15 @@ from logging import getLogger
 from time import time
 from nextcore.http.errors import UnauthorizedError, HTTPRequestStatusError
 from datetime import datetime, timedelta
-import aiohttp
 import json
 from collections import defaultdict
+from itertools import chain
 
 from db import db
 from common import find
 from config import TWITCH_CLIENT_ID, TWITCH_CLIENT_SECRET, TWITCH_POLL_DELAY
 from bot import bot
+import cluster
 
 
 logger = getLogger(__name__)
@@ -24,10 +25,9 @@ USERS_URL = "https://api.twitch.tv/helix/users?{ids}"
 
 
 async def _fetch_twitch_token():
-    async with aiohttp.ClientSession() as session:
-        async with session.post(TOKEN_URL, raise_for_status=True) as resp:
-            d = json.loads(await resp.text())
-            return d['access_token']
+    async with bot.web.post(TOKEN_URL, raise_for_status=True) as resp:
+        d = json.loads(await resp.text())
+        return d['access_token']
 
 
 async def _fetch_twitch_url(url: str) -> dict:
@@ -35,13 +35,12 @@ async def _fetch_twitch_url(url: str) -> dict:
     global TOKEN
 
     async def _fetch() -> dict:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(
-                url,
-                headers={'client-id': TWITCH_CLIENT_ID, 'Authorization': 'Bearer ' + TOKEN},
-                raise_for_status=True
-            ) as r:
-                return (await r.json())['data']
+        async with bot.web.get(
+            url,
+            headers={'client-id': TWITCH_CLIENT_ID, 'Authorization': 'Bearer ' + TOKEN},
+            raise_for_status=True
+        ) as r:
+            return (await r.json())['data']
 
     if not TOKEN:
         TOKEN = await _fetch_twitch_token()
@@ -131,7 +130,19 @@ def _stream_summary_embed(stream: dict, stream_stat: dict) -> dict:
     }
 
 
-@bot.on_think
+@cluster.handler('twitch.subscriptions')
+async def _twitch_subscriptions() -> list[dict]:
+    """ Twitch config of the guilds served by this process, the poller may run in another worker of the cluster """
+    return [
+        {
+            'guild_id': g.id,
+            'announcement_channel': g.cfg.twitch_announcement_channel or g.id,
+            'twitch_channels': g.cfg.twitch_channels
+        } for g in bot.guilds.values() if len(g.cfg.twitch_channels)
+    ]
+
+
+@bot.on_think(singleton=True)
 async def twitch_think(frame_time: float):
     global LAST_TWITCH_POLL
     if frame_time - LAST_TWITCH_POLL < TWITCH_POLL_DELAY:
@@ -145,9 +156,12 @@ async def twitch_poll():
 
     # Get all twitch user_names to fetch streams for
     channel_to_guilds = defaultdict(list)
-    for g in bot.guilds.values():
-        for i in g.cfg.twitch_channels:
-            channel_to_guilds[i['channel'].lower()].append(g)
+    subscriptions = await cluster.link.call_all('twitch.subscriptions')
+    for guild in chain.from_iterable(subscriptions):
+        for i in guild['twitch_channels']:
+            channel_to_guilds[i['channel'].lower()].append(guild)
+    # the channels of a worker failed to answer are missing, their streams would look ended
+    all_workers_answered = len(subscriptions) == cluster.WORKERS
 
     # Fetch data from twitch and local db
     live_streams = await _fetch_twitch_streams(*channel_to_guilds.keys())
@@ -155,46 +169,55 @@ async def twitch_poll():
 
     # Update streams which is no longer live or no longer need to be tracked
     live_streams_ids = [i['stream_id'] for i in live_streams]
-    for stream in filter(lambda i: i['stream_id'] not in live_streams_ids, known_streams):
-        stream_stat = await db.fetch_one(
-            "SELECT MAX(`viewer_count`) as peak, AVG(`viewer_count`) as average" +
-            "\nFROM `twitch_stat` WHERE `stream_id`=%s",
-            (stream['stream_id'],)
-        )
-        await db.update(
-            'twitch_streams',
-            data={'is_live': False, 'ended_at': int(time())},
-            where={'stream_id': stream['stream_id']}
-        )
-        for guild in channel_to_guilds.get(stream['user_name'].lower()):
+    if all_workers_answered:
+        ended_streams = [i for i in known_streams if i['stream_id'] not in live_streams_ids]
+    else:
+        logger.warning('Not all cluster workers answered, skipping the ended streams check.')
+        ended_streams = []
+    ended_streams_stats = []
+    async with db.transaction(begin=True) as tx:
+        for stream in ended_streams:
+            ended_streams_stats.append(await tx.fetch_one(
+                "SELECT MAX(`viewer_count`) as peak, AVG(`viewer_count`) as average" +
+                "\nFROM `twitch_stat` WHERE `stream_id`=%s",
+                (stream['stream_id'],)
+            ))
+            await tx.update(
+                'twitch_streams',
+                data={'is_live': False, 'ended_at': int(time())},
+                where={'stream_id': stream['stream_id']}
+            )
+
+    for stream, stream_stat in zip(ended_streams, ended_streams_stats):
+        for guild in channel_to_guilds.get(stream['user_name'].lower(), ()):
             await _post_stream_embed(
-                guild.cfg.twitch_announcement_channel or guild.id,
+                guild['announcement_channel'],
                 embed=_stream_summary_embed(stream, stream_stat)
             )
 
+    # Update existing streams and save new streams
     known_streams_ids = [i['stream_id'] for i in known_streams]
-    for stream in live_streams:
-
-        # Update an existing stream
-        if stream['stream_id'] in known_streams_ids:
-            await db.update('twitch_streams', data=stream, where={'stream_id': stream['stream_id']})
-            await db.insert(
-                'twitch_stat',
-                {'stream_id': stream['stream_id'], 'viewer_count': stream['viewer_count'], 'at': now}
-            )
-            continue
-
-        # Save and post announcements for new stream
-        await db.insert('twitch_streams', stream)
-        for guild in channel_to_guilds.get(stream['user_name'].lower()):
-            config_row = find(lambda i: i['channel'].lower() == stream['user_name'].lower(), guild.cfg.twitch_channels)
-            if not config_row:  # config could have been updated during the data fetch
-                continue
+    new_streams = [i for i in live_streams if i['stream_id'] not in known_streams_ids]
+    async with db.transaction(begin=True) as tx:
+        for stream in live_streams:
+            if stream['stream_id'] in known_streams_ids:
+                await tx.update('twitch_streams', data=stream, where={'stream_id': stream['stream_id']})
+                await tx.insert(
+                    'twitch_stat',
+                    {'stream_id': stream['stream_id'], 'viewer_count': stream['viewer_count'], 'at': now}
+                )
+            else:
+                await tx.insert('twitch_streams', stream)
+
+    # Post announcements for new streams
+    for stream in new_streams:
+        for guild in channel_to_guilds.get(stream['user_name'].lower(), ()):
+            config_row = find(lambda i: i['channel'].lower() == stream['user_name'].lower(), guild['twitch_channels'])
             if config_row['allowed_games'].strip() != '*':
                 if all((i.strip().lower() != stream['game_name'].lower() for i in config_row['allowed_games'].split(','))):
                     continue
             await _post_stream_embed(
-                channel_id=guild.cfg.twitch_announcement_channel or guild.id,
+                channel_id=guild['announcement_channel'],
                 content=config_row['message_text'] if len(config_row['message_text'] or '') else None,
                 embed=_stream_to_embed(stream),
             )
@@ -0,0 +1,80 @@
+import sys
+import asyncio
+from logging import getLogger
+from time import time, perf_counter
+
+from db import db
+from config import STATS_RETENTION_DAYS, STATS_PRUNE_CHUNK, STATS_PRUNE_PAUSE
+
+"""
+Raw stats tables retention.
+Rows older than STATS_RETENTION_DAYS are deleted in small primary key ordered chunks with pauses in between,
+up to the newest primary key of the old rows, so a run never holds long locks or keeps a pool connection busy for long.
+Runs periodically from modules/stats_retention.py, or by hand:
+    python retention.py          # prune all configured tables
+    python retention.py <table>  # prune a single table
+"""
+
+logger = getLogger(__name__)
+DAY = 60 * 60 * 24
+
+# table: (primary key, row time column)
+RETENTION_TABLES = {
+    'mbr_stats_messages': ('message_id', 'at'),
+    'mbr_stats_reactions': ('id', 'at'),
+    'mbr_stats_presence': ('id', 'ended_at'),
+    'twitch_stat': ('id', 'at'),
+}
+
+
+async def prune_table(
+        table: str, keep_days: int, chunk_size: int = STATS_PRUNE_CHUNK, pause: float = STATS_PRUNE_PAUSE
+) -> int:
+    """ Delete rows older than keep_days from a table, return the number of deleted rows """
+    pk, at_column = RETENTION_TABLES[table]
+    before = int(time()) - keep_days * DAY
+    # the newest primary key to prune is found with the row time index, so the chunks below scan and lock
+    # the primary key range of the old rows only, not the whole table when the last chunk comes short
+    last = await db.fetch_one(f"SELECT MAX(`{pk}`) AS `last` FROM `{table}` WHERE `{at_column}`<%s", (before,))
+    if last is None or last['last'] is None:
+        return 0
+    query = f"DELETE FROM `{table}` WHERE `{pk}`<=%s AND `{at_column}`<%s ORDER BY `{pk}` LIMIT %s"
+    deleted = 0
+    while True:
+        rows = await db.execute_rowcount(query, (last['last'], before, chunk_size))
+        deleted += rows
+        if rows < chunk_size:
+            return deleted
+        await asyncio.sleep(pause)
+
+
+async def prune(tables: list[str] | None = None) -> dict:
+    """ Prune the configured tables, return rows deleted and seconds spent per table """
+    report = {}
+    for table, keep_days in STATS_RETENTION_DAYS.items():
+        if keep_days is None or (tables is not None and table not in tables):
+            continue
+        if table not in RETENTION_TABLES:
+            logger.warning(f'No retention support for the {table} table, skipping.')
+            continue
+        started_at = perf_counter()
+        rows = await prune_table(table, keep_days)
+        report[table] = {'rows': rows, 'time': round(perf_counter() - started_at, 3)}
+        logger.info(f"Pruned {rows} rows older than {keep_days} days from {table} in {report[table]['time']}s.")
+    return report
+
+
+async def main(tables: list[str] | None):
+    await db.connect(loop=asyncio.get_running_loop())
+    try:
+        report = await prune(tables)
+    finally:
+        await db.close()
+    for table, stats in report.items():
+        print(f"{table}: {stats['rows']} rows pruned in {stats['time']}s")
+    if not len(report):
+        print('Nothing to prune.')
+
+
+if __name__ == '__main__':
+    asyncio.run(main(sys.argv[1:] or None))
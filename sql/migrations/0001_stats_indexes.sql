@@ -0,0 +1,29 @@
+-- /profile counts
+ALTER TABLE `mbr_stats_messages`
+    ADD INDEX `idx_guild_user_at` (`guild_id`, `user_id`, `at`),
+    ADD INDEX `idx_guild_reply_to_user_at` (`guild_id`, `reply_to_user`, `at`);
+
+ALTER TABLE `mbr_stats_reactions`
+    ADD INDEX `idx_guild_user_at` (`guild_id`, `user_id`, `at`),
+    ADD INDEX `idx_guild_message_author_at` (`guild_id`, `message_author_id`, `at`),
+    ADD INDEX `idx_message_user` (`message_id`, `user_id`);  -- reaction remove
+
+ALTER TABLE `mbr_stats_presence`
+    ADD INDEX `idx_guild_user_started_at` (`guild_id`, `user_id`, `started_at`);
+
+-- isolator expiry check and case lookups
+ALTER TABLE `isolator`
+    ADD INDEX `idx_active_at` (`is_active`, `at`),
+    ADD INDEX `idx_guild_user_active` (`guild_id`, `user_id`, `is_active`);
+
+ALTER TABLE `oauth_user`
+    ADD INDEX `idx_api_token` (`api_token`);
+
+ALTER TABLE `oauth_user_guilds`
+    ADD INDEX `idx_user` (`user_id`);
+
+ALTER TABLE `twitch_streams`
+    ADD INDEX `idx_is_live` (`is_live`);
+
+ALTER TABLE `twitch_stat`
+    ADD INDEX `idx_stream` (`stream_id`);
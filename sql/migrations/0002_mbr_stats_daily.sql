@@ -0,0 +1,15 @@
+-- Per member daily stats rollups, maintained by modules/member_stats.py
+CREATE TABLE `mbr_stats_daily` (
+    `guild_id` BIGINT(20) UNSIGNED NOT NULL,
+    `user_id` BIGINT(20) UNSIGNED NOT NULL,
+    `day` INT UNSIGNED NOT NULL,  -- days since the unix epoch (UTC)
+    `messages` INT NOT NULL DEFAULT 0,
+    `replies` INT NOT NULL DEFAULT 0,  -- replies received from other members
+    `reactions_sent` INT NOT NULL DEFAULT 0,
+    `reactions_recv` INT NOT NULL DEFAULT 0,
+    `online` INT NOT NULL DEFAULT 0,  -- presence status durations in seconds, by the day the status started at
+    `idle` INT NOT NULL DEFAULT 0,
+    `dnd` INT NOT NULL DEFAULT 0,
+    `offline` INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (`guild_id`, `user_id`, `day`)
+);
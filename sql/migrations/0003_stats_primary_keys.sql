@@ -0,0 +1,12 @@
+-- Auto increment primary keys for the raw stats tables, retention.py prunes them in primary key order
+ALTER TABLE `mbr_stats_reactions`
+    ADD COLUMN `id` BIGINT(20) UNSIGNED NOT NULL AUTO_INCREMENT FIRST,
+    ADD PRIMARY KEY (`id`);
+
+ALTER TABLE `mbr_stats_presence`
+    ADD COLUMN `id` BIGINT(20) UNSIGNED NOT NULL AUTO_INCREMENT FIRST,
+    ADD PRIMARY KEY (`id`);
+
+ALTER TABLE `twitch_stat`
+    ADD COLUMN `id` BIGINT(20) UNSIGNED NOT NULL AUTO_INCREMENT FIRST,
+    ADD PRIMARY KEY (`id`);
@@ -0,0 +1,12 @@
+-- retention.py finds the newest primary key of the rows to prune by the row time
+ALTER TABLE `mbr_stats_messages`
+    ADD INDEX `idx_at` (`at`);
+
+ALTER TABLE `mbr_stats_reactions`
+    ADD INDEX `idx_at` (`at`);
+
+ALTER TABLE `mbr_stats_presence`
+    ADD INDEX `idx_ended_at` (`ended_at`);
+
+ALTER TABLE `twitch_stat`
+    ADD INDEX `idx_at` (`at`);
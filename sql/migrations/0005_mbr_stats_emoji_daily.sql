@@ -0,0 +1,10 @@
+-- Per member daily reactions sent by emoji, maintained by modules/member_stats.py for the /profile top emojis
+CREATE TABLE `mbr_stats_emoji_daily` (
+    `guild_id` BIGINT(20) UNSIGNED NOT NULL,
+    `user_id` BIGINT(20) UNSIGNED NOT NULL,
+    `day` INT UNSIGNED NOT NULL,  -- days since the unix epoch (UTC)
+    `emoji` VARCHAR(191) NOT NULL COLLATE utf8mb4_unicode_520_ci,  -- emojis are counted by name
+    `emoji_id` BIGINT(20) UNSIGNED,
+    `reactions` INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (`guild_id`, `user_id`, `day`, `emoji`)
+);
@@ -0,0 +1,21 @@
+-- /profile counts
+CREATE INDEX `mbr_stats_messages_guild_user_at` ON `mbr_stats_messages` (`guild_id`, `user_id`, `at`);
+CREATE INDEX `mbr_stats_messages_guild_reply_to_user_at` ON `mbr_stats_messages` (`guild_id`, `reply_to_user`, `at`);
+
+CREATE INDEX `mbr_stats_reactions_guild_user_at` ON `mbr_stats_reactions` (`guild_id`, `user_id`, `at`);
+CREATE INDEX `mbr_stats_reactions_guild_message_author_at` ON `mbr_stats_reactions` (`guild_id`, `message_author_id`, `at`);
+CREATE INDEX `mbr_stats_reactions_message_user` ON `mbr_stats_reactions` (`message_id`, `user_id`);  -- reaction remove
+
+CREATE INDEX `mbr_stats_presence_guild_user_started_at` ON `mbr_stats_presence` (`guild_id`, `user_id`, `started_at`);
+
+-- isolator expiry check and case lookups
+CREATE INDEX `isolator_active_at` ON `isolator` (`is_active`, `at`);
+CREATE INDEX `isolator_guild_user_active` ON `isolator` (`guild_id`, `user_id`, `is_active`);
+
+CREATE INDEX `oauth_user_api_token` ON `oauth_user` (`api_token`);
+
+CREATE INDEX `oauth_user_guilds_user` ON `oauth_user_guilds` (`user_id`);
+
+CREATE INDEX `twitch_streams_is_live` ON `twitch_streams` (`is_live`);
+
+CREATE INDEX `twitch_stat_stream` ON `twitch_stat` (`stream_id`);
@@ -0,0 +1,15 @@
+-- Per member daily stats rollups, maintained by modules/member_stats.py
+CREATE TABLE `mbr_stats_daily` (
+    `guild_id` INTEGER NOT NULL,
+    `user_id` INTEGER NOT NULL,
+    `day` INTEGER NOT NULL,  -- days since the unix epoch (UTC)
+    `messages` INTEGER NOT NULL DEFAULT 0,
+    `replies` INTEGER NOT NULL DEFAULT 0,  -- replies received from other members
+    `reactions_sent` INTEGER NOT NULL DEFAULT 0,
+    `reactions_recv` INTEGER NOT NULL DEFAULT 0,
+    `online` INTEGER NOT NULL DEFAULT 0,  -- presence status durations in seconds, by the day the status started at
+    `idle` INTEGER NOT NULL DEFAULT 0,
+    `dnd` INTEGER NOT NULL DEFAULT 0,
+    `offline` INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (`guild_id`, `user_id`, `day`)
+);
@@ -0,0 +1,46 @@
+-- Auto increment primary keys for the raw stats tables, retention.py prunes them in primary key order.
+-- SQLite can not add a primary key to an existing table, so the tables are rebuilt.
+CREATE TABLE `mbr_stats_reactions_new` (
+    `id` INTEGER PRIMARY KEY,
+    `guild_id` INTEGER NOT NULL,
+    `message_id` INTEGER NOT NULL,
+    `message_author_id` INTEGER NOT NULL,
+    `user_id` INTEGER NOT NULL,
+    `emoji` TEXT,
+    `emoji_id` INTEGER,
+    `at` INTEGER NOT NULL
+);
+INSERT INTO `mbr_stats_reactions_new` (`guild_id`, `message_id`, `message_author_id`, `user_id`, `emoji`, `emoji_id`, `at`)
+    SELECT `guild_id`, `message_id`, `message_author_id`, `user_id`, `emoji`, `emoji_id`, `at` FROM `mbr_stats_reactions` ORDER BY `rowid`;
+DROP TABLE `mbr_stats_reactions`;
+ALTER TABLE `mbr_stats_reactions_new` RENAME TO `mbr_stats_reactions`;
+CREATE INDEX `mbr_stats_reactions_guild_user_at` ON `mbr_stats_reactions` (`guild_id`, `user_id`, `at`);
+CREATE INDEX `mbr_stats_reactions_guild_message_author_at` ON `mbr_stats_reactions` (`guild_id`, `message_author_id`, `at`);
+CREATE INDEX `mbr_stats_reactions_message_user` ON `mbr_stats_reactions` (`message_id`, `user_id`);
+
+CREATE TABLE `mbr_stats_presence_new` (
+    `id` INTEGER PRIMARY KEY,
+    `guild_id` INTEGER NOT NULL,
+    `user_id` INTEGER NOT NULL,
+    `status` TEXT NOT NULL,
+    `started_at` INTEGER NOT NULL,
+    `ended_at` INTEGER NOT NULL,
+    `duration` INTEGER NOT NULL
+);
+INSERT INTO `mbr_stats_presence_new` (`guild_id`, `user_id`, `status`, `started_at`, `ended_at`, `duration`)
+    SELECT `guild_id`, `user_id`, `status`, `started_at`, `ended_at`, `duration` FROM `mbr_stats_presence` ORDER BY `rowid`;
+DROP TABLE `mbr_stats_presence`;
+ALTER TABLE `mbr_stats_presence_new` RENAME TO `mbr_stats_presence`;
+CREATE INDEX `mbr_stats_presence_guild_user_started_at` ON `mbr_stats_presence` (`guild_id`, `user_id`, `started_at`);
+
+CREATE TABLE `twitch_stat_new` (
+    `id` INTEGER PRIMARY KEY,
+    `stream_id` INTEGER NOT NULL,
+    `viewer_count` INTEGER NOT NULL,
+    `at` INTEGER NOT NULL
+);
+INSERT INTO `twitch_stat_new` (`stream_id`, `viewer_count`, `at`)
+    SELECT `stream_id`, `viewer_count`, `at` FROM `twitch_stat` ORDER BY `rowid`;
+DROP TABLE `twitch_stat`;
+ALTER TABLE `twitch_stat_new` RENAME TO `twitch_stat`;
+CREATE INDEX `twitch_stat_stream` ON `twitch_stat` (`stream_id`);
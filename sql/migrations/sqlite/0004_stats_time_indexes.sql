@@ -0,0 +1,5 @@
+-- retention.py finds the newest primary key of the rows to prune by the row time
+CREATE INDEX `mbr_stats_messages_at` ON `mbr_stats_messages` (`at`);
+CREATE INDEX `mbr_stats_reactions_at` ON `mbr_stats_reactions` (`at`);
+CREATE INDEX `mbr_stats_presence_ended_at` ON `mbr_stats_presence` (`ended_at`);
+CREATE INDEX `twitch_stat_at` ON `twitch_stat` (`at`);
@@ -0,0 +1,10 @@
+-- Per member daily reactions sent by emoji, maintained by modules/member_stats.py for the /profile top emojis
+CREATE TABLE `mbr_stats_emoji_daily` (
+    `guild_id` INTEGER NOT NULL,
+    `user_id` INTEGER NOT NULL,
+    `day` INTEGER NOT NULL,  -- days since the unix epoch (UTC)
+    `emoji` TEXT NOT NULL COLLATE NOCASE,  -- emojis are counted by name
+    `emoji_id` INTEGER,
+    `reactions` INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (`guild_id`, `user_id`, `day`, `emoji`)
+);
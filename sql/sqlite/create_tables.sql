@@ -0,0 +1,121 @@
+-- SQLite version of create_tables.sql for DB_BACKEND = 'sqlite', apply with:
+--     sqlite3 lunodog.db < sql/sqlite/create_tables.sql
+-- case_id INTEGER PRIMARY KEY is an alias of the rowid, so it is auto incremented like in mysql
+
+CREATE TABLE `guild_config` (
+  `p_key` INTEGER NOT NULL,
+  `f_key` INTEGER,
+  `name` TEXT,
+  `cfg` TEXT NOT NULL,
+  PRIMARY KEY (`p_key`)
+);
+
+CREATE TABLE `oauth_user` (
+    `user_id` INTEGER NOT NULL,
+    `api_token` TEXT,
+    `username` TEXT,
+    `discriminator` TEXT,
+    `avatar` TEXT,
+    `access_token` TEXT,
+    `refresh_token` TEXT,
+    `expires_at` INTEGER NOT NULL,
+    PRIMARY KEY (`user_id`)
+);
+
+CREATE TABLE `oauth_user_guilds` (
+    `user_id` INTEGER NOT NULL,
+    `guild_id` INTEGER NOT NULL
+ );
+
+CREATE TABLE `greetings` (
+  `guild_id` INTEGER NOT NULL,
+  `user_id` INTEGER NOT NULL,
+  `visit_count` INTEGER NOT NULL DEFAULT 0,
+  PRIMARY KEY (`guild_id`, `user_id`)
+);
+
+CREATE TABLE `mbr_stats_messages` (
+    `guild_id` INTEGER NOT NULL,
+    `channel_id` INTEGER NOT NULL,
+    `message_id` INTEGER NOT NULL,
+    `user_id` INTEGER NOT NULL,
+    `reply_to` INTEGER,
+    `reply_to_user` INTEGER,
+    `at` INTEGER NOT NULL,
+    PRIMARY KEY (`message_id`)
+);
+
+CREATE TABLE `mbr_stats_reactions` (
+    `guild_id` INTEGER NOT NULL,
+    `message_id` INTEGER NOT NULL,
+    `message_author_id` INTEGER NOT NULL,
+    `user_id` INTEGER NOT NULL,
+    `emoji` TEXT,
+    `emoji_id` INTEGER,
+    `at` INTEGER NOT NULL
+);
+
+CREATE TABLE `mbr_stats_presence` (
+    `guild_id` INTEGER NOT NULL,
+    `user_id` INTEGER NOT NULL,
+    `status` TEXT NOT NULL,
+    `started_at` INTEGER NOT NULL,
+    `ended_at` INTEGER NOT NULL,
+    `duration` INTEGER NOT NULL
+);
+
+CREATE TABLE `mbr_stats_last_logoff` (
+    `guild_id` INTEGER NOT NULL,
+    `user_id` INTEGER NOT NULL,
+    `at` INTEGER NOT NULL,
+    PRIMARY KEY (`guild_id`, `user_id`)
+);
+
+CREATE TABLE `isolator` (
+    `case_id` INTEGER NOT NULL,
+    `guild_id` INTEGER NOT NULL,
+    `is_active` INTEGER NOT NULL DEFAULT 1,
+    `is_muted` INTEGER NOT NULL DEFAULT 0,
+    `user_id` INTEGER NOT NULL,
+    `username` TEXT NOT NULL,
+    `name` TEXT,
+    `at` INTEGER NOT NULL,
+    `duration` INTEGER NOT NULL,
+    `author_id` INTEGER NOT NULL,
+    `author_username` TEXT NOT NULL,
+    `reason` TEXT,
+    PRIMARY KEY (`case_id`)
+);
+
+CREATE TABLE `twitch_streams` (
+    `stream_id` INTEGER NOT NULL,
+    `user_id` INTEGER NOT NULL,
+    `user_name` TEXT NOT NULL,
+    `user_avatar` TEXT NOT NULL,
+    `game_name` TEXT NOT NULL,
+    `game_thumbnail` TEXT NOT NULL,
+    `title` TEXT NOT NULL,
+    `started_at` INTEGER NOT NULL,
+    `ended_at` INTEGER,
+    `is_live` INTEGER NOT NULL DEFAULT 1,
+    `thumbnail` TEXT,
+    `viewer_count` INTEGER NOT NULL,
+    PRIMARY KEY (`stream_id`)
+);
+
+CREATE TABLE `twitch_stat` (
+    `stream_id` INTEGER NOT NULL,
+    `viewer_count` INTEGER NOT NULL,
+    `at` INTEGER NOT NULL
+);
+
+CREATE TABLE `yt_known_channels` (
+    `channel` TEXT NOT NULL,
+    PRIMARY KEY (`channel`)
+);
+
+CREATE TABLE `yt_known_videos` (
+    `channel` TEXT NOT NULL,
+    `video_id` TEXT NOT NULL,
+    `video_type` TEXT NOT NULL
+);